@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+#-------------------------------------------------------------------------
+# FILE:             benchmark.py
+# DESCRIPTION:      Offline benchmark of the controller's hot paths
+#-------------------------------------------------------------------------
+"""
+Drives SizeBasedDynamicDmzSwitch with fake connections and synthetic or
+recorded traffic, without a switch or a running POX.
+
+    ./benchmark.py --switches 4 --flows 10000 --churn 0.05 --save new.json
+    ./benchmark.py --replay trace.jsonl --baseline old.json
+
+Each run reports flow stats processing time per cycle, packet-in handling
+rate, flow_mods written and peak memory. With --workers, flow stats are
+processed in that many worker processes, and flow_stats_ms only covers
+the POX thread's share; flow_stats_entries_per_sec is what the slower of
+the POX thread and the busiest worker could sustain. As in the
+controller, the packet-in storm limiter is off unless --packet-in-rate is
+given; the packet-ins it limits are counted in packet_ins_limited. The
+fake connections are the ones the tests use. --save writes the report as
+JSON; --baseline compares against a saved report and exits with status 1
+if anything got more than --tolerance worse.
+
+Traces are JSON lines, one record per event:
+
+    {"type": "packet_in", "dpid": 1, "flow": [src, dst, sport, dport, in_port]}
+    {"type": "flow_stats", "dpid": 1,
+     "flows": [[src, dst, sport, dport, in_port, byte_count, duration], ...]}
+
+--record writes the run's events in this format so it can be replayed.
+"""
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import os
+import sys
+
+# POX is a submodule; let this run from a plain checkout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'pox'))
+
+import pox.core
+if pox.core.core is None:
+    pox.core.initialize()
+from pox.core import core
+from pox.lib.addresses import IPAddr, EthAddr
+from pox.openflow import FlowStatsReceived, PacketIn
+import pox.openflow.libopenflow_01 as of
+import pox.lib.packet as pkt
+
+import argparse
+from functools import partial
+import json
+import random
+import resource
+import threading
+import time
+
+import mymultiflow
+from estimators import make_estimator
+from tests.fakes import FakeConnection
+from timerwheel import TimerWheel
+from timeseries import MemoryBudget
+from metrics import ControllerMetrics
+from workers import StatsWorkerPool
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+DPI_PORT_NAME = 'dpi'
+DPI_PORT = 99
+HOST_PORTS = 8
+SWITCH_PORTS = [(DPI_PORT_NAME, DPI_PORT)] + \
+    [('eth%d' % (port,), port) for port in range(1, HOST_PORTS + 1)]
+# Synthetic rates, as fractions of the elephant threshold
+ELEPHANT_RATE = 2.0
+MOUSE_RATE = 0.01
+# (report key, True if bigger is better)
+REGRESSION_METRICS = (('flow_stats_ms.p50', False),
+                      ('flow_stats_entries_per_sec', True),
+                      ('flow_stats_ms.p99', False),
+                      ('packet_ins_per_sec', True),
+                      ('peak_rss_kb', False))
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class DeferredCalls(object):
+    """
+    Stands in for core.callLater and core.callDelayed, so that deferred
+    work (flow_mod flushes) runs between events on the benchmark thread
+    instead of racing it on the POX scheduler's. Worker results are
+    posted from other threads, so the calls are kept under a lock.
+    """
+
+    class Call(object):
+        def __init__(self, when, func, args, kw):
+            self.when = when
+            self.func = func
+            self.args = args
+            self.kw = kw
+            self.cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    def __init__(self):
+        self._calls = []
+        self._lock = threading.Lock()
+
+    def install(self):
+        core.callLater = self.call_later
+        core.callDelayed = self.call_delayed
+
+    def call_later(self, func, *args, **kw):
+        return self.call_delayed(0, func, *args, **kw)
+
+    def call_delayed(self, seconds, func, *args, **kw):
+        call = DeferredCalls.Call(time.time() + seconds, func, args, kw)
+        with self._lock:
+            self._calls.append(call)
+        return call
+
+    def run_due(self):
+        now = time.time()
+        with self._lock:
+            due = [call for call in self._calls if call.when <= now]
+            self._calls = [call for call in self._calls if call.when > now]
+        for call in due:
+            if not call.cancelled:
+                call.func(*call.args, **call.kw)
+
+
+class SyntheticWorkload(object):
+    """
+    Traffic for `switches` switches carrying `flows` TCP flows each.
+
+    A fraction `elephants` of the flows run at ELEPHANT_RATE times the
+    elephant threshold and the rest at MOUSE_RATE. Every cycle, a
+    fraction `churn` of each switch's flows end and are replaced by new
+    ones. Every new flow starts with a packet-in.
+    """
+
+    def __init__(self, switches, flows, churn, elephants, cycles, interval,
+                 seed):
+        self.switches = switches
+        self.flows = flows
+        self.churn = churn
+        self.elephants = elephants
+        self.cycles = cycles
+        self.interval = interval
+        self.seed = seed
+
+    def _new_flow(self, rng):
+        src = "10.%d.%d.%d" % (rng.randint(0, 255), rng.randint(0, 255),
+                                rng.randint(1, 254))
+        dst = "10.%d.%d.%d" % (rng.randint(0, 255), rng.randint(0, 255),
+                                rng.randint(1, 254))
+        rate = ELEPHANT_RATE if rng.random() < self.elephants else MOUSE_RATE
+        # [5-tuple, bytes/sec, byte count, duration]
+        return [[src, dst, rng.randint(1024, 65535), rng.choice((80, 443)),
+                 rng.randint(1, HOST_PORTS)],
+                rate * mymultiflow.THRESHOLD_BITS_PER_SEC / 8, 0, 0.0]
+
+    def records(self):
+        rng = random.Random(self.seed)
+        tables = {}
+        for dpid in range(1, self.switches + 1):
+            tables[dpid] = [self._new_flow(rng) for i in range(self.flows)]
+            for flow in tables[dpid]:
+                yield {'type': 'packet_in', 'dpid': dpid, 'flow': flow[0]}
+
+        replaced = int(round(self.churn * self.flows))
+        for cycle in range(self.cycles):
+            for dpid, table in sorted(tables.items()):
+                if cycle:
+                    for i in rng.sample(range(len(table)), replaced):
+                        table[i] = self._new_flow(rng)
+                        yield {'type': 'packet_in', 'dpid': dpid,
+                               'flow': table[i][0]}
+                for flow in table:
+                    flow[2] += int(flow[1] * self.interval)
+                    flow[3] += self.interval
+                yield {'type': 'flow_stats', 'dpid': dpid,
+                       'flows': [flow[0] + [flow[2], flow[3]]
+                                 for flow in table]}
+
+
+class Benchmark(object):
+    """
+    Feeds workload records to one switch object per dpid and times them.
+    """
+
+    def __init__(self, estimator, max_flows, flow_mod_rate, history_mb,
+                 workers=0):
+        self.deferred = DeferredCalls()
+        self.deferred.install()
+        new_estimator = partial(make_estimator, estimator,
+                                mymultiflow.RUNNING_AVERAGE_WINDOW,
+                                mymultiflow.EWMA_TIME_CONSTANT_SECS)
+        history_bytes = int(history_mb * 1024 * 1024)
+        self.pool = None
+        if workers:
+            self.pool = StatsWorkerPool(workers, new_estimator,
+                                        mymultiflow.compact_key_label,
+                                        history_bytes, core.callLater)
+        self.flow_states = mymultiflow.FlowStateRegistry(
+            new_estimator, MemoryBudget(history_bytes), self.pool)
+        self.timers = TimerWheel(mymultiflow.TIMER_WHEEL_TICK_SECS,
+                                 time.time())
+        self.max_flows = max_flows
+        self.flow_mod_rate = flow_mod_rate
+        self.metrics = ControllerMetrics()
+        self.switches = {}
+        self.flow_stats_times = []
+        self.flow_stats_entries = 0
+        self.packet_in_times = []
+
+    def _switch(self, dpid):
+        switch = self.switches.get(dpid)
+        if switch is None:
+            args = (FakeConnection(dpid, SWITCH_PORTS, keep=False), False,
+                    DPI_PORT_NAME, self.flow_states.get(dpid), self.max_flows,
+                    self.timers, self.flow_mod_rate, self.metrics)
+            if self.pool is None:
+                switch = mymultiflow.SizeBasedDynamicDmzSwitch(*args)
+            else:
+                switch = mymultiflow.PooledDmzSwitch(self.pool, *args)
+            self.switches[dpid] = switch
+        return switch
+
+    def _expire_timers(self):
+        for (dpid, key), action in self.timers.advance(time.time()):
+            self.switches[dpid].handle_timer(key, action)
+
+    def handle(self, record):
+        switch = self._switch(record['dpid'])
+        if record['type'] == 'packet_in':
+            event = packet_in_event(switch.connection, record['flow'])
+            start = time.time()
+            switch._handle_PacketIn(event)
+            self.packet_in_times.append(time.time() - start)
+            # The destination has answered by the time the flow is an
+            # elephant, so the switch knows where to reroute it
+            dst = record['flow'][1]
+            switch.macToPort[host_mac(dst)] = host_port(dst)
+        elif record['type'] == 'flow_stats':
+            event = flow_stats_event(switch.connection, record['flows'])
+            start = time.time()
+            switch.handle_flow_stats(event)
+            self.flow_stats_times.append(time.time() - start)
+            self.flow_stats_entries += len(record['flows'])
+        self.deferred.run_due()
+        self._expire_timers()
+
+    def run(self, records):
+        for record in records:
+            self.handle(record)
+        if self.pool is not None:
+            self.pool.wait()
+            self.deferred.run_due()
+        report = self.report()
+        if self.pool is not None:
+            self.pool.close()
+        return report
+
+    def report(self):
+        packet_in_secs = sum(self.packet_in_times)
+        connections = [switch.connection for switch in self.switches.values()]
+        queues = [switch.flow_mods for switch in self.switches.values()]
+        tables = [switch.flow_table for switch in self.switches.values()
+                  if switch.flow_table is not None]
+        # Stats processing is as fast as its slowest stage: the POX thread
+        # alone, or with workers, it or the busiest worker
+        worker_secs = self.pool.counters()['busy_seconds'] if self.pool \
+            else []
+        stats_secs = max([sum(self.flow_stats_times)] + worker_secs)
+        return {
+            'flow_stats_replies': len(self.flow_stats_times),
+            'flow_stats_ms': summarize(self.flow_stats_times, 1e3),
+            'packet_ins': len(self.packet_in_times),
+            'packet_in_us': summarize(self.packet_in_times, 1e6),
+            'packet_ins_per_sec': (len(self.packet_in_times) / packet_in_secs
+                                   if packet_in_secs else 0.0),
+            'packet_ins_limited': sum(switch.packet_ins_limited
+                                      for switch in self.switches.values()),
+            'flow_mods': sum(queue.written for queue in queues),
+            'flow_mods_merged': sum(queue.merged for queue in queues),
+            'flow_mods_queued': sum(queue.depth for queue in queues),
+            'messages_sent': sum(c.messages_sent for c in connections),
+            'bytes_sent': sum(c.bytes_sent for c in connections),
+            'flow_stats_entries_per_sec': (self.flow_stats_entries /
+                                           stats_secs if stats_secs else 0.0),
+            'worker_busy_secs': worker_secs,
+            'flows_tracked': sum(switch.flow_count()
+                                 for switch in self.switches.values()),
+            'flow_table_bytes': sum(table.memory_usage()[0]
+                                    for table in tables),
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+#-------------------------------------------------------------------------
+# FUNCTIONS
+#-------------------------------------------------------------------------
+
+
+def host_mac(ip):
+    return EthAddr("02:00:" + ":".join("%02x" % (int(octet),)
+                                       for octet in ip.split(".")))
+
+
+def host_port(ip):
+    return 1 + int(ip.split(".")[-1]) % HOST_PORTS
+
+
+def packet_in_event(connection, flow):
+    """ The PacketIn for the first packet of a TCP flow. """
+    src, dst, sport, dport, in_port = flow
+    segment = pkt.tcp(srcport=sport, dstport=dport, off=5)
+    packet = pkt.ipv4(srcip=IPAddr(str(src)), dstip=IPAddr(str(dst)),
+                      protocol=pkt.ipv4.TCP_PROTOCOL)
+    packet.payload = segment
+    frame = pkt.ethernet(src=host_mac(src), dst=host_mac(dst),
+                         type=pkt.ethernet.IP_TYPE)
+    frame.payload = packet
+    return PacketIn(connection, of.ofp_packet_in(
+        in_port=in_port, data=frame.pack(), reason=of.OFPR_NO_MATCH))
+
+
+def flow_stats_event(connection, flows):
+    """ A single-part flow stats reply with one entry per flow. """
+    stats = []
+    for src, dst, sport, dport, in_port, byte_count, duration in flows:
+        stats.append(of.ofp_flow_stats(
+            match=of.ofp_match(dl_dst=host_mac(str(dst)),
+                               dl_type=pkt.ethernet.IP_TYPE,
+                               nw_proto=pkt.ipv4.TCP_PROTOCOL,
+                               nw_src=IPAddr(str(src)),
+                               nw_dst=IPAddr(str(dst)),
+                               tp_src=sport, tp_dst=dport, in_port=in_port),
+            byte_count=byte_count, duration_sec=int(duration),
+            duration_nsec=int(duration % 1 * 1e9)))
+    reply = of.ofp_stats_reply(type=of.OFPST_FLOW, body=stats)
+    return FlowStatsReceived(connection, [reply], stats)
+
+
+def summarize(samples, scale):
+    if not samples:
+        return {'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+    ordered = sorted(samples)
+    return {'mean': scale * sum(ordered) / len(ordered),
+            'p50': scale * ordered[len(ordered) // 2],
+            'p99': scale * ordered[min(len(ordered) - 1,
+                                       int(len(ordered) * 0.99))],
+            'max': scale * ordered[-1]}
+
+
+def replay(path):
+    with open(path) as trace:
+        for line in trace:
+            if line.strip():
+                yield json.loads(line)
+
+
+def record(records, path):
+    with open(path, 'w') as trace:
+        for r in records:
+            trace.write(json.dumps(r) + "\n")
+            yield r
+
+
+def lookup(report, key):
+    for part in key.split('.'):
+        report = report[part]
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """ Returns a line for each metric more than tolerance worse. """
+    regressions = []
+    for key, bigger_is_better in REGRESSION_METRICS:
+        try:
+            old, new = lookup(baseline, key), lookup(report, key)
+        except KeyError:
+            # Saved before the metric was reported
+            continue
+        if not old:
+            continue
+        change = (new - old) / float(old)
+        if bigger_is_better:
+            change = -change
+        if change > tolerance:
+            regressions.append("%s: %g -> %g (%+.1f%%)" %
+                               (key, old, new, 100 * change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the controller's hot paths offline.")
+    parser.add_argument('--switches', type=int, default=1)
+    parser.add_argument('--flows', type=int, default=1000,
+                        help="flows per switch")
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help="fraction of flows replaced every cycle")
+    parser.add_argument('--elephants', type=float, default=0.01,
+                        help="fraction of flows above the threshold")
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--interval', type=float,
+                        default=mymultiflow.FLOW_STATS_INTERVAL_SECS,
+                        help="seconds of traffic per cycle")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--replay', metavar='TRACE',
+                        help="replay a recorded trace instead")
+    parser.add_argument('--record', metavar='TRACE',
+                        help="save this run's events as a trace")
+    parser.add_argument('--estimator', default=mymultiflow.RATE_ESTIMATOR)
+    parser.add_argument('--max-flows', type=int,
+                        default=mymultiflow.MAX_FLOWS_PER_SWITCH)
+    parser.add_argument('--flow-mod-rate', type=float,
+                        default=mymultiflow.MAX_FLOW_MODS_PER_SEC)
+    parser.add_argument('--packet-in-rate', type=float,
+                        help="packet-ins per second per port before the "
+                        "storm limiter takes over (off by default)")
+    parser.add_argument('--history-mb', type=float,
+                        default=mymultiflow.HISTORY_BUDGET_MB)
+    parser.add_argument('--save', metavar='REPORT')
+    parser.add_argument('--baseline', metavar='REPORT')
+    parser.add_argument('--workers', type=int, default=0,
+                        help="process flow stats in this many worker "
+                        "processes")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        workload = {'replay': args.replay}
+        records = replay(args.replay)
+    else:
+        workload = dict((name, getattr(args, name)) for name in
+                        ('switches', 'flows', 'churn', 'elephants', 'cycles',
+                         'interval', 'seed'))
+        records = SyntheticWorkload(**workload).records()
+    if args.record:
+        records = record(records, args.record)
+
+    mymultiflow._packet_in_rate = args.packet_in_rate
+    benchmark = Benchmark(args.estimator, args.max_flows, args.flow_mod_rate,
+                          args.history_mb, args.workers)
+    report = benchmark.run(records)
+    report['workload'] = workload
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION %s" % (line,))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
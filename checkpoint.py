@@ -0,0 +1,148 @@
+#-------------------------------------------------------------------------
+# FILE:             checkpoint.py
+# DESCRIPTION:      On-disk checkpoints of per-switch controller state
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from collections import OrderedDict
+import logging
+import numpy as np
+import os
+import threading
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# One learned MAC address
+MAC_RECORD = np.dtype([
+    ('mac', np.uint8, 6),
+    ('port', np.uint16),
+])
+
+# One tracked flow: its compact key, then what the flow table knew. Which
+# flows are in the DMZ is not kept; the switch's own rules say.
+FLOW_RECORD = np.dtype([
+    ('nw_src', np.uint32),
+    ('nw_dst', np.uint32),
+    ('tp_src', np.uint16),
+    ('tp_dst', np.uint16),
+    ('in_port', np.uint16),
+    ('total_bytes', np.uint64),
+    ('duration', np.float64),
+    ('last_time', np.float64),
+    ('rate', np.float64),
+    ('backoff', np.bool_),
+])
+
+#-------------------------------------------------------------------------
+# VARIABLES
+#-------------------------------------------------------------------------
+log = logging.getLogger('checkpoint')
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class CheckpointStore(object):
+    """
+    Per-switch state saved in a directory, as NumPy arrays of MAC_RECORD
+    and FLOW_RECORD: <dpid>-macs.npy and <dpid>-flows.npy.
+
+    Each file is written beside its final name and renamed over it, so a
+    crash mid-save leaves the previous checkpoint whole. Loading maps the
+    files into memory instead of reading them, so a restart only touches
+    the pages of the switches that reconnect.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, dpid, kind):
+        return os.path.join(self.directory, "%016x-%s.npy" % (dpid, kind))
+
+    def _write(self, path, records):
+        temporary = path + ".tmp"
+        with open(temporary, 'wb') as f:
+            np.save(f, records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary, path)
+
+    def save(self, dpid, macs, flows):
+        """ Replaces a switch's checkpoint with the given record arrays. """
+        self._write(self._path(dpid, 'macs'), macs)
+        self._write(self._path(dpid, 'flows'), flows)
+
+    def _read(self, path, dtype):
+        if not os.path.exists(path):
+            return np.zeros(0, dtype)
+        try:
+            records = np.load(path, mmap_mode='r')
+        except ValueError:
+            # An empty array has nothing to map
+            records = np.load(path)
+        if records.dtype != dtype:
+            # Written by a version with other fields
+            return np.zeros(0, dtype)
+        return records
+
+    def load(self, dpid):
+        """
+        Returns a switch's (macs, flows) record arrays, empty if it has
+        no checkpoint.
+        """
+        return (self._read(self._path(dpid, 'macs'), MAC_RECORD),
+                self._read(self._path(dpid, 'flows'), FLOW_RECORD))
+
+
+class CheckpointWriter(object):
+    """
+    Saves checkpoints to a CheckpointStore on a thread of its own, so the
+    POX thread never waits for the disk.
+
+    save() only queues a switch's record arrays, which must not change
+    afterwards; if the switch is still queued, the newer arrays replace
+    the older. close() writes whatever is left and stops the thread.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._queued = OrderedDict()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run,
+                                        name="checkpoint-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, dpid, macs, flows):
+        """ Queues a switch's checkpoint to be written. """
+        with self._condition:
+            self._queued[dpid] = (macs, flows)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queued and not self._closed:
+                    self._condition.wait()
+                if not self._queued:
+                    return
+                dpid, (macs, flows) = self._queued.popitem(last=False)
+            try:
+                self.store.save(dpid, macs, flows)
+            except (IOError, OSError) as e:
+                log.error("%016x: checkpoint failed: %s" % (dpid, e))
+
+    def close(self, timeout=None):
+        """ Writes the checkpoints still queued, then stops. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
@@ -0,0 +1,133 @@
+#-------------------------------------------------------------------------
+# FILE:             dashboard.py
+# DESCRIPTION:      Bandwidth feed behind the flow bandwidth dashboard
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from collections import deque
+import json
+import threading
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# Deltas kept for clients that fall behind; further back they get a snapshot.
+FEED_HISTORY = 16
+# Comment line sent on an idle stream so proxies keep it open.
+KEEPALIVE_SECS = 15
+# Flows shown on the dashboard; the rest are summed into OTHER_FLOWS.
+TOP_FLOWS = 10
+OTHER_FLOWS = 'other'
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class BandwidthFeed(object):
+    """
+    Publishes each stats cycle's flow bandwidths to dashboard clients.
+
+    The POX thread calls publish() once per cycle with a ranking of the
+    switch's flows. Clients are sent the top_flows fastest flows and the
+    rest summed as OTHER_FLOWS. Only what was added, changed or removed
+    from that view is serialized, as one server-sent event shared by every
+    client. A client that connects, or falls more than FEED_HISTORY cycles
+    behind, gets a full snapshot first. Snapshots are serialized at most
+    once per cycle, and only if someone asks for them.
+
+    Each cycle's (sequence, top, ranking) is never modified once it is
+    published, and it and its serialized forms are swapped in as single
+    attribute assignments, so snapshot readers never take a lock.
+    """
+
+    def __init__(self, top_flows=TOP_FLOWS):
+        self.top_flows = top_flows
+        self._published = (0, {}, None)
+        self._deltas = deque(maxlen=FEED_HISTORY)
+        self._snapshot = (None, None)
+        self._everything = (None, None)
+        self._condition = threading.Condition()
+
+    @property
+    def ranking(self):
+        """ The latest ranking, or None before the first cycle. """
+        return self._published[2]
+
+    def publish(self, ranking):
+        """
+        Publishes a ranking of every flow the switch has: anything with
+        len(), a total rate and top(n) returning [(flow, bits/sec)],
+        fastest first, such as a FlowRanking.
+        """
+        sequence, previous = self._published[:2]
+        top = dict((flow.label, rate)
+                   for flow, rate in ranking.top(self.top_flows))
+        if len(ranking) > len(top):
+            top[OTHER_FLOWS] = max(0.0, ranking.total - sum(top.values()))
+        changed = dict((label, rate) for label, rate in top.items()
+                       if previous.get(label) != rate)
+        removed = [label for label in previous if label not in top]
+        if not changed and not removed:
+            # Flows outside the top can still have changed
+            self._published = (sequence, previous, ranking)
+            return
+
+        sequence += 1
+        delta = self._event(sequence, 'delta',
+                            {'changed': changed, 'removed': removed})
+        with self._condition:
+            self._deltas.append((sequence, delta))
+            self._published = (sequence, top, ranking)
+            self._condition.notify_all()
+
+    def _event(self, sequence, name, data):
+        return "id: %d\nevent: %s\ndata: %s\n\n" % (
+            sequence, name, json.dumps(data))
+
+    def snapshot_json(self, everything=False):
+        """
+        Returns the latest sequence number and the flows clients are shown
+        as JSON, or every flow's bandwidth if everything is set.
+        """
+        sequence, top, ranking = self._published
+        if not everything:
+            snapshot = self._snapshot
+            if snapshot[0] is not top:
+                snapshot = self._snapshot = (top, json.dumps(top))
+        else:
+            snapshot = self._everything
+            if snapshot[0] is not ranking:
+                flows = ranking.top(len(ranking)) if ranking else []
+                snapshot = self._everything = (ranking, json.dumps(dict(
+                    (flow.label, rate) for flow, rate in flows)))
+        return sequence, snapshot[1]
+
+    def snapshot(self):
+        """ Returns the latest sequence number and its snapshot event. """
+        sequence, data = self.snapshot_json()
+        return sequence, "id: %d\nevent: snapshot\ndata: %s\n\n" % (
+            sequence, data)
+
+    def stream(self):
+        """ Yields the server-sent events for one client, forever. """
+        sequence, event = self.snapshot()
+        yield event
+        while True:
+            with self._condition:
+                if self._published[0] == sequence:
+                    self._condition.wait(KEEPALIVE_SECS)
+                pending = [delta for delta in self._deltas
+                           if delta[0] > sequence]
+
+            if not pending:
+                yield ": keepalive\n\n"
+            elif pending[0][0] != sequence + 1:
+                sequence, event = self.snapshot()
+                yield event
+            else:
+                for sequence, event in pending:
+                    yield event
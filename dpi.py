@@ -0,0 +1,149 @@
+#-------------------------------------------------------------------------
+# FILE:             dpi.py
+# DESCRIPTION:      Flow assignment across several DPI appliances
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from bisect import bisect
+import hashlib
+import struct
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# Points on the ring per unit of weight; more spread flows more evenly.
+POINTS_PER_WEIGHT = 64
+# How far load can push a port's share away from its configured weight
+MIN_WEIGHT_SCALE = 0.25
+MAX_WEIGHT_SCALE = 4.0
+# Past this fraction of the DPI capacity, the elephant threshold drops
+TARGET_UTILIZATION = 0.8
+# How much the threshold moves per rebalance
+THRESHOLD_STEP = 0.9
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def parse_dpi_ports(spec):
+    """
+    Turns 'eth1:2,eth2' into [('eth1', 2.0), ('eth2', 1.0)]: each DPI
+    port's name and capacity weight, 1 if not given.
+    """
+    ports = []
+    for item in str(spec).split(','):
+        name, _, weight = item.strip().partition(':')
+        weight = float(weight) if weight else 1.0
+        if not name or weight <= 0 or name in [n for n, w in ports]:
+            raise ValueError("Bad DPI port %r" % (item,))
+        ports.append((name, weight))
+    return ports
+
+
+def _hash(text):
+    return struct.unpack('>Q', hashlib.md5(text.encode()).digest()[:8])[0]
+
+
+def flow_hash(match):
+    """
+    Hashes a match's 5-tuple, the same way in both directions so a
+    connection's two halves meet at one DPI. Matches without one, like
+    per-MAC rules, hash their MAC addresses instead.
+    """
+    if match.nw_src is None and match.nw_dst is None:
+        ends = sorted((str(match.dl_src), str(match.dl_dst)))
+        return _hash("%s %s" % tuple(ends))
+    ends = sorted([(str(match.nw_src), match.tp_src),
+                   (str(match.nw_dst), match.tp_dst)])
+    return _hash("%s:%s %s:%s %s" % (ends[0] + ends[1] + (match.nw_proto,)))
+
+
+class DpiRing(object):
+    """
+    A weighted consistent-hash ring over a switch's DPI ports.
+
+    Each port owns points on the ring in proportion to its weight, and a
+    flow goes to the owner of the first point at or after its hash. A
+    port's share only changes by adding or taking away its own points,
+    so reweighting moves the fewest flows, and only between that port
+    and the others. Flows already placed keep their port anyway: the
+    switch remembers it per flow.
+
+    rebalance() scales each port's weight by how loaded it was, per unit
+    of weight, against the others. Weights are only relative shares.
+    Given the capacity of one DPI port, it also tracks how much of the
+    threshold to use (threshold()).
+    """
+
+    def __init__(self, ports):
+        self.names = [name for name, weight in ports]
+        self.weights = [weight for name, weight in ports]
+        self.scales = [1.0] * len(ports)
+        self.headroom = 1.0
+        self._points = None
+        self._build()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _counts(self):
+        return [max(1, int(round(POINTS_PER_WEIGHT * weight * scale)))
+                for weight, scale in zip(self.weights, self.scales)]
+
+    def _build(self):
+        counts = self._counts()
+        if counts == self._points:
+            return False
+        self._points = counts
+        ring = sorted((_hash("%s#%d" % (name, i)), index)
+                      for index, (name, count) in
+                      enumerate(zip(self.names, counts))
+                      for i in range(count))
+        self._hashes = [point for point, index in ring]
+        self._owners = [index for point, index in ring]
+        return True
+
+    def lookup(self, match):
+        """ Returns the index of the port a match's flow belongs to. """
+        if len(self.names) == 1:
+            return 0
+        i = bisect(self._hashes, flow_hash(match))
+        return self._owners[i % len(self._owners)]
+
+    def rebalance(self, loads, capacity=None):
+        """
+        Takes each port's measured load in bits/sec, in port order.
+        Returns whether the ring changed.
+        """
+        total = float(sum(loads))
+        if total <= 0:
+            return False
+        mean = total / sum(self.weights)
+        for i, (load, weight) in enumerate(zip(loads, self.weights)):
+            # Halfway there each time, so the ring does not oscillate
+            ratio = mean / (load / weight) if load > 0 else MAX_WEIGHT_SCALE
+            self.scales[i] = min(MAX_WEIGHT_SCALE, max(
+                MIN_WEIGHT_SCALE, self.scales[i] * ratio ** 0.5))
+
+        if capacity:
+            utilization = total / (capacity * len(self.names))
+            if utilization > TARGET_UTILIZATION:
+                self.headroom *= THRESHOLD_STEP
+            elif utilization < TARGET_UTILIZATION * THRESHOLD_STEP:
+                self.headroom /= THRESHOLD_STEP
+            self.headroom = min(1.0, max(1.0 / len(self.names),
+                                         self.headroom))
+        return self._build()
+
+    def threshold(self, base):
+        """
+        The elephant threshold for a switch whose one-DPI threshold is
+        base: each extra DPI port lets flows that much faster stay
+        inspected, less what the DPIs have no room for. It never drops
+        below base.
+        """
+        return base * len(self.names) * self.headroom
@@ -0,0 +1,109 @@
+#-------------------------------------------------------------------------
+# FILE:             estimators.py
+# DESCRIPTION:      Vectorized flow rate estimators for FlowTable
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import numpy as np
+
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class SlidingWindowEstimator(object):
+    """
+    Average rate over the last `window` samples of each flow.
+
+    Each row keeps a fixed-size ring of (bytes, seconds) samples, and the
+    rate is the bytes in the ring over the time they took, so samples
+    taken at uneven intervals are weighted correctly.
+    """
+
+    def __init__(self, window=1):
+        self.window = window
+        self._bytes = np.zeros((0, window))
+        self._seconds = np.zeros((0, window))
+        self._cursor = np.zeros(0, np.int32)
+
+    @property
+    def nbytes(self):
+        return self._bytes.nbytes + self._seconds.nbytes + self._cursor.nbytes
+
+    def resize(self, capacity):
+        size = len(self._cursor)
+        for name in ('_bytes', '_seconds'):
+            ring = np.zeros((capacity, self.window))
+            ring[:size] = getattr(self, name)
+            setattr(self, name, ring)
+        cursor = np.zeros(capacity, np.int32)
+        cursor[:size] = self._cursor
+        self._cursor = cursor
+
+    def reset(self, rows):
+        self._bytes[rows] = 0
+        self._seconds[rows] = 0
+        self._cursor[rows] = 0
+
+    def add(self, rows, byte_deltas, elapsed):
+        """ Records one sample per row and returns the rows' rates. """
+        cursor = self._cursor[rows]
+        self._bytes[rows, cursor] = byte_deltas
+        self._seconds[rows, cursor] = elapsed
+        self._cursor[rows] = (cursor + 1) % self.window
+        return 8 * self._bytes[rows].sum(axis=1) / \
+            self._seconds[rows].sum(axis=1)
+
+
+class EwmaEstimator(object):
+    """
+    Exponentially weighted moving average of each flow's rate.
+
+    The weight of a sample depends on how long it covers, so the average
+    decays with a fixed time constant whatever the poll interval is.
+    """
+
+    def __init__(self, time_constant):
+        self.time_constant = float(time_constant)
+        self._rate = np.zeros(0)
+        self._primed = np.zeros(0, np.bool_)
+
+    @property
+    def nbytes(self):
+        return self._rate.nbytes + self._primed.nbytes
+
+    def resize(self, capacity):
+        size = len(self._rate)
+        rate = np.zeros(capacity)
+        rate[:size] = self._rate
+        primed = np.zeros(capacity, np.bool_)
+        primed[:size] = self._primed
+        self._rate = rate
+        self._primed = primed
+
+    def reset(self, rows):
+        self._rate[rows] = 0
+        self._primed[rows] = False
+
+    def add(self, rows, byte_deltas, elapsed):
+        """ Records one sample per row and returns the rows' rates. """
+        sample = 8 * byte_deltas / elapsed
+        alpha = np.where(self._primed[rows],
+                         1 - np.exp(-elapsed / self.time_constant), 1.0)
+        rate = self._rate[rows]
+        rate += alpha * (sample - rate)
+        self._rate[rows] = rate
+        self._primed[rows] = True
+        return rate
+
+
+def make_estimator(name, window, time_constant):
+    """ Builds the estimator selected on the command line. """
+    if name == 'window':
+        return SlidingWindowEstimator(window)
+    if name == 'ewma':
+        return EwmaEstimator(time_constant)
+    raise RuntimeError("Unknown rate estimator '%s'" % (name,))
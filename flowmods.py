@@ -0,0 +1,135 @@
+#-------------------------------------------------------------------------
+# FILE:             flowmods.py
+# DESCRIPTION:      Batched, rate-limited flow_mod pipeline per switch
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from pox.core import core
+from pox.lib.util import dpid_to_str
+import pox.openflow.libopenflow_01 as of
+from ratelimit import TokenBucket
+from collections import OrderedDict
+import itertools
+import time
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# A barrier not answered by then is taken as lost and forgotten.
+BARRIER_TIMEOUT_SECS = 10
+
+#-------------------------------------------------------------------------
+# VARIABLES
+#-------------------------------------------------------------------------
+log = core.getLogger()
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class FlowModQueue(object):
+    """
+    Outbound flow_mod queue for one connection.
+
+    Messages queued during one turn of the event loop are packed into a
+    single write followed by a barrier request, so the barrier reply tells
+    when they have all taken effect. A MODIFY replaces any MODIFY still
+    queued for the same match, and no more than `rate` flow_mods per
+    second are written; the rest wait for the next flush. Barriers that
+    go unanswered, and whatever is queued when the connection goes down,
+    are dropped.
+    """
+
+    MODIFY_COMMANDS = (of.OFPFC_MODIFY, of.OFPFC_MODIFY_STRICT)
+
+    def __init__(self, connection, rate):
+        self.connection = connection
+        self.bucket = TokenBucket(rate)
+        self.merged = 0
+        self.written = 0
+        self.barrier_latency = None
+        self._pending = OrderedDict()
+        self._barriers = OrderedDict()
+        self._sequence = itertools.count()
+        self._flush_timer = None
+        # core.callLater() returns no handle, so a flag stops it being
+        # called once per queued message
+        self._flush_soon = False
+
+        connection.addListenerByName("BarrierIn", self._handle_BarrierIn)
+        connection.addListenerByName("ConnectionDown",
+                                     self._handle_ConnectionDown)
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def send(self, msg):
+        """ Queues a flow_mod to go out on the next flush. """
+        if msg.command in FlowModQueue.MODIFY_COMMANDS:
+            key = (msg.command, msg.match.pack())
+            if self._pending.pop(key, None) is not None:
+                self.merged += 1
+        else:
+            key = next(self._sequence)
+        self._pending[key] = msg
+
+        if self._flush_timer is None and not self._flush_soon:
+            self._flush_soon = True
+            core.callLater(self.flush)
+
+    def flush(self):
+        """ Writes as much of the queue as the rate budget allows. """
+        self._flush_soon = False
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._pending:
+            return
+
+        count = self.bucket.take(len(self._pending))
+        if count:
+            batch = [self._pending.popitem(last=False)[1]
+                     for i in range(count)]
+            now = time.time()
+            self._expire_barriers(now)
+            barrier = of.ofp_barrier_request()
+            self._barriers[barrier.xid] = (now, count)
+            self.connection.send(
+                b''.join(msg.pack() for msg in batch) + barrier.pack())
+            self.written += count
+
+        if self._pending:
+            self._flush_timer = core.callDelayed(
+                self.bucket.wait_time(), self.flush)
+
+    def _expire_barriers(self, now):
+        """ Forgets barriers the switch never answered. """
+        while self._barriers:
+            xid, (sent, count) = next(iter(self._barriers.items()))
+            if now - sent < BARRIER_TIMEOUT_SECS:
+                break
+            del self._barriers[xid]
+            log.debug("%s: no reply to the barrier after %d flow_mods" %
+                      (dpid_to_str(self.connection.dpid), count))
+
+    def _handle_ConnectionDown(self, event):
+        """ Drops everything meant for the connection that went away. """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        self._pending.clear()
+        self._barriers.clear()
+
+    def _handle_BarrierIn(self, event):
+        barrier = self._barriers.pop(event.xid, None)
+        if barrier is None:
+            return
+        self.barrier_latency = time.time() - barrier[0]
+        log.debug("%s: %d flow_mods in effect after %.1f ms, %d queued" %
+                  (dpid_to_str(self.connection.dpid), barrier[1],
+                   self.barrier_latency * 1000, self.depth))
@@ -0,0 +1,369 @@
+#-------------------------------------------------------------------------
+# FILE:             flowtable.py
+# DESCRIPTION:      Array-backed flow store for the Dynamic DMZ controller
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from policy import Policy
+import numpy as np
+import sys
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+INITIAL_CAPACITY = 1024
+COUNTER_32_BIT_LIMIT = 2 ** 32
+COUNTER_64_BIT_LIMIT = 2 ** 64
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def address_value(address):
+    """ An IP address from a flow key as an integer, 0 if wildcarded. """
+    if address is None:
+        return 0
+    if hasattr(address, 'toUnsigned'):
+        return address.toUnsigned()
+    return address
+
+
+class FlowTable(object):
+    """
+    Flow state for one switch, one NumPy column per field.
+
+    Keys map to rows through a dict; everything numeric lives in the
+    columns so that a whole stats reply can be folded in and classified
+    with a handful of array operations. Only the rows whose DMZ state
+    changes are handed back to Python. Rows freed by removal are reused
+    before the columns grow.
+    """
+
+    COLUMNS = (
+        ('live', np.bool_),
+        ('missed', np.uint16),
+        ('total_bytes', np.uint64),
+        ('duration', np.float64),
+        ('last_time', np.float64),
+        ('rate', np.float64),
+        ('in_port', np.int32),
+        ('in_dmz', np.bool_),
+        ('backoff', np.bool_),
+        ('nw_src', np.uint32),
+        ('nw_dst', np.uint32),
+        # The policy rules a flow's addresses match; 0 until looked up
+        ('rules', np.uint64),
+        # When the flow last entered or left the DMZ
+        ('changed', np.float64),
+        # Whether the latest sample was above the plain threshold
+        ('above', np.bool_),
+    )
+
+    def __init__(self, estimator, capacity=INITIAL_CAPACITY, policy=None):
+        self.index = {}
+        self.keys = []
+        self.flows = []
+        self.size = 0
+        self._free = []
+        self.capacity = capacity
+        self.estimator = estimator
+        # Without a policy, one threshold both ways and no dwell time
+        self.policy = policy or Policy(up=1.0, down=1.0, dwell=0.0)
+        for name, dtype in FlowTable.COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype))
+        estimator.resize(capacity)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, dtype in FlowTable.COLUMNS:
+            column = np.zeros(self.capacity, dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.estimator.resize(self.capacity)
+
+    def add(self, key, flow):
+        """ Allocates a row for a new flow and returns it. """
+        if key in self.index:
+            return self.index[key]
+        if self._free:
+            row = self._free.pop()
+            self.keys[row] = key
+            self.flows[row] = flow
+        else:
+            if self.size == self.capacity:
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.keys.append(key)
+            self.flows.append(flow)
+        self.index[key] = row
+        self.live[row] = True
+        self.in_port[row] = key[4] if key[4] is not None else -1
+        self.nw_src[row] = address_value(key[0])
+        self.nw_dst[row] = address_value(key[1])
+        return row
+
+    def remove(self, rows):
+        """ Forgets the flows in the given rows and returns their keys. """
+        keys = []
+        for row in rows:
+            key = self.keys[row]
+            del self.index[key]
+            keys.append(key)
+            self.keys[row] = None
+            self.flows[row] = None
+            self._free.append(row)
+        for name, dtype in FlowTable.COLUMNS:
+            getattr(self, name)[rows] = 0
+        self.estimator.reset(rows)
+        return keys
+
+    def age(self, seen_rows, max_missed):
+        """
+        Ages out flows missing from a full stats reply.
+
+        Flows absent from max_missed full replies in a row are no longer on
+        the switch; their rows are removed and their keys returned.
+        """
+        absent = self.live[:self.size].copy()
+        absent[seen_rows] = False
+        self.missed[seen_rows] = 0
+        self.missed[:self.size][absent] += 1
+        return self.remove(np.flatnonzero(
+            absent & (self.missed[:self.size] >= max_missed)))
+
+    def evict(self, max_flows):
+        """
+        Removes the least recently seen flows above max_flows and returns
+        their keys. Flows in the DMZ are evicted last.
+        """
+        excess = len(self) - max_flows
+        if excess <= 0:
+            return []
+        candidates = np.flatnonzero(self.live[:self.size])
+        last_seen = np.where(self.in_dmz[candidates], np.inf,
+                             self.last_time[candidates])
+        oldest = np.argpartition(last_seen, excess - 1)[:excess]
+        return self.remove(candidates[oldest])
+
+    def memory_usage(self):
+        """
+        Returns the table's approximate footprint in bytes and what each
+        tracked flow adds to it, not counting rows allocated but unused.
+        """
+        arrays = self.estimator.nbytes + sum(
+            getattr(self, name).nbytes for name, dtype in FlowTable.COLUMNS)
+        containers = sys.getsizeof(self.index) + sys.getsizeof(self.keys) + \
+            sys.getsizeof(self.flows) + sys.getsizeof(self._free)
+        records = 0
+        for key in self.index:
+            flow = self.flows[self.index[key]]
+            records = len(self) * (sys.getsizeof(key) + sys.getsizeof(flow))
+            break
+        per_flow = arrays // self.capacity + \
+            (containers + records) // max(1, len(self))
+        return arrays + containers + records, per_flow
+
+    def lookup(self, keys):
+        """ Returns the row of every key, or -1 where the key is unknown. """
+        get = self.index.get
+        return np.array([get(key, -1) for key in keys], np.intp)
+
+    def update(self, rows, byte_counts, durations, now):
+        """
+        Folds new byte counters into the given rows and returns their rates
+        in bits per second.
+
+        The time between samples comes from the switch's own entry
+        durations, falling back to receive timestamps for switches that
+        leave them at zero. An entry whose duration went backwards was
+        reinstalled and its counter restarted from zero; a counter that
+        went backwards while its entry kept ageing has wrapped.
+        """
+        previous_bytes = self.total_bytes[rows]
+        previous_duration = self.duration[rows]
+        seen = self.last_time[rows] > 0
+        went_back = byte_counts < previous_bytes
+        reset = seen & ((durations < previous_duration) |
+                        (went_back & (durations == 0)))
+        wrapped = seen & ~reset & went_back
+        restart = ~seen | reset
+
+        byte_deltas = byte_counts.astype(np.float64) - previous_bytes
+        byte_deltas[wrapped] += np.where(
+            previous_bytes[wrapped] < COUNTER_32_BIT_LIMIT,
+            float(COUNTER_32_BIT_LIMIT), float(COUNTER_64_BIT_LIMIT))
+        byte_deltas[restart] = byte_counts[restart]
+
+        elapsed = durations - previous_duration
+        elapsed[restart] = durations[restart]
+        no_duration = seen & (elapsed <= 0)
+        elapsed[no_duration] = now - self.last_time[rows][no_duration]
+
+        self.total_bytes[rows] = byte_counts
+        self.duration[rows] = durations
+        self.last_time[rows] = now
+
+        valid = elapsed > 0
+        sampled = rows[valid]
+        self.rate[sampled] = self.estimator.add(
+            sampled, byte_deltas[valid], elapsed[valid])
+        return self.rate[rows]
+
+    def classify(self, rows, threshold, exclude_ports):
+        """
+        Moves flows in and out of the DMZ.
+
+        Flows enter above the policy's up fraction of the threshold and
+        leave below its down fraction, once they have been in or out for
+        its dwell time, counted from their latest sample.
+
+        Returns two row arrays, flows that became elephants and DMZ flows
+        that dropped back to mice, and how many flows crossed the plain
+        threshold since their previous sample, so a single threshold would
+        have moved them, but the policy kept them where they were. Flows
+        arriving on exclude_ports (the DPI ports) and flows backing off
+        after a kick are not promoted.
+        """
+        policy = self.policy
+        pending = rows[self.rules[rows] == 0]
+        if len(pending):
+            self.rules[pending] = policy.masks(
+                self.nw_src[pending], self.nw_dst[pending],
+                self.in_port[pending])
+        rule = policy.select(self.rules[rows], self.total_bytes[rows])
+
+        rates = self.rate[rows]
+        in_dmz = self.in_dmz[rows]
+        eligible = ~np.in1d(self.in_port[rows], exclude_ports)
+        now = self.last_time[rows]
+        settled = now - self.changed[rows] >= policy.dwell[rule]
+
+        above = rates > threshold
+        was_above = self.above[rows]
+        self.above[rows] = above
+        promote = eligible & ~in_dmz & ~self.backoff[rows] & \
+            above & ~was_above
+        demote = eligible & in_dmz & (rates < threshold) & was_above
+        elephant = eligible & ~in_dmz & ~self.backoff[rows] & settled & \
+            (rates > threshold * policy.up[rule])
+        mouse = eligible & in_dmz & settled & \
+            (rates < threshold * policy.down[rule])
+        prevented = int(np.count_nonzero(promote & ~elephant) +
+                        np.count_nonzero(demote & ~mouse))
+
+        elephants = rows[elephant]
+        mice = rows[mouse]
+        self.in_dmz[elephants] = True
+        self.in_dmz[mice] = False
+        self.changed[elephants] = now[elephant]
+        self.changed[mice] = now[mouse]
+        return elephants, mice, prevented
+
+    def demote(self, row):
+        """ Takes back a promotion that could not be carried out. """
+        self.in_dmz[row] = False
+
+    def kick(self, row):
+        """
+        Sends a DMZ flow back through the DPI and starts its back-off. Its
+        dwell time counts from its latest sample, as if it had been demoted.
+        """
+        self.in_dmz[row] = False
+        self.backoff[row] = True
+        self.changed[row] = self.last_time[row]
+
+    def release(self, row):
+        """ Ends a flow's back-off so it can be promoted again. """
+        self.backoff[row] = False
+
+    def hot(self, threshold, exclude_ports):
+        """
+        Returns the rows worth polling between full sweeps: flows in the
+        DMZ and flows at or above `threshold` that could be promoted.
+        """
+        size = self.size
+        eligible = ~np.in1d(self.in_port[:size], exclude_ports)
+        return np.flatnonzero(
+            self.live[:size] & eligible &
+            (self.in_dmz[:size] | (self.rate[:size] >= threshold)))
+
+    def dmz_count(self):
+        return int(np.count_nonzero(self.in_dmz[:self.size]))
+
+    def ranking(self):
+        """ Returns the live flows ordered by rate, as they are now. """
+        return FlowRanking(self)
+
+
+class FlowRanking(object):
+    """
+    A table's live flows and their rates, frozen when it is built, ranked
+    overall and within each in_port.
+
+    Building one only copies the columns. The dashboard's short list
+    comes from a partial sort; the first query for anything else sorts
+    every flow once, and later queries are slices. Nothing built is
+    modified afterwards, and the flows handed out never change, so other
+    threads can query it while the table moves on.
+    """
+
+    def __init__(self, table):
+        live = np.flatnonzero(table.live[:table.size])
+        self.rows = live
+        self.rates = table.rate[live]
+        self.in_ports = table.in_port[live]
+        self.total = float(self.rates.sum())
+        self.flows = list(table.flows)
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _sort(self):
+        order = np.argsort(-self.rates, kind='mergesort')
+        rows = self.rows[order]
+        rates = self.rates[order]
+        # A stable sort by port keeps each port's flows fastest first
+        ports = self.in_ports[order]
+        order = np.argsort(ports, kind='mergesort')
+        port_values, starts = np.unique(ports[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        spans = dict(zip(port_values.tolist(),
+                         zip(starts.tolist(), ends.tolist())))
+        self._sorted = (rows, rates, rows[order], rates[order], spans)
+        return self._sorted
+
+    def top(self, n, in_port=None):
+        """
+        Returns the n fastest flows, or the n fastest arriving on in_port,
+        as [(flow, bits/sec)].
+        """
+        ranked = self._sorted
+        if ranked is None and in_port is None and n < len(self.rows):
+            fastest = np.argpartition(-self.rates, n - 1)[:n]
+            fastest = fastest[np.argsort(-self.rates[fastest],
+                                         kind='mergesort')]
+            rows, rates = self.rows[fastest], self.rates[fastest]
+        else:
+            rows, rates, port_rows, port_rates, spans = \
+                ranked or self._sort()
+            if in_port is None:
+                rows, rates = rows[:n], rates[:n]
+            else:
+                start, end = spans.get(in_port, (0, 0))
+                end = min(end, start + n)
+                rows = port_rows[start:end]
+                rates = port_rates[start:end]
+        return [(self.flows[row], rate)
+                for row, rate in zip(rows.tolist(), rates.tolist())]
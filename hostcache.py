@@ -0,0 +1,69 @@
+#-------------------------------------------------------------------------
+# FILE:             hostcache.py
+# DESCRIPTION:      IP to MAC address and port cache with aging
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from collections import OrderedDict
+import time
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# A host not heard from in this long may have moved or gone.
+HOST_TIMEOUT_SECS = 120
+MAX_HOSTS = 65536
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class HostCache(object):
+    """
+    The MAC address and switch port last seen for each IP address.
+
+    Entries are kept in the order they were last learned, so the oldest
+    is always first: aging only ever looks at the front, and a full cache
+    drops the host heard from least recently.
+    """
+
+    def __init__(self, timeout=HOST_TIMEOUT_SECS, max_hosts=MAX_HOSTS):
+        self.timeout = timeout
+        self.max_hosts = max_hosts
+        self._hosts = OrderedDict()
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def learn(self, ip, mac, port):
+        now = time.time()
+        self._hosts.pop(ip, None)
+        self._hosts[ip] = (mac, port, now)
+        self.expire(now)
+        while len(self._hosts) > self.max_hosts:
+            self._hosts.popitem(last=False)
+
+    def get(self, ip):
+        """ Returns (mac, port) for ip, or None if unknown or stale. """
+        host = self._hosts.get(ip)
+        if host is None:
+            return None
+        if time.time() - host[2] >= self.timeout:
+            del self._hosts[ip]
+            return None
+        return host[:2]
+
+    def expire(self, now=None):
+        """ Forgets every host not heard from within the timeout. """
+        oldest = (now if now is not None else time.time()) - self.timeout
+        while self._hosts:
+            # Iterating over the keys, not items(), which is a list on
+            # Python 2 and would copy the whole cache every packet-in
+            ip = next(iter(self._hosts))
+            if self._hosts[ip][2] > oldest:
+                break
+            del self._hosts[ip]
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#-------------------------------------------------------------------------
+# FILE:             journal.py
+# DESCRIPTION:      Binary ring journal of reroute decisions
+#-------------------------------------------------------------------------
+"""
+Every reroute decision the controller makes, as fixed-size records in a
+memory-mapped ring file, and a tool to search them offline.
+
+    ./journal.py reroutes.jnl --action elephant --host 10.0.0.7
+    ./journal.py reroutes.jnl --start 2026-10-18T09:00 --end 2026-10-18T10:00
+        --group-by host
+
+Without --group-by, the latest --limit matching records are printed,
+oldest first. With it, they are counted per action, host (either end of the
+flow), dpid or minute, with their bytes and mean and peak rates.
+"""
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import argparse
+import datetime
+import mmap
+import os
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+JOURNAL_MAGIC = b'DMZJRNL1'
+# magic, record size, capacity in records, records ever written
+HEADER = struct.Struct('<8sIIQ')
+HEADER_BYTES = 64
+COUNT_OFFSET = 16
+JOURNAL_RECORDS = 1000000
+
+# Actions, as stored
+ELEPHANT = 1
+MOUSE = 2
+KICK = 3
+ACTIONS = {ELEPHANT: 'elephant', MOUSE: 'mouse', KICK: 'kick'}
+
+# What the controller writes and what the tool reads: the same layout
+RECORD = struct.Struct('<dQIIHHHBxdQ')
+JOURNAL_RECORD = np.dtype([
+    ('time', '<f8'),
+    ('dpid', '<u8'),
+    ('nw_src', '<u4'),
+    ('nw_dst', '<u4'),
+    ('tp_src', '<u2'),
+    ('tp_dst', '<u2'),
+    ('in_port', '<u2'),
+    ('action', 'u1'),
+    ('pad', 'u1'),
+    ('rate', '<f8'),
+    ('bytes', '<u8'),
+])
+assert JOURNAL_RECORD.itemsize == RECORD.size
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class Journal(object):
+    """
+    A ring of RECORDs in a memory-mapped file.
+
+    write() packs straight into the mapping, so a decision costs one
+    struct pack and no strings or system calls; the OS writes the pages
+    back. Once capacity records are in, the oldest are overwritten. An
+    existing journal of the same capacity is continued, not cleared.
+    """
+
+    def __init__(self, path, capacity=JOURNAL_RECORDS):
+        self.path = path
+        self.capacity = capacity
+        size = HEADER_BYTES + capacity * RECORD.size
+        self._file = open(path, 'a+b')
+        self._file.seek(0)
+        header = self._file.read(HEADER.size)
+        fresh = len(header) < HEADER.size or \
+            HEADER.unpack(header)[:3] != (JOURNAL_MAGIC, RECORD.size,
+                                          capacity) or \
+            os.path.getsize(path) != size
+        if fresh:
+            self._file.truncate(0)
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        if fresh:
+            HEADER.pack_into(self._map, 0, JOURNAL_MAGIC, RECORD.size,
+                             capacity, 0)
+        self.count = HEADER.unpack_from(self._map, 0)[3]
+
+    def write(self, now, dpid, nw_src, nw_dst, tp_src, tp_dst, in_port,
+              action, rate, byte_count):
+        """ Adds a record; addresses are integers. """
+        RECORD.pack_into(
+            self._map,
+            HEADER_BYTES + (self.count % self.capacity) * RECORD.size,
+            now, dpid, nw_src, nw_dst, tp_src, tp_dst, in_port, action,
+            rate, byte_count)
+        self.count += 1
+        struct.pack_into('<Q', self._map, COUNT_OFFSET, self.count)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+def read_journal(path):
+    """ Returns a journal's records, oldest first, as a JOURNAL_RECORD array. """
+    with open(path, 'rb') as f:
+        magic, record_size, capacity, count = HEADER.unpack(
+            f.read(HEADER.size))
+    if magic != JOURNAL_MAGIC or record_size != JOURNAL_RECORD.itemsize:
+        raise ValueError("%s is not a journal" % (path,))
+    if count == 0:
+        return np.zeros(0, JOURNAL_RECORD)
+    records = np.memmap(path, JOURNAL_RECORD, 'r', HEADER_BYTES,
+                        (capacity,))
+    if count <= capacity:
+        return records[:count]
+    start = count % capacity
+    return np.concatenate((records[start:], records[:start]))
+
+
+def ip_value(text):
+    return struct.unpack('!I', socket.inet_aton(text))[0]
+
+
+def ip_text(value):
+    return socket.inet_ntoa(struct.pack('!I', int(value)))
+
+
+def parse_time(text):
+    """ Seconds since the epoch, or a local YYYY-MM-DD[THH:MM[:SS]]. """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for layout in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(datetime.datetime.strptime(
+                text, layout).timetuple())
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("not a time: %r" % (text,))
+
+
+def select(records, start=None, end=None, host=None, action=None,
+           dpid=None):
+    """ Returns the records matching every filter given. """
+    keep = np.ones(len(records), np.bool_)
+    if start is not None:
+        keep &= records['time'] >= start
+    if end is not None:
+        keep &= records['time'] < end
+    if host is not None:
+        address = ip_value(host)
+        keep &= (records['nw_src'] == address) | \
+            (records['nw_dst'] == address)
+    if action is not None:
+        keep &= records['action'] == action
+    if dpid is not None:
+        keep &= records['dpid'] == dpid
+    return records[keep]
+
+
+def aggregate(records, group_by):
+    """
+    Returns [(group, count, bytes, mean rate, peak rate)], largest
+    count first.
+    """
+    if group_by == 'host':
+        # A flow counts toward both of its ends
+        keys = np.concatenate((records['nw_src'], records['nw_dst']))
+        records = np.concatenate((records, records))
+    elif group_by == 'minute':
+        keys = (records['time'] // 60).astype(np.int64) * 60
+    else:
+        keys = records[group_by]
+    groups, inverse, counts = np.unique(keys, return_inverse=True,
+                                        return_counts=True)
+    byte_sums = np.bincount(inverse, records['bytes'].astype(np.float64),
+                            len(groups))
+    rate_sums = np.bincount(inverse, records['rate'], len(groups))
+    peaks = np.zeros(len(groups))
+    np.maximum.at(peaks, inverse, records['rate'])
+    order = np.argsort(-counts, kind='mergesort')
+    return [(groups[i], int(counts[i]), int(byte_sums[i]),
+             rate_sums[i] / counts[i], peaks[i]) for i in order]
+
+
+def group_text(group_by, value):
+    if group_by == 'host':
+        return ip_text(value)
+    if group_by == 'action':
+        return ACTIONS.get(int(value), str(value))
+    if group_by == 'minute':
+        return datetime.datetime.fromtimestamp(value).strftime(
+            '%Y-%m-%d %H:%M')
+    return "%016x" % (value,)
+
+
+def record_text(record):
+    return "%s %016x %-8s %s:%d -> %s:%d in_port %d %d bytes %.0f b/s" % (
+        datetime.datetime.fromtimestamp(record['time']).strftime(
+            '%Y-%m-%d %H:%M:%S.%f'),
+        record['dpid'], ACTIONS.get(int(record['action']), '?'),
+        ip_text(record['nw_src']), record['tp_src'],
+        ip_text(record['nw_dst']), record['tp_dst'],
+        record['in_port'], record['bytes'], record['rate'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Search a reroute journal.")
+    parser.add_argument('journal')
+    parser.add_argument('--start', type=parse_time)
+    parser.add_argument('--end', type=parse_time)
+    parser.add_argument('--host', help="either end of the flow")
+    parser.add_argument('--action', choices=sorted(ACTIONS.values()))
+    parser.add_argument('--dpid', type=lambda text: int(text, 0))
+    parser.add_argument('--group-by',
+                        choices=('action', 'host', 'dpid', 'minute'))
+    parser.add_argument('--limit', type=int, default=100,
+                        help="latest records to print, 0 for all")
+    args = parser.parse_args(argv)
+
+    action = None
+    if args.action is not None:
+        action = dict((name, code) for code, name in ACTIONS.items())[
+            args.action]
+    try:
+        records = select(read_journal(args.journal), args.start, args.end,
+                         args.host, action, args.dpid)
+    except (IOError, ValueError, socket.error) as e:
+        parser.error(str(e))
+
+    if args.group_by:
+        for group, count, byte_count, mean, peak in aggregate(
+                records, args.group_by):
+            print("%-20s %10d records %16d bytes %14.0f mean b/s "
+                  "%14.0f peak b/s" % (group_text(args.group_by, group),
+                                       count, byte_count, mean, peak))
+    else:
+        for record in records[-args.limit:] if args.limit else records:
+            print(record_text(record))
+    print("%d records" % (len(records),))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#-------------------------------------------------------------------------
+# FILE:             metrics.py
+# DESCRIPTION:      Counters, gauges, histograms and a sampling profiler
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from bisect import bisect_left
+from collections import defaultdict
+import sys
+import threading
+import time
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# Seconds; covers a fast packet-in up to a stats reply for a full table
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+FLOW_MOD_REASONS = ('elephant', 'mouse', 'kick', 'learn', 'drop')
+# Whether the host cache could answer an ARP request
+ARP_RESULTS = ('answered', 'missed')
+PROFILE_INTERVAL_SECS = 0.005
+MAX_PROFILE_SECS = 60
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def format_labels(labels):
+    """ Renders a ((name, value), ...) tuple as Prometheus labels. """
+    if not labels:
+        return ""
+    return "{%s}" % (",".join('%s="%s"' % (name, value)
+                              for name, value in labels),)
+
+
+class Counter(object):
+    """
+    A count that only goes up, per set of labels.
+
+    Labels are a tuple of (name, value) pairs; callers build them once
+    and reuse them, so counting is a dict update.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        return [(self.name, labels, value)
+                for labels, value in list(self.values.items())]
+
+
+class Gauge(object):
+    """
+    A value read when the metrics are scraped: collect() returns
+    {labels: value}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, labels, value)
+                for labels, value in self.collect().items()]
+
+
+class Histogram(object):
+    """
+    Observations counted into fixed buckets, per set of labels.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, labels, value):
+        counts = self.values.get(labels)
+        if counts is None:
+            # One count per bucket, the +Inf bucket, then the sum
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        result = []
+        for labels, counts in list(self.values.items()):
+            counts = list(counts)
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                result.append((self.name + '_bucket',
+                               labels + (('le', bound),), total))
+            result.append((self.name + '_sum', labels, counts[-1]))
+            result.append((self.name + '_count', labels, total))
+        return result
+
+
+class Registry(object):
+    """
+    Every metric the controller exports, rendered in the Prometheus text
+    format. Metrics are updated on the POX thread and read by the web
+    server's, without locks; a scrape may see a cycle half counted.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+
+    def gauge(self, name, help, collect):
+        return self.add(Gauge(name, help, collect))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append("%s%s %r" % (name, format_labels(labels),
+                                          float(value)))
+        return "\n".join(lines) + "\n"
+
+
+class ControllerMetrics(Registry):
+    """
+    The metrics SizeBasedDynamicDmzSwitch and StatsPoller update, by dpid.
+    Gauges over the switches are added by whoever owns them.
+    """
+
+    def __init__(self):
+        Registry.__init__(self)
+        self.flow_stats_seconds = self.histogram(
+            'dmz_flow_stats_seconds',
+            'Time to process one flow stats reply, all of its parts')
+        self.packet_in_seconds = self.histogram(
+            'dmz_packet_in_seconds', 'Time to handle one packet-in')
+        self.stats_rtt_seconds = self.histogram(
+            'dmz_stats_request_rtt_seconds',
+            'Time from flow stats request to reply')
+        self.packet_ins = self.counter(
+            'dmz_packet_ins_total', 'Packet-ins received')
+        self.packet_ins_limited = self.counter(
+            'dmz_packet_ins_limited_total',
+            'Packet-ins over the per-port rate limit')
+        self.floods = self.counter('dmz_floods_total', 'Packets flooded')
+        self.drops = self.counter('dmz_drops_total', 'Packets dropped')
+        self.flow_mods = self.counter(
+            'dmz_flow_mods_total', 'flow_mods queued, by reason')
+        self.flaps_prevented = self.counter(
+            'dmz_flaps_prevented_total',
+            'Threshold crossings a single threshold would have rerouted '
+            'that hysteresis or dwell time held back')
+        self.arp_requests = self.counter(
+            'dmz_arp_requests_total',
+            'ARP requests seen with proxy ARP, by whether the controller '
+            'answered them')
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of every other thread at a fixed interval, for a
+    while, and reports how often each stack was seen.
+
+    It is off until run() is called, and only one run happens at a time.
+    The result is in the folded format flame graph tools read: one line
+    per distinct stack, thread name first, then a count.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def run(self, seconds, interval=PROFILE_INTERVAL_SECS):
+        """ Returns the folded stacks, or None if a run is in progress. """
+        if not self._lock.acquire(False):
+            return None
+        try:
+            return self._sample(min(seconds, MAX_PROFILE_SECS), interval)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds, interval):
+        me = threading.current_thread().ident
+        stacks = defaultdict(int)
+        end = time.time() + seconds
+        while time.time() < end:
+            names = dict((thread.ident, thread.name)
+                         for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, code.co_filename,
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+        return "".join("%s %d\n" % (stack, count)
+                       for stack, count in sorted(stacks.items()))
@@ -14,45 +14,230 @@ from pox.lib.addresses import *
 from pox.lib.util import dpid_to_str
 from pox.lib.util import str_to_bool
 import pox.openflow.libopenflow_01 as of
-from flask import Flask
-from flask import render_template
-import json
 import logging
 import random
 from utils import *
+from poller import StatsPoller, FULL, TARGETED
+from flowtable import FlowTable
+from estimators import make_estimator
+from timerwheel import TimerWheel
+from flowmods import FlowModQueue
+from ratelimit import TokenBucket
+from dashboard import BandwidthFeed
+from timeseries import TimeSeriesStore, MemoryBudget
+from webapi import WebApi
+from metrics import ControllerMetrics, FLOW_MOD_REASONS, ARP_RESULTS
+from workers import (StatsWorkerPool, RemoteRanking, RemoteHistory,
+                     WorkerError, WORKER_COUNTERS)
+from checkpoint import (CheckpointStore, CheckpointWriter, MAC_RECORD,
+                        FLOW_RECORD)
+from hostcache import HostCache, HOST_TIMEOUT_SECS
+from dpi import DpiRing, parse_dpi_ports
+from journal import Journal, JOURNAL_RECORDS, ELEPHANT, MOUSE, KICK
+from policy import compile_policy, DEFAULT_SECTION
+from pox.lib.recoco import Timer
+from functools import partial
+from collections import deque
+import numpy as np
 import time
 import datetime
-import threading
+import copy
 
 
 #-------------------------------------------------------------------------
 # CONSTANTS
 #-------------------------------------------------------------------------
 FLOW_STATS_INTERVAL_SECS = 1
+HOT_FLOW_FRACTION = 0.5
+RATE_ESTIMATOR = 'window'
+RUNNING_AVERAGE_WINDOW = 1
+EWMA_TIME_CONSTANT_SECS = 5
 THRESHOLD_BITS_PER_SEC = 500 * 1024 * 1024
 FLOW_ENTRY_IDLE_TIMEOUT_SECS = 10
 FLOW_ENTRY_HARD_TIMEOUT_SECS = 800
 RANDOM_TIMEOUT = { 'min': 3, 'max': 10 }
+FLOW_AGE_MISSED_REPLIES = 3
+MAX_FLOWS_PER_SWITCH = 100000
+TIMER_WHEEL_TICK_SECS = 0.1
+MAX_FLOW_MODS_PER_SEC = 1000
+PACKET_IN_BURST_SECS = 2
+STORM_ACTIONS = ('flood', 'drop')
+RULE_GRANULARITIES = ('exact', 'flow', 'aggregate')
+COARSE_RULE_PRIORITY = 100
+REROUTE_PRIORITY = 10000
+HISTORY_BUDGET_MB = 256
+# A disconnected switch's state is kept this long in case it comes back
+STATE_RETENTION_SECS = 300
+CHECKPOINT_INTERVAL_SECS = 60
+
+# Per-flow timer actions
+DMZ_EXPIRED = 'dmz-expired'
+BACKOFF_EXPIRED = 'backoff-expired'
+
+# What each journaled reroute is called in the debug log
+REROUTE_MESSAGES = {
+    ELEPHANT: "ELEPHANT FLOW REROUTED",
+    MOUSE: "MOUSE FLOW REROUTED",
+    KICK: "ELEPHANT FLOW KICKED",
+}
 
 #-------------------------------------------------------------------------
 # VARIABLES
 #-------------------------------------------------------------------------
-flask_log = logging.getLogger('werkzeug')
-flask_log.setLevel(logging.ERROR)
-
 log = core.getLogger()
 
 # We don't want to flood immediately when a switch connects.
 # Can be overriden on commandline.
 _flood_delay = 0
 
+# Use RANDOM_TIMEOUT['max'] instead of a random timeout, for experiments.
+# Can be overriden on commandline.
+_fixed_timeout = False
+
+# How specific the rules installed on PacketIn are, and the prefix length
+# of the per-subnet rules in 'aggregate' mode. Can be overriden on
+# commandline.
+_rule_granularity = 'exact'
+_aggregate_prefix = 24
+
+# Packet-ins admitted per second on each ingress port, and what happens to
+# the ones over that. None admits them all. Can be overriden on
+# commandline.
+_packet_in_rate = None
+_storm_action = 'flood'
+
+# Process each part of a multipart flow stats reply as it arrives, one
+# part per turn of the event loop. Can be overriden on commandline.
+_stream_stats = False
+
+# Answer ARP requests for hosts in the host cache instead of flooding them,
+# and how long a host stays cached. Can be overriden on commandline.
+_proxy_arp = False
+_host_timeout = HOST_TIMEOUT_SECS
+
+# The classification Policy, from the policy file if one is given. Can be
+# overriden on commandline.
+_policy = None
+
+# Bits/sec one DPI port can inspect, or None to leave the elephant
+# threshold to the number of DPI ports alone. Can be overriden on
+# commandline.
+_dpi_capacity = None
+
+# The Journal reroute decisions are recorded in, if any. Can be overriden
+# on commandline.
+_journal = None
+
+# Flows at or above this fraction of the threshold are polled every
+# interval in tiered polling. Can be overriden on commandline.
+_hot_fraction = HOT_FLOW_FRACTION
+
 #-------------------------------------------------------------------------
 # CLASSES
 #-------------------------------------------------------------------------
 
 
+def flow_key(match):
+    """
+    Identifies a flow by its send/recieve ports and hardware interface.
+    """
+    return (match.nw_src, match.nw_dst,
+            match.tp_src, match.tp_dst, match.in_port)
+
+
+def compact_key(match):
+    """
+    flow_key() as plain integers, which are cheaper to send to a worker.
+    """
+    return (match.nw_src.toUnsigned(), match.nw_dst.toUnsigned(),
+            match.tp_src, match.tp_dst, match.in_port)
+
+
+def compact_key_label(key):
+    """ The label Flow gives the flow with this compact key. """
+    return str((IPAddr(key[0]), IPAddr(key[1])) + tuple(key[2:]))
+
+
+def is_reroute(entry, dpi_ports):
+    """
+    Tells whether a flow stats entry is one of our elephant reroutes: a
+    flow from a host sent somewhere other than a DPI. Every other flow
+    from a host is sent to one. The entry's priority says nothing, since
+    a reroute modifies the flow's entry and OpenFlow 1.0 keeps its
+    priority.
+    """
+    ports = [action.port for action in entry.actions
+             if hasattr(action, 'port')]
+    return entry.match.in_port not in dpi_ports and bool(ports) and \
+        not any(port in dpi_ports for port in ports)
+
+
+def random_timeout():
+    """
+    Picks how long a flow stays in the DMZ or backs off after a kick.
+    """
+    if _fixed_timeout:
+        return RANDOM_TIMEOUT['max']
+    return random.uniform(RANDOM_TIMEOUT['min'], RANDOM_TIMEOUT['max'])
+
+
+def is_flow_match(match):
+    """
+    Tells 5-tuple entries, which can carry an elephant, from coarser ones.
+    """
+    return match.nw_src is not None and match.nw_dst is not None and \
+        match.tp_src is not None and match.tp_dst is not None
+
+
+def build_match(packet, in_port, toward_dpi):
+    """
+    Builds the match of a reactive rule at the configured granularity and
+    returns it along with the rule's priority.
+
+    'exact' matches every header field. 'flow' matches TCP and UDP on
+    their 5-tuple, other IP traffic on its host pair and everything else
+    on its destination MAC. 'aggregate' also folds IP traffic that can
+    never be an elephant into one rule per destination subnet on its way
+    to the DPI; on the way out it still needs the destination MAC. Rules
+    that could become elephants keep their destination MAC, which says
+    where a reroute sends them.
+    """
+    if _rule_granularity == 'exact':
+        return of.ofp_match.from_packet(packet, in_port), \
+            of.OFP_DEFAULT_PRIORITY
+
+    ip = packet.find('ipv4')
+    if ip is None:
+        return of.ofp_match(in_port=in_port, dl_dst=packet.dst), \
+            COARSE_RULE_PRIORITY
+
+    transport = packet.find('tcp') or packet.find('udp')
+    if transport is not None:
+        return of.ofp_match(in_port=in_port, dl_dst=packet.dst,
+                            dl_type=packet.IP_TYPE, nw_proto=ip.protocol,
+                            nw_src=ip.srcip, nw_dst=ip.dstip,
+                            tp_src=transport.srcport,
+                            tp_dst=transport.dstport), \
+            of.OFP_DEFAULT_PRIORITY
+
+    if _rule_granularity == 'aggregate' and toward_dpi:
+        netmask = (0xffffffff << (32 - _aggregate_prefix)) & 0xffffffff
+        subnet = IPAddr(ip.dstip.toUnsigned() & netmask)
+        return of.ofp_match(in_port=in_port, dl_type=packet.IP_TYPE,
+                            nw_proto=ip.protocol,
+                            nw_dst="%s/%d" % (subnet, _aggregate_prefix)), \
+            COARSE_RULE_PRIORITY
+
+    return of.ofp_match(in_port=in_port, dl_dst=packet.dst,
+                        dl_type=packet.IP_TYPE, nw_proto=ip.protocol,
+                        nw_src=ip.srcip, nw_dst=ip.dstip), \
+        COARSE_RULE_PRIORITY
+
+
 class Flow(object):
-    RUNNING_AVERAGE_WINDOW = 1
+    __slots__ = ('network_layer_src', 'network_layer_dst',
+                 'transport_layer_src', 'transport_layer_dst',
+                 'hardware_port', 'match', 'label', 'dpi_port')
 
     def __init__(self, match=None):
         self.network_layer_src = None
@@ -61,7 +246,6 @@ class Flow(object):
         self.transport_layer_dst = None
         self.hardware_port = None
         self.match = match
-        self.sample_timeout = 0
         if(match is not None and
                 hasattr(match, 'nw_src') and
                 hasattr(match, 'nw_dst') and
@@ -73,10 +257,9 @@ class Flow(object):
             self.transport_layer_src = match.tp_src
             self.transport_layer_dst = match.tp_dst
             self.hardware_port = match.in_port
-
-        self.bit_rates = [0] * Flow.RUNNING_AVERAGE_WINDOW
-        self.running_rate_sum = 0
-        self.total_bytes = 0
+        self.label = str(flow_key(match)) if match is not None else None
+        # The DPI port this flow is inspected on, once known
+        self.dpi_port = None
 
     def __eq__(self, other):
         if other is None:
@@ -95,7 +278,8 @@ class Flow(object):
         msg.command = of.OFPFC_MODIFY
         msg.idle_timeout = FLOW_ENTRY_IDLE_TIMEOUT_SECS
         msg.hard_timeout = FLOW_ENTRY_HARD_TIMEOUT_SECS
-        msg.priority = 10000
+        msg.flags = of.OFPFF_SEND_FLOW_REM
+        msg.priority = REROUTE_PRIORITY
         return msg
 
     def get_flow_table_remove_msg(self):
@@ -104,32 +288,203 @@ class Flow(object):
         msg.command = of.OFPFC_DELETE_STRICT
         return msg
 
-    def get_average_rate(self):
-        return self.running_rate_sum / Flow.RUNNING_AVERAGE_WINDOW
 
-    def add_rate(self, new_rate):
-        self.running_rate_sum += new_rate - self.bit_rates.pop(0)
-        self.bit_rates.append(new_rate)
+class PortMap(object):
+    """
+    Caches a connection's port name -> port number lookups.
+
+    The cache is dropped whenever the switch reports a port change or
+    sends its features again.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._ports = {}
+        connection.addListenerByName("PortStatus", self.invalidate)
+        connection.addListenerByName("FeaturesReceived", self.invalidate)
+
+    def get(self, name):
+        port_no = self._ports.get(name)
+        if port_no is None:
+            port_no = self._ports[name] = getOpenFlowPort(
+                self.connection, name)
+        return port_no
+
+    def invalidate(self, event=None):
+        self._ports.clear()
+
+
+class RuleTemplates(object):
+    """
+    Prebuilt reactive flow_mods, one per output port.
+
+    Each rule is a shallow copy of its port's template, so the timeouts,
+    flags and action list are only built once.
+    """
+
+    def __init__(self):
+        self._templates = {}
+
+    def build(self, port, match, priority, data):
+        template = self._templates.get(port)
+        if template is None:
+            template = self._templates[port] = of.ofp_flow_mod(
+                idle_timeout=FLOW_ENTRY_IDLE_TIMEOUT_SECS,
+                hard_timeout=FLOW_ENTRY_HARD_TIMEOUT_SECS,
+                flags=of.OFPFF_SEND_FLOW_REM,
+                actions=[of.ofp_action_output(port=port)])
+        msg = copy.copy(template)
+        msg.match = match
+        msg.priority = priority
+        msg.data = data
+        return msg
+
+
+class SwitchFlowState(object):
+    """
+    Everything the controller has learned about one switch's traffic.
+    """
+
+    def __init__(self, dpid, estimator, history_budget, pool=None):
+        self.dpid = dpid
+        self.macToPort = {}
+        self.hosts = HostCache(_host_timeout)
+        self.feed = BandwidthFeed()
+        # {compact key: Flow} of flows in the DMZ, and the compact keys of
+        # flows backing off after a kick, with workers
+        self.dmz = {}
+        self.backoff = set()
+        # Checkpointed flows waiting for the switch to confirm them:
+        # ({compact key: record index}, records)
+        self.restored = ({}, None)
+        if pool is None:
+            self.flow_table = FlowTable(estimator, policy=_policy)
+            self.history = TimeSeriesStore(history_budget)
+        else:
+            # The worker owning this switch keeps both
+            self.flow_table = None
+            self.history = RemoteHistory(pool, dpid)
+
+    def checkpoint(self):
+        """
+        Returns the MAC table and flow table as MAC_RECORD and FLOW_RECORD
+        arrays. With workers, the flow table is theirs and left out.
+        """
+        macs = np.zeros(len(self.macToPort), MAC_RECORD)
+        if len(macs):
+            addresses, ports = zip(*self.macToPort.items())
+            macs['mac'] = np.frombuffer(
+                b''.join(mac.toRaw() for mac in addresses),
+                np.uint8).reshape(-1, 6)
+            macs['port'] = ports
+
+        table = self.flow_table
+        if table is None:
+            return macs, np.zeros(0, FLOW_RECORD)
+        rows = np.flatnonzero(table.live[:table.size])
+        flows = np.zeros(len(rows), FLOW_RECORD)
+        if len(rows):
+            keys = np.array([(key[0].toUnsigned(), key[1].toUnsigned()) +
+                             key[2:] for key in
+                             (table.keys[row] for row in rows)], np.int64)
+            for i, name in enumerate(('nw_src', 'nw_dst', 'tp_src',
+                                      'tp_dst', 'in_port')):
+                flows[name] = keys[:, i]
+            for name in ('total_bytes', 'duration', 'last_time', 'rate',
+                         'backoff'):
+                flows[name] = getattr(table, name)[rows]
+        return macs, flows
+
+    def restore(self, macs, flows):
+        """
+        Relearns checkpointed MAC addresses, and holds on to checkpointed
+        flows until the switch's flow table shows which still exist.
+        """
+        for mac, port in zip(macs['mac'], macs['port'].tolist()):
+            self.macToPort.setdefault(EthAddr(mac.tobytes()), port)
+        keys = np.column_stack([flows[name] for name in (
+            'nw_src', 'nw_dst', 'tp_src', 'tp_dst', 'in_port')]).tolist()
+        self.restored = (dict(zip(map(tuple, keys), range(len(flows)))),
+                         flows)
+
+
+class FlowStateRegistry(object):
+    """
+    Holds one SwitchFlowState per dpid so no switch ever touches another's.
+    """
+
+    def __init__(self, new_estimator, history_budget, pool=None):
+        self._states = {}
+        self._new_estimator = new_estimator
+        self._history_budget = history_budget
+        self._pool = pool
+
+    def __len__(self):
+        return len(self._states)
 
-    def update_total_bytes_transferred(self, new_total):
-        transmission_rate = 8 * \
-            (new_total - self.total_bytes) / FLOW_STATS_INTERVAL_SECS
-        self.total_bytes = new_total
-        self.add_rate(transmission_rate)
+    def __contains__(self, dpid):
+        return dpid in self._states
+
+    def get(self, dpid):
+        state = self._states.get(dpid)
+        if state is None:
+            state = self._states[dpid] = SwitchFlowState(
+                dpid, self._new_estimator(), self._history_budget,
+                self._pool)
+        return state
+
+    def find(self, dpid):
+        """ Like get(), but returns None for a switch never seen. """
+        return self._states.get(dpid)
+
+    def dpids(self):
+        return list(self._states)
+
+    def discard(self, dpid):
+        state = self._states.pop(dpid, None)
+        if state is not None:
+            state.history.close()
 
 
 class SizeBasedDynamicDmzSwitch (object):
 
-    def __init__(self, connection, transparent, dpi_port):
+    def __init__(self, connection, transparent, dpi_port, state, max_flows,
+                 timers, flow_mod_rate, metrics):
         # Switch we'll be adding L2 learning switch capabilities to
         self.connection = connection
+        self.dpid = connection.dpid
         self.transparent = transparent
         self.dpi_port = dpi_port
-        self._flow_bandwidths = {}
+        self.dpi = DpiRing(parse_dpi_ports(dpi_port))
+        self.threshold = self.dpi.threshold(THRESHOLD_BITS_PER_SEC)
+        self._dpi_ports = []
+        self.max_flows = max_flows
+        self.timers = timers
+        self.flow_mods = FlowModQueue(connection, flow_mod_rate)
+        self.ports = PortMap(connection)
+        self.rules = RuleTemplates()
+        self._admission = {}
+        self.packet_ins_limited = 0
+        self.state = state
+        self.metrics = metrics
+        self.labels = (('dpid', dpid_to_str(self.dpid)),)
+        self._reason_labels = dict((reason, self.labels + (('reason', reason),))
+                                   for reason in FLOW_MOD_REASONS)
+        self._arp_labels = dict((result, self.labels + (('result', result),))
+                                for result in ARP_RESULTS)
+        self.feed = state.feed
+        self.history = state.history
+        self._reply_rows = []
+        # Time spent on the current reply so far, observed once it ends
+        self._reply_seconds = 0.0
+        self._chunks = deque()
+        self._chunk_soon = False
+        # Until a full flow stats reply shows what the switch has kept
+        self._reconciling = True
         # Our table
-        self.macToPort = {}
-        self.flows = {}
-        self.dmz_flows = {}
+        self.macToPort = state.macToPort
+        self.hosts = state.hosts
+        self.flow_table = state.flow_table
 
         # We want to hear PacketIn messages, so we listen
         # to the connection
@@ -138,198 +493,457 @@ class SizeBasedDynamicDmzSwitch (object):
         # We just use this to know when to log a helpful message
         self.hold_down_expired = _flood_delay == 0
 
-        self._statistic()
-        core.openflow.addListenerByName(
-            "FlowStatsReceived", self.handle_flow_stats)
-
         log.debug("Started Switch.")
 
-        threading.Thread(target=self.webserver_worker).start()
-
-    def webserver_worker(self):
-        app = Flask(__name__)
-
-        @app.route("/")
-        def hello():
-            return render_template("index.html")
+    def flow_count(self):
+        return len(self.flow_table)
+
+    def dmz_count(self):
+        return self.flow_table.dmz_count()
+
+    def hot_matches(self):
+        """ Returns the matches of the flows tiered polling watches. """
+        self._resolve_dpi()
+        table = self.flow_table
+        return [table.flows[row].match for row in table.hot(
+            _hot_fraction * self.threshold, self._dpi_ports)]
+
+    def _resolve_dpi(self):
+        """ Looks up the DPI ports' numbers, in ring order. """
+        self._dpi_ports = [self.ports.get(name) for name in self.dpi.names]
+        return self._dpi_ports
+
+    def _assign(self, flow, entry):
+        """ Notes the DPI an entry sends its flow to, if it does. """
+        for action in entry.actions:
+            if getattr(action, 'port', None) in self._dpi_ports:
+                flow.dpi_port = action.port
+                return
 
-        @app.route("/data")
-        def data():
-            # convert tuples to strings and send
-            return json.dumps({str(k): v for k, v in self._flow_bandwidths.iteritems()})
+    def _dpi_for(self, flow):
+        """
+        Returns the DPI port a flow is inspected on. A flow never seen
+        going through one is placed on the ring now and stays there.
+        """
+        if flow.dpi_port is None:
+            flow.dpi_port = self._dpi_ports[self.dpi.lookup(flow.match)]
+        return flow.dpi_port
+
+    def rebalance(self, port_rates):
+        """
+        Reweights the DPI ring by the rate each DPI port was last seen
+        sending at, and updates the elephant threshold to match.
+        """
+        loads = [port_rates.get(port, (0, None))[1]
+                 for port in self._resolve_dpi()]
+        if None in loads:
+            return
+        if self.dpi.rebalance(loads, _dpi_capacity):
+            log.debug("%s: DPI weights now %s" % (
+                dpid_to_str(self.dpid), ", ".join(
+                    "%s=%.2f" % (name, weight * scale) for name, weight, scale
+                    in zip(self.dpi.names, self.dpi.weights, self.dpi.scales))))
+        self.threshold = self.dpi.threshold(THRESHOLD_BITS_PER_SEC)
+
+    def handle_flow_stats(self, event, full=True, last=True):
+        """
+        Processes a flow stats reply. A reply that is not `full` covers only
+        some flows, so flows missing from it are not aged; its rates reach
+        the dashboard once the `last` reply of the round is in.
+
+        When streaming, whatever handle_stats_part() has not already taken
+        from the reply is queued behind its parts, followed by the
+        end-of-reply bookkeeping.
+        """
+        if _stream_stats:
+            if event.stats:
+                self._chunks.append((event.stats, None))
+            self._chunks.append((None, (full, last)))
+            self._schedule_chunk()
+        else:
+            self._process_stats(event.stats)
+            self._end_reply(full, last)
+
+    def handle_stats_part(self, part):
+        """
+        Queues one part of a multipart flow stats reply for processing.
+        The entries are taken from the part, so POX does not keep every
+        part's entries until the last part arrives.
+        """
+        entries, part.body = part.body, []
+        if entries:
+            self._chunks.append((entries, None))
+            self._schedule_chunk()
+
+    def _schedule_chunk(self):
+        # One queued chunk per turn of the event loop, so packet-ins
+        # are handled in between
+        if not self._chunk_soon:
+            self._chunk_soon = True
+            core.callLater(self._next_chunk)
+
+    def _next_chunk(self):
+        self._chunk_soon = False
+        if not self._chunks:
+            return
+        entries, end = self._chunks.popleft()
+        if entries is not None:
+            self._process_stats(entries)
+        else:
+            self._end_reply(*end)
+        if self._chunks:
+            self._schedule_chunk()
+
+    def _process_stats(self, entries):
+        """ Updates rates and reroutes flows for some of a reply's entries. """
+        start = current_time = time.time()
+        self._resolve_dpi()
+        # Coarse rules never carry an elephant, so only 5-tuple entries
+        # are tracked
+        stats = [f for f in entries if is_flow_match(f.match)]
+        table = self.flow_table
+
+        keys = [flow_key(f.match) for f in stats]
+        rows = table.lookup(keys)
+        new = np.flatnonzero(rows < 0)
+        for i in new:
+            flow = Flow(stats[i].match)
+            self._assign(flow, stats[i])
+            rows[i] = table.add(keys[i], flow)
+        if self._reconciling:
+            self._reconcile(stats, rows, new)
+
+        byte_counts = np.fromiter(
+            (f.byte_count for f in stats), np.uint64, len(stats))
+        durations = np.fromiter(
+            (f.duration_sec + f.duration_nsec / 1e9 for f in stats),
+            np.float64, len(stats))
+        rates = table.update(rows, byte_counts, durations, current_time)
+        labels = [table.flows[row].label for row in rows]
+        self._reply_rows.append(rows)
+        self.history.record(labels, rates, current_time)
+
+        # look through all flows for elephants and for mice leaving the
+        # DMZ, ignoring flows coming from the DPI. DMZ timeouts are left
+        # to the timer wheel.
+        elephants, mice, prevented = table.classify(
+            rows, self.threshold, self._dpi_ports)
+        if prevented:
+            self.metrics.flaps_prevented.inc(self.labels, prevented)
+
+        for row in elephants:
+            current_flow = table.flows[row]
+            port = self.macToPort.get(current_flow.match.dl_dst)
+            if port is None:
+                # Flooding would send it through the DPI too; wait until
+                # we know where it goes
+                table.demote(row)
+                continue
+            self._send_flow_mod(current_flow.get_flow_table_mod_msg(port),
+                                'elephant')
+            self.timers.schedule((self.dpid, table.keys[row]),
+                                 current_time + random_timeout(), DMZ_EXPIRED)
+            self._log_reroute(ELEPHANT, row)
+
+        for row in mice:
+            flow = table.flows[row]
+            self._send_flow_mod(
+                flow.get_flow_table_mod_msg(self._dpi_for(flow)), 'mouse')
+            self.timers.cancel((self.dpid, table.keys[row]))
+            self._log_reroute(MOUSE, row)
+
+        # Send these reroutes in one write
+        self.flow_mods.flush()
+        self._reply_seconds += time.time() - start
+
+    def _end_reply(self, full, last):
+        """ Publishes a finished reply's rates and ages the flow table. """
+        start = time.time()
+        table = self.flow_table
+
+        # Forget flows that are no longer on the switch. Right after
+        # connecting, anything missing from the switch is already gone.
+        if full:
+            self._forget(table.age(
+                np.concatenate(self._reply_rows + [np.zeros(0, np.intp)]),
+                1 if self._reconciling else FLOW_AGE_MISSED_REPLIES))
+            if self._reconciling:
+                self._resume_timers()
+        self._reply_rows = []
+        self._forget(table.evict(self.max_flows))
+
+        if full or last:
+            self.feed.publish(table.ranking())
+        if log.isEnabledFor(logging.DEBUG):
+            total_bytes, bytes_per_flow = table.memory_usage()
+            log.debug("%s: tracking %d flows in %d bytes, %d bytes per flow"
+                      % (dpid_to_str(self.dpid), len(table), total_bytes,
+                         bytes_per_flow))
+        self._observe_reply(start)
+
+    def _observe_reply(self, start):
+        """ Records the time the reply ending now took, all parts included. """
+        self.metrics.flow_stats_seconds.observe(
+            self.labels, self._reply_seconds + time.time() - start)
+        self._reply_seconds = 0.0
+
+    def _reconcile(self, stats, rows, new):
+        """
+        Takes a reply's flows as the switch has them. New rows pick up
+        their checkpointed counters, so their rates carry on, and a flow
+        the switch has one of our reroutes for is in the DMZ exactly when
+        that reroute bypasses the DPI.
+        """
+        table = self.flow_table
+        index, records = self.state.restored
+        for i in new if index else ():
+            record = index.get(compact_key(stats[i].match))
+            if record is not None:
+                record = records[record]
+                for name in ('total_bytes', 'duration', 'last_time', 'rate',
+                             'backoff'):
+                    getattr(table, name)[rows[i]] = record[name]
+        bypass = np.array([is_reroute(f, self._dpi_ports) for f in stats],
+                          np.bool_)
+        table.in_dmz[rows] = bypass
+        table.backoff[rows[bypass]] = False
+
+    def _resume_timers(self):
+        """
+        Ends reconciling: flows in the DMZ or backing off get fresh timers,
+        since theirs may have fired while the switch was away.
+        """
+        self._reconciling = False
+        self.state.restored = ({}, None)
+        table = self.flow_table
+        size = table.size
+        now = time.time()
+        for row in np.flatnonzero(table.live[:size] & ~table.in_dmz[:size] &
+                                  ~table.backoff[:size]):
+            self.timers.cancel((self.dpid, table.keys[row]))
+        for row in np.flatnonzero(table.in_dmz[:size]):
+            self.timers.schedule((self.dpid, table.keys[row]),
+                                 now + random_timeout(), DMZ_EXPIRED)
+        for row in np.flatnonzero(table.backoff[:size] & ~table.in_dmz[:size]):
+            self.timers.schedule((self.dpid, table.keys[row]),
+                                 now + random_timeout(), BACKOFF_EXPIRED)
+        log.debug("%s: reconciled %d flows, %d in the DMZ" %
+                  (dpid_to_str(self.dpid), len(table), table.dmz_count()))
+
+    def handle_timer(self, key, action):
+        """ Acts on a flow's DMZ or back-off timer running out. """
+        table = self.flow_table
+        row = table.index.get(key)
+        if row is None:
+            return
 
-        app.run(host='0.0.0.0')
+        if action == DMZ_EXPIRED:
+            self._resolve_dpi()
+            table.kick(row)
+            self.timers.schedule((self.dpid, key),
+                                 time.time() + random_timeout(),
+                                 BACKOFF_EXPIRED)
+            flow = table.flows[row]
+            self._send_flow_mod(
+                flow.get_flow_table_mod_msg(self._dpi_for(flow)), 'kick')
+            self._log_reroute(KICK, row)
+        elif action == BACKOFF_EXPIRED:
+            table.release(row)
+
+    def _send_flow_mod(self, msg, reason):
+        self.metrics.flow_mods.inc(self._reason_labels[reason])
+        self.flow_mods.send(msg)
+
+    def _forget(self, keys):
+        for key in keys:
+            self.timers.cancel((self.dpid, key))
+
+    def _handle_FlowRemoved(self, event):
+        row = self.flow_table.index.get(flow_key(event.ofp.match))
+        if row is not None:
+            self._forget(self.flow_table.remove([row]))
+
+    def _log_reroute(self, action, row):
+        table = self.flow_table
+        flow = table.flows[row]
+        if _journal is not None:
+            _journal.write(time.time(), self.dpid, int(table.nw_src[row]),
+                           int(table.nw_dst[row]),
+                           flow.transport_layer_src or 0,
+                           flow.transport_layer_dst or 0,
+                           flow.hardware_port or 0, action,
+                           float(table.rate[row]),
+                           int(table.total_bytes[row]))
+        # Only build the message if someone will read it
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s %s: %s:%s -> %s:%s, Inport: %d, Bytes: %d, "
+                      "Rate: %f" %
+                      (datetime.datetime.now(),
+                       REROUTE_MESSAGES[action],
+                       flow.network_layer_src,
+                       flow.transport_layer_src,
+                       flow.network_layer_dst,
+                       flow.transport_layer_dst,
+                       flow.hardware_port,
+                       table.total_bytes[row],
+                       table.rate[row]))
+
+    def _flood(self, event, message=None):
+        """ Floods the packet """
+        msg = of.ofp_packet_out()
+        if time.time() - self.connection.connect_time >= _flood_delay:
+            # Only flood if we've been connected for a little while...
+
+            if self.hold_down_expired is False:
+                # Oh yes it is!
+                self.hold_down_expired = True
+                log.info("%s: Flood hold-down expired -- flooding",
+                         dpid_to_str(event.dpid))
+
+            if message is not None:
+                log.debug(message)
+            #log.debug("%i: flood %s -> %s", event.dpid,packet.src,packet.dst)
+            # OFPP_FLOOD is optional; on some switches you may need to change
+            # this to OFPP_ALL.
+            msg.actions.append(
+                of.ofp_action_output(port=of.OFPP_FLOOD))
+            self.metrics.floods.inc(self.labels)
+        else:
+            pass
+            #log.info("Holding down flood for %s", dpid_to_str(event.dpid))
+        msg.data = event.ofp
+        msg.in_port = event.port
+        self.connection.send(msg)
+
+    def _drop(self, event, duration=None):
+        """
+        Drops this packet and optionally installs a flow to continue
+        dropping similar ones for a while
+        """
+        log.debug("Dropping packet")
+        self.metrics.drops.inc(self.labels)
+        if duration is not None:
+            if not isinstance(duration, tuple):
+                duration = (duration, duration)
+                msg = of.ofp_flow_mod()
+                msg.match = of.ofp_match.from_packet(event.parsed)
+                msg.idle_timeout = duration[0]
+                msg.hard_timeout = duration[1]
+                msg.buffer_id = event.ofp.buffer_id
+                self._send_flow_mod(msg, 'drop')
+            elif event.ofp.buffer_id is not None:
+                msg = of.ofp_packet_out()
+                msg.buffer_id = event.ofp.buffer_id
+                msg.in_port = event.port
+                self.connection.send(msg)
 
-    def _statistic(self):
-        for con in core.openflow.connections:
-            con.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
-        threading.Timer(FLOW_STATS_INTERVAL_SECS, self._statistic).start()
+    def _discard(self, event):
+        """ Frees the switch buffer holding the packet, if there is one """
+        self.metrics.drops.inc(self.labels)
+        if event.ofp.buffer_id is not None:
+            self.connection.send(of.ofp_packet_out(
+                buffer_id=event.ofp.buffer_id, in_port=event.port))
+
+    def _admit(self, event):
+        """
+        Charges a packet-in to its ingress port's token bucket and tells
+        whether it may take the full learning path.
+        """
+        bucket = self._admission.get(event.port)
+        if bucket is None:
+            bucket = self._admission[event.port] = TokenBucket(
+                _packet_in_rate, _packet_in_rate * PACKET_IN_BURST_SECS)
+        return bucket.take() == 1
+
+    def _learn_host(self, packet, port):
+        """ Caches where the sender of an ARP or IP packet is. """
+        arp_packet = packet.find('arp')
+        if arp_packet is not None:
+            # Probes come from 0.0.0.0 and say nothing about the sender
+            if arp_packet.protosrc != IP_ANY:
+                self.hosts.learn(arp_packet.protosrc, arp_packet.hwsrc, port)
+            return
+        ip = packet.find('ipv4')
+        if ip is not None:
+            self.hosts.learn(ip.srcip, packet.src, port)
+
+    def _answer_arp(self, event):
+        """
+        Answers an ARP request from the host cache. Returns False if the
+        host is not cached, leaving the request to be flooded.
+
+        Gratuitous ARP and probes for the sender's own address are never
+        answered. They are meant for the other hosts: one announces a new
+        or moved address, the other checks that no one else has it.
+        """
+        request = event.parsed.next
+        if request.protosrc == request.protodst:
+            return False
+        host = self.hosts.get(request.protodst)
+        if host is not None and host[0] == request.hwsrc:
+            return False
+        if host is None:
+            self.metrics.arp_requests.inc(self._arp_labels['missed'])
+            return False
+        reply = createArpReply(event.parsed, request.protodst, host[0], log)
+        msg = of.ofp_packet_out()
+        msg.data = reply.pack()
+        msg.actions.append(of.ofp_action_output(port=of.OFPP_IN_PORT))
+        msg.in_port = event.port
+        self.connection.send(msg)
+        if event.ofp.buffer_id is not None:
+            self.connection.send(of.ofp_packet_out(
+                buffer_id=event.ofp.buffer_id, in_port=event.port))
+        self.metrics.arp_requests.inc(self._arp_labels['answered'])
+        return True
 
-    def handle_flow_stats(self, event):
-        self._dpi_port = getOpenFlowPort(self.connection, self.dpi_port)
-        self._flow_bandwidths.clear()
-        current_time = time.time()
+    def _handle_PacketIn(self, event):
+        start = time.time()
+        self.metrics.packet_ins.inc(self.labels)
+        self._packet_in(event)
+        self.metrics.packet_in_seconds.observe(self.labels,
+                                               time.time() - start)
 
-        # look through all flows and look for elephant flows
-        for f in event.stats:
-            # Create an identification key for this flow using the send/recieve
-            # ports and hardware interface
-            key = (f.match.nw_src, f.match.nw_dst,
-                   f.match.tp_src, f.match.tp_dst, f.match.in_port)
+    def _packet_in(self, event):
+        packet = event.parsed
 
-            current_flow = None
-            if key in self.flows:
-                current_flow = self.flows[key]
-            elif key in self.dmz_flows:
-                current_flow = self.dmz_flows[key]
+        # Under a packet-in storm, skip learning and rule installation
+        if _packet_in_rate is not None and not self._admit(event):
+            self.packet_ins_limited += 1
+            self.metrics.packet_ins_limited.inc(self.labels)
+            if _storm_action == 'flood':
+                self._flood(event)
             else:
-                current_flow = self.flows[key] = Flow(f.match)
-
-            current_flow.update_total_bytes_transferred(f.byte_count)
-            transmission_rate_bits = current_flow.get_average_rate()
-
-            self._flow_bandwidths[key] = transmission_rate_bits
-
-            # Do not look for elephant flows coming from the DPI.
-            if f.match.in_port == self._dpi_port:
-                continue
-
-            # If Elephant flow is detected
-            if not key in self.dmz_flows and transmission_rate_bits > THRESHOLD_BITS_PER_SEC and current_time >= current_flow.sample_timeout:
-                self.dmz_flows[key] = current_flow
-                del self.flows[key]
-
-                if f.match.dl_dst in self.macToPort:
-                    #current_flow.timeout = current_time + random.randint(RANDOM_TIMEOUT['min'], RANDOM_TIMEOUT['max'])
-                    current_flow.timeout = current_time + RANDOM_TIMEOUT['max'] # use a fixed timeout for experiments
-                    self.connection.send(
-                        current_flow.get_flow_table_mod_msg(self.macToPort[f.match.dl_dst]))
-                else:
-                    self.connection.send(
-                        current_flow.get_flow_table_mod_msg(of.OFPP_FLOOD))
-
-                log.debug("%s ELEPHANT FLOW REROUTED: %s:%s -> %s:%s, Inport: %d, Bytes: %d, Rate: %f" %
-                          (datetime.datetime.now(),
-                           current_flow.network_layer_src,
-                           current_flow.transport_layer_src,
-                           current_flow.network_layer_dst,
-                           current_flow.transport_layer_dst,
-                           current_flow.hardware_port,
-                           current_flow.total_bytes,
-                           transmission_rate_bits))
-
-            #if a mouse flow was detected in the DMZ
-            elif key in self.dmz_flows and transmission_rate_bits < THRESHOLD_BITS_PER_SEC:
-                self.flows[key] = current_flow
-                del self.dmz_flows[key]
-
-                self.connection.send(current_flow.get_flow_table_mod_msg(self._dpi_port))
-                log.debug("%s MOUSE FLOW REROUTED: %s:%s -> %s:%s, Inport: %d, Bytes: %d, Rate: %f" %
-                          (datetime.datetime.now(),
-                           current_flow.network_layer_src,
-                           current_flow.transport_layer_src,
-                           current_flow.network_layer_dst,
-                           current_flow.transport_layer_dst,
-                           current_flow.hardware_port,
-                           current_flow.total_bytes,
-                           transmission_rate_bits))
-
-            #check for DMZ timeouts
-            if key in self.dmz_flows and current_time >= current_flow.timeout:
-                self.flows[key] = current_flow
-                del self.dmz_flows[key]
-                #current_flow.sample_timeout = current_time + random.randint(RANDOM_TIMEOUT['min'], RANDOM_TIMEOUT['max'])
-                current_flow.sample_timeout = current_time + RANDOM_TIMEOUT['max'] # use a fixed timeout for experiments
-
-                self.connection.send(current_flow.get_flow_table_mod_msg(self._dpi_port))
-                log.debug("%s ELEPHANT FLOW KICKED: %s:%s -> %s:%s, Inport: %d, Bytes: %d, Rate: %f" %
-                          (datetime.datetime.now(),
-                           current_flow.network_layer_src,
-                           current_flow.transport_layer_src,
-                           current_flow.network_layer_dst,
-                           current_flow.transport_layer_dst,
-                           current_flow.hardware_port,
-                           current_flow.total_bytes,
-                           transmission_rate_bits))
-
+                self._discard(event)
+            return
 
+        self._resolve_dpi()
 
-    def _handle_PacketIn(self, event):
-        packet = event.parsed
+        if _proxy_arp and event.port not in self._dpi_ports:
+            self._learn_host(packet, event.port)
+            if packetIsRequestARP(packet, log) and self._answer_arp(event):
+                return
 
-        def flood(message=None):
-            """ Floods the packet """
-            msg = of.ofp_packet_out()
-            if time.time() - self.connection.connect_time >= _flood_delay:
-                # Only flood if we've been connected for a little while...
-
-                if self.hold_down_expired is False:
-                    # Oh yes it is!
-                    self.hold_down_expired = True
-                    log.info("%s: Flood hold-down expired -- flooding",
-                             dpid_to_str(event.dpid))
-
-                if message is not None:
-                    log.debug(message)
-                #log.debug("%i: flood %s -> %s", event.dpid,packet.src,packet.dst)
-                # OFPP_FLOOD is optional; on some switches you may need to change
-                # this to OFPP_ALL.
-                msg.actions.append(
-                    of.ofp_action_output(port=of.OFPP_FLOOD))
-            else:
-                pass
-                #log.info("Holding down flood for %s", dpid_to_str(event.dpid))
-            msg.data = event.ofp
-            msg.in_port = event.port
-            self.connection.send(msg)
-
-        def drop(duration=None):
-            """
-            Drops this packet and optionally installs a flow to continue
-            dropping similar ones for a while
-            """
-            log.debug("Dropping packet")
-            if duration is not None:
-                if not isinstance(duration, tuple):
-                    duration = (duration, duration)
-                    msg = of.ofp_flow_mod()
-                    msg.match = of.ofp_match.from_packet(packet)
-                    msg.idle_timeout = duration[0]
-                    msg.hard_timeout = duration[1]
-                    msg.buffer_id = event.ofp.buffer_id
-                    self.connection.send(msg)
-                elif event.ofp.buffer_id is not None:
-                    msg = of.ofp_packet_out()
-                    msg.buffer_id = event.ofp.buffer_id
-                    msg.in_port = event.port
-                    self.connection.send(msg)
-
-
-        self._dpi_port = getOpenFlowPort(self.connection, self.dpi_port)
-
-        if not packet.dst.is_multicast and event.port != self._dpi_port:
+        if not packet.dst.is_multicast and event.port not in self._dpi_ports:
             self.macToPort[packet.src] = event.port
-            msg = of.ofp_flow_mod()
-            msg.match = of.ofp_match.from_packet(packet, event.port)
-            msg.idle_timeout = FLOW_ENTRY_IDLE_TIMEOUT_SECS
-            msg.hard_timeout = FLOW_ENTRY_HARD_TIMEOUT_SECS
-            msg.actions.append(of.ofp_action_output(port=self._dpi_port))
-            msg.data = event.ofp
-            self.connection.send(msg)
+            match, priority = build_match(packet, event.port, True)
+            self._send_flow_mod(self.rules.build(
+                self._dpi_ports[self.dpi.lookup(match)], match, priority,
+                event.ofp), 'learn')
             #log.debug("Create Flow Table Entry: %s:%s -> %s:%s, ingress interface: %s" %
             #          (msg.match.nw_src, msg.match.tp_src, msg.match.nw_dst, msg.match.tp_dst, event.port))
             return
 
         if not self.transparent:
             if packet.type == packet.LLDP_TYPE or packet.dst.isBridgeFiltered():
-                drop()
+                self._drop(event)
                 return
 
         if packet.dst.is_multicast:
-            flood()
+            self._flood(event)
         else:
             if packet.dst not in self.macToPort:
-                flood("Port for %s unknown -- flooding" % (packet.dst,))
+                self._flood(event, "Port for %s unknown -- flooding" % (packet.dst,))
             else:
                 port = self.macToPort[packet.dst]
                 if port == event.port:
@@ -337,37 +951,447 @@ class SizeBasedDynamicDmzSwitch (object):
                                 (packet.src, packet.dst, dpid_to_str(event.dpid), port))
                     return
 
-                msg = of.ofp_flow_mod()
-                msg.match = of.ofp_match.from_packet(packet, event.port)
-                msg.idle_timeout = FLOW_ENTRY_IDLE_TIMEOUT_SECS
-                msg.hard_timeout = FLOW_ENTRY_HARD_TIMEOUT_SECS
-                msg.actions.append(of.ofp_action_output(port=port))
-                msg.data = event.ofp
-                self.connection.send(msg)
+                match, priority = build_match(packet, event.port, False)
+                self._send_flow_mod(self.rules.build(
+                    port, match, priority, event.ofp), 'learn')
                 #log.debug("Create Flow Table Entry: %s:%s -> %s:%s, ingress interface: %s" %
                 #          (msg.match.nw_src, msg.match.tp_src, msg.match.nw_dst, msg.match.tp_dst, event.port))
 
 
+class PooledDmzSwitch (SizeBasedDynamicDmzSwitch):
+    """
+    A switch whose flow stats are processed by a StatsWorkerPool.
+
+    Here a reply's entries are only reduced to arrays of compact keys
+    and counters and sent to the switch's worker, which keeps the flow
+    table and history. The worker answers with the entries to reroute,
+    and the flow_mods are sent once it does. Matches are only kept for
+    flows in the DMZ, whose timers still run here, and for the hot flows
+    tiered polling asks for.
+    """
+
+    def __init__(self, pool, *args):
+        SizeBasedDynamicDmzSwitch.__init__(self, *args)
+        self.pool = pool
+        # Kept in the state so a reconnecting switch can still kick and
+        # release them; their timers may have fired while it was away
+        self._dmz = self.state.dmz
+        self._backoff = self.state.backoff
+        self._hot = {}
+        now = time.time()
+        for key in self._dmz:
+            self.timers.schedule((self.dpid, key), now + random_timeout(),
+                                 DMZ_EXPIRED)
+        for key in self._backoff:
+            self.timers.schedule((self.dpid, key), now + random_timeout(),
+                                 BACKOFF_EXPIRED)
+        self._flows = 0
+        self._dmz_flows = 0
+
+    def flow_count(self):
+        return self._flows
+
+    def dmz_count(self):
+        return self._dmz_flows
+
+    def hot_matches(self):
+        return list(self._hot.values())
+
+    def _process_stats(self, entries):
+        start = time.time()
+        self._resolve_dpi()
+        stats = [f for f in entries if is_flow_match(f.match)]
+        keys = np.array([compact_key(f.match) for f in stats],
+                        np.int64).reshape(-1, 5)
+        byte_counts = np.fromiter(
+            (f.byte_count for f in stats), np.uint64, len(stats))
+        durations = np.fromiter(
+            (f.duration_sec + f.duration_nsec / 1e9 for f in stats),
+            np.float64, len(stats))
+        self.pool.send(self.dpid, 'stats',
+                       (keys, byte_counts, durations, start,
+                        self.threshold, _hot_fraction * self.threshold,
+                        self._dpi_ports),
+                       partial(self._reroute, stats))
+        self._reply_seconds += time.time() - start
+
+    def _log_reroute(self, action, key, flow, rate=0.0, byte_count=0):
+        """ Journals a reroute; the workers know a kicked flow's numbers. """
+        if _journal is not None:
+            _journal.write(time.time(), self.dpid, key[0], key[1], key[2],
+                           key[3], key[4], action, rate, byte_count)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s: %s" % (REROUTE_MESSAGES[action], flow.label))
+
+    def _reroute(self, stats, result):
+        if isinstance(result, WorkerError):
+            log.error("%s: %s" % (dpid_to_str(self.dpid), result))
+            return
+        elephants, mice, hot, rates = result
+        now = time.time()
+        for i, rate in zip(elephants, rates):
+            key = compact_key(stats[i].match)
+            port = self.macToPort.get(stats[i].match.dl_dst)
+            if port is None:
+                self.pool.send(self.dpid, 'demote', (key,))
+                continue
+            flow = self._dmz[key] = Flow(stats[i].match)
+            self._assign(flow, stats[i])
+            self._send_flow_mod(flow.get_flow_table_mod_msg(port),
+                                'elephant')
+            self.timers.schedule((self.dpid, key),
+                                 now + random_timeout(), DMZ_EXPIRED)
+            self._log_reroute(ELEPHANT, key, flow, rate, stats[i].byte_count)
+        for i, rate in zip(mice, rates[len(elephants):]):
+            key = compact_key(stats[i].match)
+            flow = self._dmz.pop(key, None) or Flow(stats[i].match)
+            self._send_flow_mod(
+                flow.get_flow_table_mod_msg(self._dpi_for(flow)), 'mouse')
+            self.timers.cancel((self.dpid, key))
+            self._log_reroute(MOUSE, key, flow, rate, stats[i].byte_count)
+        for i in hot:
+            self._hot[compact_key(stats[i].match)] = stats[i].match
+        self.flow_mods.flush()
+
+    def _end_reply(self, full, last):
+        start = time.time()
+        self._resolve_dpi()
+        self.pool.send(self.dpid, 'end',
+                       (full, last, self.max_flows, FLOW_AGE_MISSED_REPLIES,
+                        _hot_fraction * self.threshold,
+                        self._dpi_ports, self.feed.top_flows),
+                       self._publish)
+        self._observe_reply(start)
+
+    def _publish(self, result):
+        if isinstance(result, WorkerError):
+            log.error("%s: %s" % (dpid_to_str(self.dpid), result))
+            return
+        forgotten, hot, summary = result
+        for key in forgotten:
+            self._dmz.pop(key, None)
+            self._backoff.discard(key)
+        self._forget(forgotten)
+        self._hot = dict((key, self._hot[key]) for key in hot
+                         if key in self._hot)
+        if summary is not None:
+            top, total, self._flows, self._dmz_flows = summary
+            self.feed.publish(RemoteRanking(self.pool, self.dpid, top, total,
+                                            self._flows))
+
+    def handle_timer(self, key, action):
+        if action == DMZ_EXPIRED:
+            flow = self._dmz.pop(key, None)
+            if flow is None:
+                return
+            self._resolve_dpi()
+            self.pool.send(self.dpid, 'kick', (key,))
+            self._backoff.add(key)
+            self.timers.schedule((self.dpid, key),
+                                 time.time() + random_timeout(),
+                                 BACKOFF_EXPIRED)
+            self._send_flow_mod(
+                flow.get_flow_table_mod_msg(self._dpi_for(flow)), 'kick')
+            self._log_reroute(KICK, key, flow)
+        elif action == BACKOFF_EXPIRED:
+            self._backoff.discard(key)
+            self.pool.send(self.dpid, 'release', (key,))
+
+    def _handle_FlowRemoved(self, event):
+        if not is_flow_match(event.ofp.match):
+            return
+        key = compact_key(event.ofp.match)
+        self._dmz.pop(key, None)
+        self._backoff.discard(key)
+        self._hot.pop(key, None)
+        self.pool.send(self.dpid, 'remove', (key,))
+        self._forget([key])
+
+
 class l2_learning (object):
     """
     Waits for OpenFlow switches to connect and makes them learning switches.
     """
 
-    def __init__(self, transparent, dpi_port):
+    def __init__(self, transparent, dpi_port, poll_interval, sweep_interval,
+                 port_gating, new_estimator, max_flows, flow_mod_rate,
+                 history_budget, pool=None, checkpoints=None,
+                 checkpoint_interval=CHECKPOINT_INTERVAL_SECS):
         core.openflow.addListeners(self)
         self.transparent = transparent
         self.dpi_port = dpi_port
+        self.max_flows = max_flows
+        self.flow_mod_rate = flow_mod_rate
+        self.pool = pool
+        self.metrics = ControllerMetrics()
+        self._add_gauges(self.metrics)
+        self.poller = StatsPoller(
+            poll_interval, self.metrics, sweep_interval, self._hot_flows,
+            self._gate_threshold if port_gating else None, self._dpi_ports,
+            self._port_rates_updated)
+        self.flow_states = FlowStateRegistry(new_estimator, history_budget,
+                                             pool)
+        self.switches = {}
+        self.checkpoints = checkpoints
+        self._down_since = {}
+        self.timers = TimerWheel(TIMER_WHEEL_TICK_SECS, time.time())
+        Timer(TIMER_WHEEL_TICK_SECS, self._expire_timers, recurring=True)
+        self._writer = None
+        if checkpoints is not None:
+            # Only the copying is done here; the disk is the writer's
+            self._writer = CheckpointWriter(checkpoints)
+            Timer(checkpoint_interval, self._checkpoint_all, recurring=True)
+            core.addListenerByName("GoingDownEvent", self._handle_GoingDown)
+        self.api = WebApi(self.flow_states, self.metrics,
+                          self.poller.port_rates)
+        self.api.start()
 
     def _handle_ConnectionUp(self, event):
         log.debug("Connection %s" % (event.connection,))
-        SizeBasedDynamicDmzSwitch(
-            event.connection, self.transparent, self.dpi_port)
-
+        self._down_since.pop(event.dpid, None)
+        known = event.dpid in self.flow_states
+        state = self.flow_states.get(event.dpid)
+        if not known and self.checkpoints is not None:
+            state.restore(*self.checkpoints.load(event.dpid))
+            log.info("%s: restored %d MAC addresses and %d flows" %
+                     (dpid_to_str(event.dpid), len(state.macToPort),
+                      len(state.restored[0])))
+        args = (event.connection, self.transparent, self.dpi_port,
+                state, self.max_flows, self.timers,
+                self.flow_mod_rate, self.metrics)
+        if self.pool is None:
+            self.switches[event.dpid] = SizeBasedDynamicDmzSwitch(*args)
+        else:
+            self.switches[event.dpid] = PooledDmzSwitch(self.pool, *args)
+
+    def _handle_ConnectionDown(self, event):
+        # The state outlives the connection for a while, so a switch that
+        # reconnects picks up where it left off
+        self.switches.pop(event.dpid, None)
+        self._checkpoint(event.dpid)
+        self._down_since[event.dpid] = time.time()
+        core.callDelayed(STATE_RETENTION_SECS, self._retire, event.dpid)
+
+    def _retire(self, dpid):
+        since = self._down_since.get(dpid)
+        if since is not None and \
+                time.time() - since >= STATE_RETENTION_SECS:
+            del self._down_since[dpid]
+            self.flow_states.discard(dpid)
+
+    def _checkpoint(self, dpid):
+        state = self.flow_states.find(dpid)
+        if self._writer is None or state is None:
+            return
+        self._writer.save(dpid, *state.checkpoint())
+
+    def _checkpoint_all(self):
+        for dpid in self.flow_states.dpids():
+            self._checkpoint(dpid)
+
+    def _handle_GoingDown(self, event):
+        self._checkpoint_all()
+        self._writer.close()
+
+    def _add_gauges(self, metrics):
+        def per_switch(measure):
+            return lambda: dict((switch.labels, measure(switch))
+                                for switch in list(self.switches.values()))
+
+        metrics.gauge('dmz_flows', 'Flows tracked',
+                      per_switch(lambda switch: switch.flow_count()))
+        metrics.gauge('dmz_dmz_flows', 'Flows bypassing the DPI',
+                      per_switch(lambda switch: switch.dmz_count()))
+        metrics.gauge('dmz_mac_table_entries', 'Learned MAC addresses',
+                      per_switch(lambda switch: len(switch.macToPort)))
+        metrics.gauge('dmz_elephant_threshold_bits_per_second',
+                      'Rate above which flows bypass the DPI',
+                      per_switch(lambda switch: switch.threshold))
+        metrics.gauge('dmz_host_cache_entries',
+                      'IP addresses in the proxy ARP host cache',
+                      per_switch(lambda switch: len(switch.hosts)))
+        metrics.gauge('dmz_flow_mods_queued', 'flow_mods waiting to be sent',
+                      per_switch(lambda switch: switch.flow_mods.depth))
+
+        def port_rates(direction):
+            return lambda: dict(
+                ((('dpid', dpid_to_str(dpid)), ('port', port)),
+                 rates[direction])
+                for dpid, ports in list(self.poller.port_rates.items())
+                for port, rates in ports.items())
+
+        metrics.gauge('dmz_port_rx_bits_per_second',
+                      'Port receive rate, with port gating', port_rates(0))
+        metrics.gauge('dmz_port_tx_bits_per_second',
+                      'Port transmit rate, with port gating', port_rates(1))
+
+        if self.pool is None:
+            return
 
-def launch(transparent=False, hold_down=_flood_delay, dpi_port='eth0'):
+        def worker_counter(name):
+            return lambda: dict(
+                ((('worker', str(i)),), value)
+                for i, value in enumerate(self.pool.counters()[name]))
+
+        for name in WORKER_COUNTERS:
+            metrics.gauge('dmz_worker_%s' % (name,),
+                          'Stats worker %s, from shared memory' % (
+                              name.replace('_', ' '),),
+                          worker_counter(name))
+
+    def _gate_threshold(self, dpid):
+        switch = self.switches.get(dpid)
+        threshold = THRESHOLD_BITS_PER_SEC if switch is None else \
+            switch.threshold
+        if _policy is not None:
+            # A port this slow cannot carry a flow any rule would promote
+            threshold *= _policy.up.min()
+        return threshold
+
+    def _dpi_ports(self, dpid):
+        switch = self.switches.get(dpid)
+        if switch is None:
+            return ()
+        return switch._resolve_dpi()
+
+    def _hot_flows(self, dpid):
+        switch = self.switches.get(dpid)
+        if switch is None:
+            return []
+        return switch.hot_matches()
+
+    def _port_rates_updated(self, dpid, rates):
+        switch = self.switches.get(dpid)
+        if switch is not None:
+            switch.rebalance(rates)
+
+    def _expire_timers(self):
+        for (dpid, key), action in self.timers.advance(time.time()):
+            switch = self.switches.get(dpid)
+            if switch is not None:
+                switch.handle_timer(key, action)
+
+    def _handle_FlowStatsReceived(self, event):
+        kind, last = self.poller.reply(event)
+        # Only the switch that sent the reply gets to look at it
+        switch = self.switches.get(event.dpid)
+        if switch is not None:
+            switch.handle_flow_stats(event, kind == FULL, last)
+
+    def _handle_RawStatsReply(self, event):
+        # Streaming takes each part of our flow stats replies as it
+        # arrives; the FlowStatsReceived that follows the last part then
+        # only closes the reply.
+        if not _stream_stats:
+            return
+        switch = self.switches.get(event.dpid)
+        parts = event.ofp if isinstance(event.ofp, list) else [event.ofp]
+        for part in parts:
+            if switch is not None and part.type == of.OFPST_FLOW and \
+                    self.poller.request_kind(part.xid) in (FULL, TARGETED):
+                switch.handle_stats_part(part)
+
+
+def launch(transparent=False, hold_down=_flood_delay, dpi_port='eth0',
+           poll_interval=FLOW_STATS_INTERVAL_SECS, sweep_interval=None,
+           hot_fraction=HOT_FLOW_FRACTION, port_gating=False,
+           stream_stats=False,
+           estimator=RATE_ESTIMATOR,
+           window=RUNNING_AVERAGE_WINDOW,
+           time_constant=EWMA_TIME_CONSTANT_SECS,
+           max_flows=MAX_FLOWS_PER_SWITCH, fixed_timeout=False,
+           granularity=_rule_granularity, aggregate_prefix=_aggregate_prefix,
+           flow_mod_rate=MAX_FLOW_MODS_PER_SEC, packet_in_rate=_packet_in_rate,
+           storm_action=_storm_action, history_mb=HISTORY_BUDGET_MB,
+           workers=0, checkpoint_dir=None,
+           checkpoint_interval=CHECKPOINT_INTERVAL_SECS, proxy_arp=False,
+           host_timeout=HOST_TIMEOUT_SECS, dpi_capacity=None, policy=None,
+           up=None, down=None, dwell=None, journal=None,
+           journal_records=JOURNAL_RECORDS):
     """
     Starts an L2 learning switch.
+
+    dpi_port names the interface traffic is inspected on. Several DPI
+    appliances are given as a list with capacity weights, like
+    eth1:2,eth2:1 (weights default to 1). New flows are spread across
+    them by consistent hashing on the 5-tuple, both directions of a
+    connection on the same one, and a flow stays on its DPI. With
+    port_gating, the DPI ports' measured load shifts new flows toward the
+    less loaded ones. The elephant threshold grows with the number of DPI
+    ports; given dpi_capacity, the bits/sec one of them can inspect, it
+    is lowered again while the DPIs are over TARGET_UTILIZATION, never
+    below the one-DPI threshold.
+
+    Flow rates are estimated either over a sliding window of the last
+    `window` samples (estimator=window) or as a moving average with the
+    given time constant in seconds (estimator=ewma). At most max_flows
+    flows are tracked per switch; the least recently seen go first.
+    fixed_timeout replaces the random DMZ and back-off timeouts with
+    RANDOM_TIMEOUT['max'] for repeatable experiments.
+
+    granularity picks how specific reactive rules are: exact (every
+    header field), flow (5-tuple for TCP/UDP, destination MAC for non-IP)
+    or aggregate (flow, plus one rule per aggregate_prefix subnet for IP
+    traffic that is neither TCP nor UDP).
+
+    No switch is sent more than flow_mod_rate flow_mods per second. If
+    packet_in_rate is given, each ingress port gets that many packet-ins
+    per second through the learning path; the rest are flooded or dropped
+    (storm_action). Dropping them leaves their flows without a rule, so
+    they keep coming back as packet-ins.
+
+    Every flow's rate history is kept for the dashboard's /history
+    queries, raw and rolled up to 10 second and 1 minute min/avg/max,
+    in at most history_mb megabytes across all switches.
+
+    Every poll_interval seconds each switch is asked for its whole flow
+    table. Given a longer sweep_interval, polling is tiered instead: the
+    whole table is requested every sweep_interval, and in between only
+    flows in the DMZ or above hot_fraction of the threshold are.
+
+    port_gating asks for port stats before each flow poll, and only asks
+    for flows arriving on ports busy enough to carry an elephant, plus
+    the hot ones. The whole table is still asked for every few sweeps so
+    that stale flows age out. Port rates are shown on the dashboard.
+
+    stream_stats processes flow stats replies part by part as they
+    arrive, one part per turn of the event loop, instead of all at once
+    after the last part.
+
+    With workers above 0, flow stats are processed by that many worker
+    processes, each owning the flow tables and history of a share of the
+    switches, and the history budget is split between them. Only reroute
+    decisions come back to the POX thread.
+
+    Given a checkpoint_dir, each switch's learned MAC addresses and flow
+    table are saved there every checkpoint_interval seconds, when it
+    disconnects and when POX shuts down, and reloaded when it first
+    connects after a restart. Files are written on a thread of their own. Which flows are in the DMZ is taken from the
+    reroutes the switch still has. With workers, only MAC addresses are
+    saved. A switch that disconnects keeps its state for
+    STATE_RETENTION_SECS either way.
+
+    proxy_arp has the controller answer ARP requests itself from a cache
+    of where each IP address was last seen, filled from ARP and IP
+    packet-ins, so only requests for unknown hosts are flooded. A host not
+    seen for host_timeout seconds is forgotten.
+
+    Flows enter the DMZ above up times the elephant threshold and leave
+    it below down times the threshold, and not until dwell seconds after
+    they last moved, so a flow hovering around the threshold is not
+    rerouted every poll. A policy file can set these per source or
+    destination subnet, in_port or byte count; see policy.py. up, down
+    and dwell given on the commandline override its [default] section.
+
+    Given a journal file, every reroute decision is also recorded there
+    in binary, the last journal_records of them, for journal.py to search
+    by time, host or action. The debug log only describes them when debug
+    logging is on.
     """
+    global _fixed_timeout, _rule_granularity, _aggregate_prefix
+    global _packet_in_rate, _storm_action, _hot_fraction, _stream_stats
+    global _proxy_arp, _host_timeout, _dpi_capacity, _policy, _journal
+
     try:
         global _flood_delay
         _flood_delay = int(str(hold_down), 10)
@@ -375,4 +1399,114 @@ def launch(transparent=False, hold_down=_flood_delay, dpi_port='eth0'):
     except:
         raise RuntimeError("Expected hold-down to be a number")
 
-    core.registerNew(l2_learning, str_to_bool(transparent), dpi_port)
+    try:
+        poll_interval = float(poll_interval)
+        window = int(str(window), 10)
+        time_constant = float(time_constant)
+        max_flows = int(str(max_flows), 10)
+        flow_mod_rate = float(flow_mod_rate)
+        if packet_in_rate is not None:
+            _packet_in_rate = float(packet_in_rate)
+            assert _packet_in_rate > 0
+        history_mb = float(history_mb)
+        workers = int(str(workers), 10)
+        sweep_interval = float(sweep_interval or poll_interval)
+        assert poll_interval > 0 and window > 0 and time_constant > 0
+        assert max_flows > 0 and flow_mod_rate > 0
+        assert history_mb > 0 and sweep_interval >= poll_interval
+        checkpoint_interval = float(checkpoint_interval)
+        assert workers >= 0 and checkpoint_interval > 0
+    except:
+        raise RuntimeError("Expected poll_interval, window, time_constant, "
+                           "max_flows, flow_mod_rate, packet_in_rate and "
+                           "history_mb to be positive, sweep_interval "
+                           "to be at least poll_interval, workers a "
+                           "count and checkpoint_interval positive")
+
+    try:
+        _hot_fraction = float(hot_fraction)
+        assert 0 < _hot_fraction <= 1
+    except:
+        raise RuntimeError("Expected hot_fraction to be from 0 to 1")
+
+    if storm_action not in STORM_ACTIONS:
+        raise RuntimeError("Expected storm_action to be one of %s" %
+                           (", ".join(STORM_ACTIONS),))
+    _storm_action = storm_action
+
+    _fixed_timeout = str_to_bool(fixed_timeout)
+    _stream_stats = str_to_bool(stream_stats)
+    _proxy_arp = str_to_bool(proxy_arp)
+    try:
+        parse_dpi_ports(dpi_port)
+        _dpi_capacity = float(dpi_capacity) if dpi_capacity else None
+        assert _dpi_capacity is None or _dpi_capacity > 0
+    except:
+        raise RuntimeError("Expected dpi_port to be name[:weight],... with "
+                           "positive weights and dpi_capacity positive")
+    try:
+        _host_timeout = float(host_timeout)
+        assert _host_timeout > 0
+    except:
+        raise RuntimeError("Expected host_timeout to be positive")
+
+    config = readConfigFile(policy, log) if policy else {}
+    default = config.setdefault(DEFAULT_SECTION, {})
+    try:
+        # Given on the commandline, they win over the policy file
+        for key, value in (('up', up), ('down', down), ('dwell', dwell)):
+            if value is not None:
+                default[key] = float(value)
+    except ValueError:
+        raise RuntimeError("Expected up, down and dwell to be numbers")
+    _policy = compile_policy(config)
+
+    if journal:
+        try:
+            journal_records = int(str(journal_records), 10)
+            assert journal_records > 0
+        except:
+            raise RuntimeError("Expected journal_records to be positive")
+        try:
+            _journal = Journal(journal, journal_records)
+        except (IOError, OSError) as e:
+            raise RuntimeError("Expected journal to be a writable file: %s"
+                               % (e,))
+        core.addListenerByName("GoingDownEvent",
+                               lambda event: _journal.flush())
+
+    if granularity not in RULE_GRANULARITIES:
+        raise RuntimeError("Expected granularity to be one of %s" %
+                           (", ".join(RULE_GRANULARITIES),))
+    _rule_granularity = granularity
+    try:
+        _aggregate_prefix = int(str(aggregate_prefix), 10)
+        assert 0 < _aggregate_prefix <= 32
+    except:
+        raise RuntimeError("Expected aggregate_prefix to be from 1 to 32")
+
+    # Fail at startup rather than on the first switch connection
+    new_estimator = partial(make_estimator, estimator, window, time_constant)
+    new_estimator()
+
+    history_bytes = int(history_mb * 1024 * 1024)
+    pool = None
+    if workers:
+        # Fork before any of our threads start
+        pool = StatsWorkerPool(workers, new_estimator, compact_key_label,
+                               history_bytes, core.callLater, _policy)
+        core.addListenerByName("GoingDownEvent", lambda event: pool.close())
+
+    checkpoints = None
+    if checkpoint_dir:
+        try:
+            checkpoints = CheckpointStore(checkpoint_dir)
+        except OSError as e:
+            raise RuntimeError("Expected checkpoint_dir to be a writable "
+                               "directory: %s" % (e,))
+
+    core.registerNew(l2_learning, str_to_bool(transparent), dpi_port,
+                     poll_interval, sweep_interval, str_to_bool(port_gating),
+                     new_estimator, max_flows, flow_mod_rate,
+                     MemoryBudget(history_bytes), pool, checkpoints,
+                     checkpoint_interval)
@@ -0,0 +1,151 @@
+#-------------------------------------------------------------------------
+# FILE:             policy.py
+# DESCRIPTION:      Elephant classification policy with hysteresis
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import numpy as np
+import socket
+import struct
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# A flow enters the DMZ above UP times the elephant threshold, leaves it
+# below DOWN times the threshold, and neither until it has been where it
+# is for DWELL seconds.
+POLICY_UP = 1.0
+POLICY_DOWN = 0.8
+POLICY_DWELL_SECS = 2.0
+DEFAULT_SECTION = 'default'
+# One bit per rule in a uint64, plus the default
+MAX_POLICY_RULES = 63
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def parse_subnet(text):
+    """ Turns '10.1.0.0/16' into its (network, netmask) as integers. """
+    address, _, bits = text.strip().partition('/')
+    bits = int(bits) if bits else 32
+    if not 0 <= bits <= 32:
+        raise ValueError("Bad prefix length in %r" % (text,))
+    netmask = (0xffffffff << (32 - bits)) & 0xffffffff
+    network = struct.unpack('!I', socket.inet_aton(address))[0]
+    return network & netmask, netmask
+
+
+class Policy(object):
+    """
+    Per-flow up and down thresholds and dwell times.
+
+    Rules pick flows by source and destination subnet, in_port and a
+    minimum byte count, and the first that matches a flow decides its
+    values; the default decides the rest. They are compiled into arrays
+    once, and matched against whole columns of flows at a time.
+
+    The part of a rule that never changes for a flow (subnets and port)
+    is matched once per flow, into a bit mask of the rules it could
+    match. The byte count is checked against every rule at once through
+    a table of masks sorted by min_bytes. The lowest bit both leave set
+    is the rule that applies.
+    """
+
+    def __init__(self, rules=(), up=POLICY_UP, down=POLICY_DOWN,
+                 dwell=POLICY_DWELL_SECS):
+        """
+        rules are dicts with any of src and dst ((network, netmask)),
+        in_port, min_bytes, up, down and dwell, in the order they are
+        tried.
+        """
+        if len(rules) > MAX_POLICY_RULES:
+            raise ValueError("At most %d rules" % (MAX_POLICY_RULES,))
+        rules = list(rules) + [{}]
+        count = len(rules)
+        self.rules = count - 1
+        self.src = np.array([r.get('src', (0, 0)) for r in rules],
+                            np.uint32).reshape(count, 2)
+        self.dst = np.array([r.get('dst', (0, 0)) for r in rules],
+                            np.uint32).reshape(count, 2)
+        self.in_port = np.array([r.get('in_port', -1) for r in rules],
+                                np.int32)
+        self.up = np.array([r.get('up', up) for r in rules], np.float64)
+        self.down = np.array([r.get('down', down) for r in rules],
+                             np.float64)
+        self.dwell = np.array([r.get('dwell', dwell) for r in rules],
+                              np.float64)
+        if (self.down > self.up).any() or (self.dwell < 0).any():
+            raise ValueError("down must not be above up, nor dwell negative")
+
+        min_bytes = np.array([r.get('min_bytes', 0) for r in rules],
+                             np.uint64)
+        order = np.argsort(min_bytes, kind='mergesort')
+        self._byte_bounds = min_bytes[order]
+        # Masks of the rules a flow with at least that many bytes passes
+        self._byte_masks = np.bitwise_or.accumulate(
+            np.left_shift(np.uint64(1), order.astype(np.uint64)))
+
+    def masks(self, nw_src, nw_dst, in_port):
+        """ Returns each flow's mask of the rules its addresses match. """
+        if not self.rules:
+            return np.ones(len(nw_src), np.uint64)
+        matched = \
+            ((nw_src[:, None] & self.src[:, 1]) == self.src[:, 0]) & \
+            ((nw_dst[:, None] & self.dst[:, 1]) == self.dst[:, 0]) & \
+            ((self.in_port < 0) | (in_port[:, None] == self.in_port))
+        bits = np.left_shift(np.uint64(1),
+                             np.arange(len(self.up), dtype=np.uint64))
+        return np.bitwise_or.reduce(np.where(matched, bits, np.uint64(0)),
+                                    axis=1)
+
+    def select(self, masks, total_bytes):
+        """ Returns the index of the rule deciding each flow. """
+        if not self.rules:
+            return np.zeros(len(masks), np.intp)
+        passed = self._byte_masks[np.searchsorted(
+            self._byte_bounds, total_bytes, 'right') - 1]
+        chosen = masks & passed
+        lowest = chosen & (~chosen + np.uint64(1))
+        return np.log2(lowest).astype(np.intp)
+
+
+def compile_policy(config):
+    """
+    Builds a Policy from a configuration file read by readConfigFile().
+    Its [default] section sets up, down and dwell for flows no rule
+    matches. Every other section is a rule: src and dst subnets, in_port
+    and min_bytes pick flows, and up, down and dwell say how to treat
+    them. Rules are tried by descending priority, then by section name.
+    """
+    config = dict(config)
+    default = config.pop(DEFAULT_SECTION, {})
+    rules = []
+    for name, options in config.items():
+        rule = {}
+        try:
+            for key, value in options.items():
+                if key in ('src', 'dst'):
+                    rule[key] = parse_subnet(value)
+                elif key in ('in_port', 'min_bytes', 'priority'):
+                    rule[key] = int(value)
+                elif key in ('up', 'down', 'dwell'):
+                    rule[key] = float(value)
+                else:
+                    raise ValueError("unknown option %r" % (key,))
+        except (ValueError, socket.error) as e:
+            raise RuntimeError("Expected a valid policy rule [%s]: %s" %
+                               (name, e))
+        rules.append((-rule.pop('priority', 0), name, rule))
+    try:
+        policy = Policy([rule for _, _, rule in sorted(rules)],
+                        float(default.get('up', POLICY_UP)),
+                        float(default.get('down', POLICY_DOWN)),
+                        float(default.get('dwell', POLICY_DWELL_SECS)))
+    except ValueError as e:
+        raise RuntimeError("Expected a valid policy: %s" % (e,))
+    return policy
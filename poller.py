@@ -0,0 +1,285 @@
+#-------------------------------------------------------------------------
+# FILE:             poller.py
+# DESCRIPTION:      Controller-wide flow statistics poll scheduler
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from pox.core import core
+from pox.lib.util import dpid_to_str
+import pox.openflow.libopenflow_01 as of
+from collections import OrderedDict
+import time
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# A request with no reply after this many intervals is considered lost.
+REQUEST_TIMEOUT_INTERVALS = 3
+# Past this many hot flows, one full request is cheaper than targeted ones.
+MAX_TARGETED_REQUESTS = 64
+# How many request kinds are remembered for replies arriving late.
+REQUEST_KIND_HISTORY = 4096
+# With port gating, a switch gets a full request at least once per this
+# many sweeps, so flows missing from the replies are still aged out.
+FULL_SWEEP_INTERVALS = 4
+
+# Request kinds
+FULL = 'full'
+TARGETED = 'targeted'
+PORTS = 'ports'
+
+#-------------------------------------------------------------------------
+# VARIABLES
+#-------------------------------------------------------------------------
+log = core.getLogger()
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def stats_reply_xid(event):
+    """ Returns the xid of the request a stats event is answering. """
+    parts = event.ofp
+    if isinstance(parts, list):
+        parts = parts[0]
+    return parts.xid
+
+
+class StatsPoller(object):
+    """
+    Sends one flow stats request per switch per interval.
+
+    A single timer on the POX event loop visits the switches round-robin,
+    one per slot of interval/N seconds, so requests and replies are spread
+    evenly over the interval. A switch whose previous requests are still
+    unanswered is skipped until the replies arrive or the requests time out.
+
+    With a sweep_interval longer than the interval, polling is tiered: the
+    full table is only requested once per sweep_interval, and in between
+    only the flows hot_flows(dpid) returns are requested, each with its
+    own match-filtered request. The owner of the switches hands every
+    flow stats reply to reply(), which tells the two apart.
+
+    Given gate_threshold(dpid), returning a switch's threshold in bits/sec,
+    each poll starts with a port stats request, and flows are only
+    requested once it is answered. Flows can't be faster than the port
+    they arrive on. So an idle switch, with no port receiving its
+    threshold and no hot flows, is not asked for flows at all. If only
+    some of its ports are that busy, only flows from those ports (and hot
+    flows) are requested. Either way every FULL_SWEEP_INTERVALS sweeps
+    the full table is requested regardless, since only full replies age
+    flows out. ignored_ports(dpid) lists ports that never count as busy.
+    Each switch's latest {port: (rx, tx) bits/sec} is kept in port_rates,
+    and handed to rates_updated(dpid, rates) as soon as it has any.
+    """
+
+    def __init__(self, interval, metrics, sweep_interval=None,
+                 hot_flows=None, gate_threshold=None, ignored_ports=None,
+                 rates_updated=None):
+        self.interval = interval
+        self.metrics = metrics
+        self.sweep_interval = sweep_interval or interval
+        self.hot_flows = hot_flows
+        self.gate_threshold = gate_threshold
+        self.ignored_ports = ignored_ports
+        self.rates_updated = rates_updated
+        self.port_rates = {}
+        self.flow_polls_gated = 0
+        self._port_counters = {}
+        self.request_timeout = interval * REQUEST_TIMEOUT_INTERVALS
+        self.reply_times = {}
+        self.requests_sent = 0
+        self.requests_skipped = 0
+        self._order = []
+        self._next = 0
+        self._outstanding = {}
+        self._next_sweep = {}
+        self._next_full = {}
+        self._kinds = OrderedDict()
+        self._timer = None
+
+        core.openflow.addListeners(self)
+
+    def _handle_ConnectionUp(self, event):
+        if event.dpid not in self._order:
+            self._order.append(event.dpid)
+        if self._timer is None:
+            self._schedule()
+
+    def _handle_ConnectionDown(self, event):
+        if event.dpid in self._order:
+            self._order.remove(event.dpid)
+        self._outstanding.pop(event.dpid, None)
+        self._next_sweep.pop(event.dpid, None)
+        self._next_full.pop(event.dpid, None)
+        self.reply_times.pop(event.dpid, None)
+        self.port_rates.pop(event.dpid, None)
+        self._port_counters.pop(event.dpid, None)
+
+    def _handle_PortStatsReceived(self, event):
+        xid = stats_reply_xid(event)
+        requests = self._outstanding.get(event.dpid)
+        if not requests or requests.pop(xid, None) is None:
+            return
+        busy_ports = self._busy_ports(event)
+        rates = self.port_rates[event.dpid]
+        if self.rates_updated is not None and rates:
+            self.rates_updated(event.dpid, rates)
+        connection = core.openflow.getConnection(event.dpid)
+        if connection is not None:
+            self._poll_flows(connection, time.time(), busy_ports)
+
+    def _busy_ports(self, event):
+        """
+        Updates the switch's port rates and returns the ports that could
+        be carrying an elephant.
+        """
+        now = time.time()
+        previous = self._port_counters.get(event.dpid, {})
+        counters = {}
+        rates = {}
+        busy = []
+        ignored = self._ignored(event.dpid)
+        threshold = self.gate_threshold(event.dpid)
+        for port in event.stats:
+            if port.port_no >= of.OFPP_MAX:
+                continue
+            counters[port.port_no] = (port.rx_bytes, port.tx_bytes, now)
+            last = previous.get(port.port_no)
+            if last is None or port.rx_bytes < last[0] or \
+                    port.tx_bytes < last[1] or now <= last[2]:
+                # No rate yet, or the counters were reset
+                rx = None
+            else:
+                elapsed = now - last[2]
+                rx = 8 * (port.rx_bytes - last[0]) / elapsed
+                rates[port.port_no] = (rx, 8 * (port.tx_bytes - last[1]) /
+                                       elapsed)
+            if port.port_no not in ignored and \
+                    (rx is None or rx >= threshold):
+                busy.append(port.port_no)
+        self._port_counters[event.dpid] = counters
+        self.port_rates[event.dpid] = rates
+        return busy
+
+    def _ignored(self, dpid):
+        return self.ignored_ports(dpid) if self.ignored_ports else ()
+
+    def _eligible_ports(self, dpid):
+        """ The switch's ports last reported, less the ignored ones. """
+        ignored = self._ignored(dpid)
+        return [port for port in self._port_counters.get(dpid, ())
+                if port not in ignored]
+
+    def request_kind(self, xid):
+        """ Returns the kind of a request by xid, or None if not ours. """
+        return self._kinds.get(xid)
+
+    def reply(self, event):
+        """
+        Accounts for a flow stats reply. Returns its kind, FULL, TARGETED
+        or None for a request the poller never sent, and whether it was
+        the last outstanding reply from its switch.
+        """
+        xid = stats_reply_xid(event)
+        requests = self._outstanding.get(event.dpid, {})
+        sent = requests.pop(xid, None)
+        if not requests:
+            self._outstanding.pop(event.dpid, None)
+        if sent is not None:
+            elapsed = time.time() - sent
+            self.reply_times[event.dpid] = elapsed
+            self.metrics.stats_rtt_seconds.observe(
+                (('dpid', dpid_to_str(event.dpid)),), elapsed)
+            log.debug("%s: flow stats reply in %.1f ms (%d entries)" %
+                      (dpid_to_str(event.dpid), elapsed * 1000,
+                       len(event.stats)))
+        return self._kinds.get(xid), not requests
+
+    def _schedule(self):
+        slot = float(self.interval) / max(1, len(self._order))
+        self._timer = core.callDelayed(slot, self._tick)
+
+    def _tick(self):
+        if not self._order:
+            self._timer = None
+            return
+
+        self._next %= len(self._order)
+        dpid = self._order[self._next]
+        self._next += 1
+        self.poll(dpid)
+        self._schedule()
+
+    def poll(self, dpid):
+        """ Requests flow stats from one switch unless a request is pending. """
+        connection = core.openflow.getConnection(dpid)
+        if connection is None:
+            return
+
+        now = time.time()
+        requests = self._outstanding.get(dpid)
+        if requests and now - min(requests.values()) < self.request_timeout:
+            self.requests_skipped += 1
+            log.debug("%s: flow stats request still outstanding -- skipping" %
+                      (dpid_to_str(dpid),))
+            return
+
+        self._outstanding[dpid] = {}
+        if self.gate_threshold is not None:
+            self._send(connection, of.ofp_port_stats_request(), PORTS, now)
+        else:
+            self._poll_flows(connection, now, None)
+
+    def _poll_flows(self, connection, now, busy_ports):
+        """
+        Requests the flows worth looking at. busy_ports is None without
+        port gating, else the ports that could be carrying an elephant.
+        """
+        dpid = connection.dpid
+        hot = [] if self.hot_flows is None else self.hot_flows(dpid)
+        sweep = now >= self._next_sweep.get(dpid, 0)
+
+        matches = None
+        if not sweep or (busy_ports is not None and not busy_ports):
+            matches = hot
+        elif busy_ports is not None and \
+                len(busy_ports) < len(self._eligible_ports(dpid)):
+            busy = set(busy_ports)
+            matches = [of.ofp_match(in_port=port) for port in busy_ports] + \
+                [match for match in hot if match.in_port not in busy]
+        if matches is not None and len(matches) > MAX_TARGETED_REQUESTS:
+            matches = None
+        if sweep and busy_ports is not None and \
+                now >= self._next_full.get(dpid, 0):
+            # Only full replies age flows out
+            matches = None
+
+        if sweep and (matches is None or busy_ports != []):
+            self._next_sweep[dpid] = now + self.sweep_interval
+        if matches is None:
+            self._next_full[dpid] = now + \
+                FULL_SWEEP_INTERVALS * self.sweep_interval
+            self._send(connection, of.ofp_flow_stats_request(), FULL, now)
+        elif not matches and busy_ports is not None:
+            self.flow_polls_gated += 1
+        for match in matches or ():
+            self._send(connection, of.ofp_flow_stats_request(match=match),
+                       TARGETED, now)
+
+    def _send(self, connection, body, kind, now):
+        msg = of.ofp_stats_request(body=body)
+        self._outstanding.setdefault(connection.dpid, {})[msg.xid] = now
+        self._kinds[msg.xid] = kind
+        if len(self._kinds) > REQUEST_KIND_HISTORY:
+            self._kinds.popitem(last=False)
+        self.requests_sent += 1
+        connection.send(msg)
+
+    def get_poll_cost(self):
+        """ Returns the summed reply time of the last request to each switch. """
+        return sum(self.reply_times.values())
@@ -0,0 +1,50 @@
+#-------------------------------------------------------------------------
+# FILE:             ratelimit.py
+# DESCRIPTION:      Token bucket rate limiter
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import time
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# Shortest wait handed out, so callers never spin on rounding errors.
+MIN_WAIT_SECS = 0.001
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` events per second on average and up to `burst` at once.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self._last = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, count=1):
+        """ Takes up to `count` tokens and returns how many were granted. """
+        self._refill()
+        granted = min(count, int(self.tokens + 1e-9))
+        self.tokens = max(0.0, self.tokens - granted)
+        return granted
+
+    def wait_time(self):
+        """ Returns the seconds until the next token is available. """
+        self._refill()
+        return max(MIN_WAIT_SECS, (1 - self.tokens) / self.rate)
@@ -1,7 +1,8 @@
 #!/bin/sh
 SCRIPT="mymultiflow"
+MODULES="$SCRIPT.py utils.py poller.py flowtable.py estimators.py timerwheel.py ratelimit.py flowmods.py dashboard.py timeseries.py webapi.py metrics.py workers.py checkpoint.py hostcache.py dpi.py policy.py journal.py"
 ETHPORT="eth6"
 
-cp -r $SCRIPT.py utils.py templates ./pox/ext/
+cp -r $MODULES templates ./pox/ext/
 ./pox/pox.py --verbose $SCRIPT --dpi_port=$ETHPORT
-rm -r ./pox/ext/$SCRIPT.py ./pox/ext/utils.py ./pox/ext/templates
+(cd ./pox/ext && rm -r $MODULES templates)
@@ -0,0 +1,23 @@
+#-------------------------------------------------------------------------
+# FILE:             __init__.py
+# DESCRIPTION:      Unit tests for the controller modules
+#-------------------------------------------------------------------------
+"""
+Run from the top of the checkout, with the pox submodule present:
+
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import os
+import sys
+
+# The controller modules live at the top of the checkout and POX in its
+# submodule, as for benchmark.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(ROOT, 'pox'), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,73 @@
+#-------------------------------------------------------------------------
+# FILE:             fakes.py
+# DESCRIPTION:      Stand-ins for the POX objects the controller talks to
+#-------------------------------------------------------------------------
+"""
+Shared by the tests and by benchmark.py, which drive switch objects
+without a network.
+"""
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import pox.openflow.libopenflow_01 as of
+
+import time
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class FakeClock(object):
+    """ Stands in for the time module where a test moves time itself. """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeConnection(object):
+    """
+    Enough of a POX Connection for one switch object: ports by name,
+    listeners that tests can fire with raise_event(), and a send() that
+    keeps messages in `sent` instead of writing them. With keep=False
+    messages are only packed and counted, for long runs.
+    """
+
+    def __init__(self, dpid, ports=(), keep=True):
+        self.dpid = dpid
+        self.connect_time = time.time()
+        self.ports = dict((name, of.ofp_phy_port(port_no=port_no, name=name))
+                          for name, port_no in ports)
+        self.sent = [] if keep else None
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self._listeners = {}
+
+    def addListeners(self, sink):
+        for name in dir(sink):
+            if name.startswith('_handle_'):
+                self.addListenerByName(name[len('_handle_'):],
+                                       getattr(sink, name))
+
+    def addListenerByName(self, name, handler):
+        self._listeners.setdefault(name, []).append(handler)
+
+    def raise_event(self, name, event=None):
+        for handler in self._listeners.get(name, []):
+            handler(event)
+
+    def send(self, data):
+        self.messages_sent += 1
+        if self.sent is not None:
+            self.sent.append(data)
+            return
+        if not isinstance(data, bytes):
+            data = data.pack()
+        self.bytes_sent += len(data)
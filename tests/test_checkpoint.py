@@ -0,0 +1,121 @@
+#-------------------------------------------------------------------------
+# FILE:             test_checkpoint.py
+# DESCRIPTION:      Tests for the on-disk switch checkpoints
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkpoint import (CheckpointStore, CheckpointWriter, MAC_RECORD,
+                        FLOW_RECORD)
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+DPID = 0x1234
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def records(count):
+    """ count MAC and flow records with something in every field. """
+    macs = np.zeros(count, MAC_RECORD)
+    macs['mac'] = np.arange(6 * count).reshape(-1, 6)
+    macs['port'] = np.arange(count) + 1
+    flows = np.zeros(count, FLOW_RECORD)
+    for name in FLOW_RECORD.names:
+        flows[name] = np.arange(count) + 1
+    return macs, flows
+
+
+class FlakyStore(CheckpointStore):
+    """ Fails its first save, as a full disk would. """
+
+    failed = False
+
+    def save(self, dpid, macs, flows):
+        if not self.failed:
+            self.failed = True
+            raise IOError("No space left on device")
+        CheckpointStore.save(self, dpid, macs, flows)
+
+
+class StoreTestCase(unittest.TestCase):
+    """ Checkpoints into a fresh directory. """
+
+    store_class = CheckpointStore
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = self.store_class(os.path.join(self.directory, 'dmz'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertRecordsEqual(self, first, second):
+        for loaded, saved in zip(first, second):
+            self.assertEqual(loaded.dtype, saved.dtype)
+            for name in saved.dtype.names:
+                self.assertEqual(loaded[name].tolist(), saved[name].tolist())
+
+
+class CheckpointStoreTest(StoreTestCase):
+
+    def test_round_trip(self):
+        self.store.save(DPID, *records(3))
+        self.assertRecordsEqual(self.store.load(DPID), records(3))
+        self.assertEqual(sorted(os.listdir(self.store.directory)),
+                         ['0000000000001234-flows.npy',
+                          '0000000000001234-macs.npy'])
+
+    def test_save_replaces_the_last_checkpoint(self):
+        self.store.save(DPID, *records(3))
+        self.store.save(DPID, *records(0))
+        self.assertRecordsEqual(self.store.load(DPID), records(0))
+
+    def test_switch_without_a_checkpoint(self):
+        self.assertRecordsEqual(self.store.load(DPID), records(0))
+
+    def test_checkpoint_from_another_version_is_ignored(self):
+        macs, flows = records(3)
+        self.store.save(DPID, macs, flows[['nw_src', 'nw_dst']].copy())
+        self.assertRecordsEqual(self.store.load(DPID), (macs, records(0)[1]))
+
+
+class CheckpointWriterTest(StoreTestCase):
+
+    def test_queued_checkpoints_are_written_on_close(self):
+        writer = CheckpointWriter(self.store)
+        writer.save(DPID, *records(3))
+        writer.save(DPID + 1, *records(2))
+        writer.close()
+        self.assertRecordsEqual(self.store.load(DPID), records(3))
+        self.assertRecordsEqual(self.store.load(DPID + 1), records(2))
+
+
+class FailedWriteTest(StoreTestCase):
+
+    store_class = FlakyStore
+
+    def test_failed_write_does_not_stop_the_writer(self):
+        writer = CheckpointWriter(self.store)
+        writer.save(DPID, *records(3))
+        writer.save(DPID + 1, *records(2))
+        writer.close()
+        self.assertRecordsEqual(self.store.load(DPID), records(0))
+        self.assertRecordsEqual(self.store.load(DPID + 1), records(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#-------------------------------------------------------------------------
+# FILE:             test_dashboard.py
+# DESCRIPTION:      Tests for the dashboard bandwidth feed
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import json
+import unittest
+
+from dashboard import BandwidthFeed, FEED_HISTORY, OTHER_FLOWS
+
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def parse(event):
+    """ Returns the name and data of one server-sent event. """
+    fields = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+
+class Flow(object):
+
+    def __init__(self, label):
+        self.label = label
+
+
+class Ranking(object):
+    """ Ranks a {label: bits/sec} dict the way a FlowRanking would. """
+
+    def __init__(self, bandwidths):
+        self.flows = sorted(((Flow(label), rate)
+                             for label, rate in bandwidths.items()),
+                            key=lambda flow: -flow[1])
+        self.total = sum(bandwidths.values())
+
+    def __len__(self):
+        return len(self.flows)
+
+    def top(self, n):
+        return self.flows[:n]
+
+
+class BandwidthFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.feed = BandwidthFeed(top_flows=3)
+        self.publish({'a': 1.0, 'b': 2.0})
+        self.stream = self.feed.stream()
+
+    def publish(self, bandwidths):
+        self.feed.publish(Ranking(bandwidths))
+
+    def test_client_starts_with_a_snapshot(self):
+        self.assertEqual(parse(next(self.stream)),
+                         ('snapshot', {'a': 1.0, 'b': 2.0}))
+
+    def test_only_changes_are_sent(self):
+        next(self.stream)
+        self.publish({'a': 1.0, 'b': 3.0, 'c': 4.0})
+        self.publish({'b': 3.0, 'c': 4.0})
+        self.assertEqual(parse(next(self.stream)),
+                         ('delta', {'changed': {'b': 3.0, 'c': 4.0},
+                                    'removed': []}))
+        self.assertEqual(parse(next(self.stream)),
+                         ('delta', {'changed': {}, 'removed': ['a']}))
+
+    def test_unchanged_cycle_is_not_published(self):
+        sequence = self.feed.snapshot()[0]
+        self.publish({'a': 1.0, 'b': 2.0})
+        self.assertEqual(self.feed.snapshot()[0], sequence)
+
+    def test_client_far_behind_gets_a_snapshot(self):
+        next(self.stream)
+        for i in range(FEED_HISTORY + 1):
+            self.publish({'a': float(i)})
+        self.assertEqual(parse(next(self.stream)),
+                         ('snapshot', {'a': float(FEED_HISTORY)}))
+
+    def test_snapshot_is_serialized_once_per_cycle(self):
+        first = self.feed.snapshot_json()[1]
+        self.assertIs(self.feed.snapshot_json()[1], first)
+        self.publish({'a': 5.0})
+        self.assertEqual(json.loads(self.feed.snapshot_json()[1]),
+                         {'a': 5.0})
+
+    def test_slower_flows_are_summed(self):
+        self.publish({'a': 1.0, 'b': 2.0, 'c': 3.0, 'd': 4.0, 'e': 5.0})
+        self.assertEqual(json.loads(self.feed.snapshot_json()[1]),
+                         {'c': 3.0, 'd': 4.0, 'e': 5.0, OTHER_FLOWS: 3.0})
+        self.assertEqual(len(json.loads(self.feed.snapshot_json(True)[1])),
+                         5)
+
+    def test_change_outside_the_top_is_kept(self):
+        self.publish({'a': 1.0, 'b': 2.0, 'c': 3.0, 'd': 4.0, 'e': 5.0})
+        sequence = self.feed.snapshot()[0]
+        # Not a change clients see, but every flow's rate is still served
+        self.publish({'a': 2.0, 'b': 1.0, 'c': 3.0, 'd': 4.0, 'e': 5.0})
+        self.assertEqual(self.feed.snapshot()[0], sequence)
+        self.assertEqual(json.loads(self.feed.snapshot_json(True)[1])['a'],
+                         2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#-------------------------------------------------------------------------
+# FILE:             test_dpi.py
+# DESCRIPTION:      Tests for flow assignment across DPI appliances
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+from pox.lib.addresses import IPAddr
+import pox.openflow.libopenflow_01 as of
+
+import unittest
+
+from dpi import DpiRing, parse_dpi_ports, flow_hash
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+FLOWS = 2000
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def tcp_match(i, reverse=False):
+    src = (IPAddr('10.0.0.1'), 1000 + i)
+    dst = (IPAddr('10.0.1.%d' % (i % 250 + 1,)), 80)
+    if reverse:
+        src, dst = dst, src
+    return of.ofp_match(nw_proto=6, nw_src=src[0], tp_src=src[1],
+                        nw_dst=dst[0], tp_dst=dst[1])
+
+
+class DpiRingTest(unittest.TestCase):
+
+    def shares(self, ring):
+        counts = [0] * len(ring)
+        for i in range(FLOWS):
+            counts[ring.lookup(tcp_match(i))] += 1
+        return [float(count) / FLOWS for count in counts]
+
+    def test_parse(self):
+        self.assertEqual(parse_dpi_ports('eth1:2, eth2'),
+                         [('eth1', 2.0), ('eth2', 1.0)])
+        for spec in ('eth1:0', 'eth1,eth1', ':2'):
+            self.assertRaises(ValueError, parse_dpi_ports, spec)
+
+    def test_both_directions_meet(self):
+        for i in range(10):
+            self.assertEqual(flow_hash(tcp_match(i)),
+                             flow_hash(tcp_match(i, reverse=True)))
+
+    def test_shares_follow_weights(self):
+        shares = self.shares(DpiRing([('eth1', 3.0), ('eth2', 1.0)]))
+        self.assertAlmostEqual(shares[0], 0.75, delta=0.1)
+
+    def test_rebalance_moves_flows_off_the_busy_port(self):
+        ring = DpiRing([('eth1', 1.0), ('eth2', 1.0)])
+        before = self.shares(ring)
+        self.assertTrue(ring.rebalance([3e9, 1e9]))
+        after = self.shares(ring)
+        self.assertLess(after[0], before[0])
+        self.assertFalse(ring.rebalance([0, 0]))
+
+    def test_threshold_drops_when_dpis_are_full(self):
+        ring = DpiRing([('eth1', 1.0), ('eth2', 1.0)])
+        self.assertEqual(ring.threshold(1000), 2000)
+        ring.rebalance([9e8, 9e8], capacity=1e9)
+        self.assertLess(ring.threshold(1000), 2000)
+        for i in range(30):
+            ring.rebalance([1e8, 1e8], capacity=1e9)
+        self.assertEqual(ring.threshold(1000), 2000)
+
+    def test_threshold_follows_the_number_of_ports(self):
+        # Weights are only shares: 3:1 is the same two DPIs as 0.75:0.25
+        ring = DpiRing([('eth1', 3.0), ('eth2', 1.0)])
+        self.assertEqual(ring.threshold(1000), 2000)
+        ring.rebalance([12e8, 5e8], capacity=1e9)
+        self.assertLess(ring.threshold(1000), 2000)
+        for i in range(30):
+            ring.rebalance([12e8, 5e8], capacity=1e9)
+        self.assertEqual(ring.threshold(1000), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#-------------------------------------------------------------------------
+# FILE:             test_estimators.py
+# DESCRIPTION:      Tests for the flow rate estimators
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import math
+import numpy as np
+import unittest
+
+from estimators import SlidingWindowEstimator, EwmaEstimator, make_estimator
+
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class SlidingWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.estimator = SlidingWindowEstimator(2)
+        self.estimator.resize(4)
+        self.rows = np.array([1], np.intp)
+
+    def add(self, byte_delta, elapsed):
+        return self.estimator.add(self.rows, np.array([float(byte_delta)]),
+                                  np.array([float(elapsed)]))[0]
+
+    def test_uneven_samples_are_weighted_by_time(self):
+        self.add(1000, 1)
+        self.assertEqual(self.add(500, 3), 3000)
+
+    def test_oldest_sample_leaves_the_window(self):
+        self.add(1000, 1)
+        self.add(500, 1)
+        self.assertEqual(self.add(500, 1), 4000)
+
+    def test_reset_forgets_the_samples(self):
+        self.add(1000, 1)
+        self.estimator.reset(self.rows)
+        self.assertEqual(self.add(500, 1), 4000)
+
+
+class EwmaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.estimator = EwmaEstimator(10)
+        self.estimator.resize(4)
+        self.rows = np.array([2], np.intp)
+
+    def add(self, byte_delta, elapsed):
+        return self.estimator.add(self.rows, np.array([float(byte_delta)]),
+                                  np.array([float(elapsed)]))[0]
+
+    def test_first_sample_primes_the_average(self):
+        self.assertEqual(self.add(1000, 1), 8000)
+
+    def test_weight_follows_the_sample_length(self):
+        self.add(1000, 1)
+        alpha = 1 - math.exp(-0.5)
+        self.assertAlmostEqual(self.add(0, 5), 8000 * (1 - alpha))
+
+    def test_unknown_estimator(self):
+        self.assertRaises(RuntimeError, make_estimator, 'median', 1, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#-------------------------------------------------------------------------
+# FILE:             test_flowmods.py
+# DESCRIPTION:      Tests for the batched flow_mod queue
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import pox.core
+if pox.core.core is None:
+    pox.core.initialize()
+import pox.openflow.libopenflow_01 as of
+
+import time
+import unittest
+
+import flowmods
+import ratelimit
+from flowmods import FlowModQueue, BARRIER_TIMEOUT_SECS
+from ratelimit import TokenBucket
+from tests.fakes import FakeClock, FakeConnection
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+DPID = 1
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class BarrierEvent(object):
+
+    def __init__(self, xid):
+        self.xid = xid
+
+
+def flow_mod(tp_src, command=of.OFPFC_ADD, port=1):
+    msg = of.ofp_flow_mod(command=command)
+    msg.match = of.ofp_match(tp_src=tp_src)
+    msg.actions.append(of.ofp_action_output(port=port))
+    return msg
+
+
+class ClockTest(unittest.TestCase):
+    """ Runs with the rate limiter and the queue on a fake clock. """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        ratelimit.time = flowmods.time = self.clock
+
+    def tearDown(self):
+        ratelimit.time = flowmods.time = time
+
+
+class TokenBucketTest(ClockTest):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(10, burst=5)
+        self.assertEqual(bucket.take(8), 5)
+        self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.wait_time(), 0.1)
+        self.clock.now += 0.35
+        self.assertEqual(bucket.take(8), 3)
+
+    def test_refill_stops_at_the_burst(self):
+        bucket = TokenBucket(10, burst=5)
+        bucket.take(5)
+        self.clock.now += 60
+        self.assertEqual(bucket.take(8), 5)
+
+
+class FlowModQueueTest(ClockTest):
+
+    def setUp(self):
+        ClockTest.setUp(self)
+        self.connection = FakeConnection(DPID)
+        self.queue = FlowModQueue(self.connection, 2)
+
+    def test_modify_replaces_the_queued_one(self):
+        self.queue.send(flow_mod(1000, of.OFPFC_MODIFY, port=2))
+        self.queue.send(flow_mod(1000, of.OFPFC_MODIFY, port=3))
+        self.queue.send(flow_mod(1001))
+        self.queue.send(flow_mod(1001))
+        self.assertEqual(self.queue.depth, 3)
+        self.assertEqual(self.queue.merged, 1)
+        self.assertEqual(
+            [msg.actions[0].port for msg in self.queue._pending.values()],
+            [3, 1, 1])
+
+    def test_writes_are_rate_limited(self):
+        for tp_src in range(5):
+            self.queue.send(flow_mod(tp_src))
+        self.queue.flush()
+        self.assertEqual((self.queue.written, self.queue.depth), (2, 3))
+        # One write per batch, whatever its size
+        self.assertEqual(len(self.connection.sent), 1)
+        self.clock.now += 1
+        self.queue.flush()
+        self.assertEqual((self.queue.written, self.queue.depth), (4, 1))
+
+    def test_barrier_reply_gives_the_latency(self):
+        self.queue.send(flow_mod(1000))
+        self.queue.flush()
+        xid = list(self.queue._barriers)[0]
+        self.clock.now += 0.25
+        self.queue._handle_BarrierIn(BarrierEvent(xid))
+        self.assertAlmostEqual(self.queue.barrier_latency, 0.25)
+        self.assertEqual(len(self.queue._barriers), 0)
+
+    def test_unanswered_barriers_expire(self):
+        self.queue.send(flow_mod(1000))
+        self.queue.flush()
+        self.clock.now += BARRIER_TIMEOUT_SECS
+        self.queue.send(flow_mod(1001))
+        self.queue.flush()
+        self.assertEqual(len(self.queue._barriers), 1)
+
+    def test_connection_down_drops_everything(self):
+        for tp_src in range(3):
+            self.queue.send(flow_mod(tp_src))
+        self.queue.flush()
+        self.queue._handle_ConnectionDown(None)
+        self.assertEqual((self.queue.depth, len(self.queue._barriers)),
+                         (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+#-------------------------------------------------------------------------
+# FILE:             test_flowtable.py
+# DESCRIPTION:      Tests for the array-backed flow store
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import numpy as np
+import unittest
+
+from estimators import SlidingWindowEstimator
+from flowtable import FlowTable, FlowRanking, COUNTER_32_BIT_LIMIT
+from policy import Policy
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+THRESHOLD = 1000.0
+DPI_PORT = 3
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def flow_key(i, in_port=1):
+    return (0x0a000001, 0x0a000002, 1000 + i, 80, in_port)
+
+
+class UpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = FlowTable(SlidingWindowEstimator(1), capacity=4)
+        self.rows = np.array([self.table.add(flow_key(0), None)], np.intp)
+
+    def update(self, byte_count, duration, now):
+        return self.table.update(self.rows, np.array([byte_count], np.uint64),
+                                 np.array([duration], np.float64), now)[0]
+
+    def test_first_sample_is_bytes_over_duration(self):
+        self.assertEqual(self.update(1000, 2, 100), 4000)
+
+    def test_rate_is_from_the_delta(self):
+        self.update(1000, 2, 100)
+        self.assertEqual(self.update(1500, 3, 101), 4000)
+
+    def test_wrapped_32_bit_counter(self):
+        self.update(COUNTER_32_BIT_LIMIT - 1000, 10, 100)
+        self.assertEqual(self.update(1000, 11, 101), 16000)
+
+    def test_reinstalled_entry_restarts(self):
+        self.update(10 ** 6, 10, 100)
+        self.assertEqual(self.update(500, 1, 101), 4000)
+
+    def test_zero_durations_use_receive_times(self):
+        self.update(1000, 0, 100)
+        self.assertEqual(self.update(3000, 0, 104), 4000)
+
+    def test_rows_are_reused_and_grow(self):
+        table = self.table
+        table.remove(self.rows)
+        self.assertEqual(table.add(flow_key(1), None), self.rows[0])
+        for i in range(2, 6):
+            table.add(flow_key(i), None)
+        self.assertEqual(len(table), 5)
+        self.assertEqual(table.capacity, 8)
+        self.assertEqual(table.total_bytes[self.rows[0]], 0)
+
+
+class AgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = FlowTable(SlidingWindowEstimator(1))
+        self.rows = np.array([self.table.add(flow_key(i), None)
+                              for i in range(3)], np.intp)
+        self.table.last_time[self.rows] = [30, 10, 20]
+
+    def test_flow_missing_from_replies_is_aged_out(self):
+        seen = self.rows[:2]
+        self.assertEqual(self.table.age(seen, 2), [])
+        self.assertEqual(self.table.age(seen, 2), [flow_key(2)])
+        self.assertEqual(len(self.table), 2)
+
+    def test_seen_flow_starts_over(self):
+        self.table.age(self.rows[:2], 2)
+        self.table.age(self.rows, 2)
+        self.assertEqual(self.table.age(self.rows[:2], 2), [])
+
+    def test_evicts_least_recently_seen(self):
+        self.assertEqual(self.table.evict(3), [])
+        self.assertEqual(self.table.evict(2), [flow_key(1)])
+
+    def test_dmz_flows_are_evicted_last(self):
+        self.table.in_dmz[self.rows[1]] = True
+        self.assertEqual(sorted(self.table.evict(1)),
+                         [flow_key(0), flow_key(2)])
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = FlowTable(SlidingWindowEstimator(1),
+                               policy=Policy(up=1.0, down=0.5, dwell=10.0))
+        self.rows = np.array([self.table.add(flow_key(0), None),
+                              self.table.add(flow_key(1, DPI_PORT), None)],
+                             np.intp)
+        self.byte_counts = np.zeros(2, np.uint64)
+        self.now = 100.0
+
+    def sample(self, rate):
+        """ One second at rate bits/sec for every flow, then classify. """
+        self.now += 1
+        self.byte_counts += np.uint64(rate / 8)
+        self.table.update(self.rows, self.byte_counts,
+                          np.full(2, self.now - 100), self.now)
+        elephants, mice, prevented = self.table.classify(
+            self.rows, THRESHOLD, [DPI_PORT])
+        return elephants.tolist(), mice.tolist(), prevented
+
+    def test_dpi_port_flows_are_not_promoted(self):
+        self.assertEqual(self.sample(2 * THRESHOLD), ([self.rows[0]], [], 0))
+        self.assertEqual(self.table.dmz_count(), 1)
+
+    def test_hysteresis_band_counts_one_crossing(self):
+        self.sample(2 * THRESHOLD)
+        self.table.changed[self.rows] = 0
+        # Below the threshold but above the down fraction: a single
+        # threshold would demote it once, not once per sample
+        self.assertEqual(self.sample(0.8 * THRESHOLD), ([], [], 1))
+        self.assertEqual(self.sample(0.8 * THRESHOLD), ([], [], 0))
+        self.assertEqual(self.sample(0.2 * THRESHOLD),
+                         ([], [self.rows[0]], 0))
+
+    def test_dwell_holds_a_new_elephant(self):
+        self.sample(2 * THRESHOLD)
+        self.assertEqual(self.sample(0.2 * THRESHOLD), ([], [], 1))
+        for i in range(8):
+            self.assertEqual(self.sample(0.2 * THRESHOLD), ([], [], 0))
+        self.assertEqual(self.sample(0.2 * THRESHOLD),
+                         ([], [self.rows[0]], 0))
+
+    def test_recrossing_counts_again(self):
+        self.sample(2 * THRESHOLD)
+        self.assertEqual(self.sample(0.2 * THRESHOLD)[2], 1)
+        self.assertEqual(self.sample(2 * THRESHOLD)[2], 0)
+        self.assertEqual(self.sample(0.2 * THRESHOLD)[2], 1)
+
+
+    def test_kick_restarts_the_dwell_time(self):
+        for i in range(3):
+            self.sample(2 * THRESHOLD)
+        self.table.kick(self.rows[0])
+        # Still an elephant, but not promoted again until released
+        self.assertEqual(self.sample(2 * THRESHOLD), ([], [], 0))
+        self.table.release(self.rows[0])
+        for i in range(8):
+            self.assertEqual(self.sample(2 * THRESHOLD), ([], [], 0))
+        self.assertEqual(self.sample(2 * THRESHOLD), ([self.rows[0]], [], 0))
+
+    def test_hot_flows(self):
+        self.table.add(flow_key(2), None)
+        self.sample(0.5 * THRESHOLD)
+        self.assertEqual(self.table.hot(THRESHOLD / 4, [DPI_PORT]).tolist(),
+                         [self.rows[0]])
+        self.sample(2 * THRESHOLD)
+        # A DMZ flow is hot whatever its rate
+        self.assertEqual(self.table.hot(4 * THRESHOLD, [DPI_PORT]).tolist(),
+                         [self.rows[0]])
+
+
+class RankingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = FlowTable(SlidingWindowEstimator(1))
+        # Flow i arrives on port 1 + i % 2 at i bits/sec
+        rows = [self.table.add(flow_key(i, 1 + i % 2), i) for i in range(6)]
+        self.table.rate[rows] = range(6)
+        self.ranking = FlowRanking(self.table)
+
+    def test_fastest_flows(self):
+        self.assertEqual(self.ranking.top(3), [(5, 5), (4, 4), (3, 3)])
+        self.assertEqual(self.ranking.total, 15)
+
+    def test_fastest_flows_on_a_port(self):
+        self.assertEqual(self.ranking.top(2, 1), [(4, 4), (2, 2)])
+        self.assertEqual(self.ranking.top(5, 2), [(5, 5), (3, 3), (1, 1)])
+        self.assertEqual(self.ranking.top(2, 3), [])
+
+    def test_sorted_and_partial_rankings_agree(self):
+        partial = self.ranking.top(3)
+        self.ranking.top(1, 1)
+        self.assertEqual(self.ranking.top(3), partial)
+        self.assertEqual(len(self.ranking.top(10)), 6)
+
+    def test_ranking_is_frozen(self):
+        self.table.rate[:6] = 0
+        self.table.remove(np.array([self.table.index[flow_key(5, 2)]]))
+        self.assertEqual(self.ranking.top(1), [(5, 5)])
+        self.assertEqual(len(FlowRanking(self.table)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
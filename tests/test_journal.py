@@ -0,0 +1,133 @@
+#-------------------------------------------------------------------------
+# FILE:             test_journal.py
+# DESCRIPTION:      Tests for the binary ring journal of reroute decisions
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from journal import Journal, read_journal, select, aggregate, ip_value, \
+    main, record_text, ELEPHANT, MOUSE
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+CAPACITY = 4
+HOST_A = '10.0.0.1'
+HOST_B = '10.0.0.2'
+HOST_C = '10.0.0.3'
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class Output(object):
+    """ A stdout that keeps what is printed. """
+
+    def __init__(self, written):
+        self.write = written.append
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'reroutes.jnl')
+        self.journal = Journal(self.path, CAPACITY)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, now, src=HOST_A, dst=HOST_B, action=ELEPHANT,
+              rate=1000.0):
+        self.journal.write(now, 1, ip_value(src), ip_value(dst), now, 80, 1,
+                           action, rate, int(now) * 100)
+
+    def times(self):
+        self.journal.flush()
+        return read_journal(self.path)['time'].tolist()
+
+    def test_empty(self):
+        self.assertEqual(self.times(), [])
+
+    def test_records_come_back_oldest_first(self):
+        for now in (1, 2, 3):
+            self.write(now)
+        self.assertEqual(self.times(), [1, 2, 3])
+
+    def test_wrap_around_keeps_the_newest(self):
+        for now in range(1, 11):
+            self.write(now)
+        self.assertEqual(self.times(), [7, 8, 9, 10])
+
+    def test_reopening_continues_the_ring(self):
+        for now in range(1, 6):
+            self.write(now)
+        self.journal.close()
+        self.journal = Journal(self.path, CAPACITY)
+        self.write(6)
+        self.assertEqual(self.times(), [3, 4, 5, 6])
+
+    def test_reopening_with_another_capacity_starts_over(self):
+        self.write(1)
+        self.journal.close()
+        self.journal = Journal(self.path, CAPACITY * 2)
+        self.write(2)
+        self.assertEqual(self.times(), [2])
+
+    def test_not_a_journal(self):
+        other = os.path.join(self.directory, 'other')
+        with open(other, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ValueError, read_journal, other)
+
+    def test_select_and_aggregate(self):
+        self.write(60, HOST_A, HOST_B, ELEPHANT, 1000.0)
+        self.write(70, HOST_A, HOST_C, ELEPHANT, 3000.0)
+        self.write(130, HOST_B, HOST_C, MOUSE, 500.0)
+        self.journal.flush()
+        records = read_journal(self.path)
+
+        self.assertEqual(
+            select(records, host=HOST_C)['time'].tolist(), [70, 130])
+        self.assertEqual(
+            select(records, start=65, action=ELEPHANT)['time'].tolist(),
+            [70])
+
+        groups = dict((group, (count, byte_count, mean, peak))
+                      for group, count, byte_count, mean, peak
+                      in aggregate(records, 'host'))
+        self.assertEqual(groups[ip_value(HOST_A)], (2, 13000, 2000.0, 3000.0))
+        minutes = [(group, count) for group, count, byte_count, mean, peak
+                   in aggregate(records, 'minute')]
+        self.assertEqual(minutes, [(60, 2), (120, 1)])
+
+    def test_limit_prints_the_latest_records_oldest_first(self):
+        for now in (1, 2, 3):
+            self.write(now)
+        self.journal.flush()
+        printed = []
+        stdout, sys.stdout = sys.stdout, Output(printed)
+        try:
+            main([self.path, '--limit', '2'])
+        finally:
+            sys.stdout = stdout
+        records = read_journal(self.path)
+        self.assertEqual(''.join(printed).splitlines(),
+                         [record_text(records[1]), record_text(records[2]),
+                          "3 records"])
+
+
+if __name__ == '__main__':
+    unittest.main()
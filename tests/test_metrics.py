@@ -0,0 +1,90 @@
+#-------------------------------------------------------------------------
+# FILE:             test_metrics.py
+# DESCRIPTION:      Tests for the metrics registry and sampling profiler
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import threading
+import time
+import unittest
+
+import metrics
+from metrics import Registry, SamplingProfiler
+from tests.fakes import FakeClock
+
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class RenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_by_labels(self):
+        counter = self.registry.counter('dmz_things_total', 'Things')
+        counter.inc((('dpid', 'a'),))
+        counter.inc((('dpid', 'a'),), 2)
+        self.assertEqual(self.registry.render(),
+                         '# HELP dmz_things_total Things\n'
+                         '# TYPE dmz_things_total counter\n'
+                         'dmz_things_total{dpid="a"} 3.0\n')
+
+    def test_gauge_is_read_on_render(self):
+        values = {(): 1}
+        self.registry.gauge('dmz_level', 'Level', lambda: values)
+        values[()] = 5
+        self.assertTrue(self.registry.render().endswith('dmz_level 5.0\n'))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('dmz_seconds', 'Time', (1, 2))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe((), value)
+        self.assertEqual(self.registry.render().split('\n')[2:-1],
+                         ['dmz_seconds_bucket{le="1"} 1.0',
+                          'dmz_seconds_bucket{le="2"} 3.0',
+                          'dmz_seconds_bucket{le="+Inf"} 4.0',
+                          'dmz_seconds_sum 6.5',
+                          'dmz_seconds_count 4.0'])
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        # Sleeping on the fake clock moves it, so a run takes no time
+        metrics.time = FakeClock()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.done.wait,
+                                       name='sleeper')
+        self.thread.start()
+
+    def tearDown(self):
+        self.done.set()
+        self.thread.join()
+        metrics.time = time
+
+    def test_counts_each_threads_stack(self):
+        stacks = SamplingProfiler().run(0.02, 0.005).splitlines()
+        sleeper = [line for line in stacks if line.startswith('sleeper;')]
+        self.assertEqual(len(sleeper), 1)
+        self.assertTrue(sleeper[0].endswith(' 4'))
+        self.assertFalse([line for line in stacks
+                          if line.startswith('MainThread;')])
+
+    def test_one_run_at_a_time(self):
+        profiler = SamplingProfiler()
+        profiler._lock.acquire()
+        try:
+            self.assertEqual(profiler.run(0.02), None)
+        finally:
+            profiler._lock.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,531 @@
+#-------------------------------------------------------------------------
+# FILE:             test_mymultiflow.py
+# DESCRIPTION:      Tests for the DMZ switch
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import pox.core
+if pox.core.core is None:
+    pox.core.initialize()
+from pox.core import core
+from pox.lib.addresses import IPAddr, EthAddr, ETHER_BROADCAST
+from pox.lib.packet.arp import arp
+from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.icmp import icmp
+from pox.lib.packet.ipv4 import ipv4
+from pox.lib.packet.tcp import tcp
+import pox.openflow.libopenflow_01 as of
+
+import json
+import time
+import unittest
+
+import mymultiflow
+import ratelimit
+from mymultiflow import (SizeBasedDynamicDmzSwitch, PooledDmzSwitch,
+                         SwitchFlowState, Flow, PortMap, RuleTemplates,
+                         build_match, flow_key, compact_key, is_reroute,
+                         DMZ_EXPIRED, BACKOFF_EXPIRED)
+from estimators import make_estimator
+from metrics import ControllerMetrics
+from tests.fakes import FakeClock, FakeConnection
+from timerwheel import TimerWheel
+from timeseries import MemoryBudget
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+DPID = 1
+DPI_NAME = 'dpi'
+DPI_PORT = 9
+HOST_PORT = 1
+SERVER_PORT = 2
+SERVER_MAC = EthAddr('00:00:00:00:00:02')
+SERVER_IP = IPAddr('10.0.0.2')
+CLIENT_MAC = EthAddr('00:00:00:00:00:01')
+CLIENT_IP = IPAddr('10.0.0.1')
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class StatsEvent(object):
+
+    def __init__(self, stats):
+        self.dpid = DPID
+        self.stats = stats
+
+
+class PacketInEvent(object):
+    """ The parts of a POX PacketIn the switch reads. """
+
+    def __init__(self, packet, port):
+        self.parsed = packet
+        self.port = port
+        self.dpid = DPID
+        self.ofp = of.ofp_packet_in(in_port=port)
+        self.ofp.buffer_id = None
+
+
+def tcp_packet(tp_src):
+    segment = tcp(srcport=tp_src, dstport=80)
+    packet = ipv4(srcip=CLIENT_IP, dstip=SERVER_IP,
+                  protocol=ipv4.TCP_PROTOCOL, next=segment)
+    return ethernet(src=CLIENT_MAC, dst=SERVER_MAC, type=ethernet.IP_TYPE,
+                    next=packet)
+
+
+def icmp_packet():
+    packet = ipv4(srcip=CLIENT_IP, dstip=SERVER_IP,
+                  protocol=ipv4.ICMP_PROTOCOL, next=icmp())
+    return ethernet(src=CLIENT_MAC, dst=SERVER_MAC, type=ethernet.IP_TYPE,
+                    next=packet)
+
+
+def arp_request(hwsrc, protosrc, protodst):
+    request = arp(opcode=arp.REQUEST, hwsrc=hwsrc, protosrc=protosrc,
+                  hwdst=EthAddr('00:00:00:00:00:00'), protodst=protodst)
+    return ethernet(src=hwsrc, dst=ETHER_BROADCAST, type=ethernet.ARP_TYPE,
+                    next=request)
+
+
+def match(tp_src, in_port=HOST_PORT):
+    return of.ofp_match(in_port=in_port, dl_dst=SERVER_MAC,
+                        dl_type=0x800, nw_proto=6,
+                        nw_src=IPAddr('10.0.0.1'), nw_dst=IPAddr('10.0.0.2'),
+                        tp_src=tp_src, tp_dst=80)
+
+
+def entry(flow_match, port, priority=of.OFP_DEFAULT_PRIORITY, byte_count=0,
+          duration=1):
+    """ A flow stats entry for a rule outputting to port. """
+    return of.ofp_flow_stats(match=flow_match, byte_count=byte_count,
+                             duration_sec=duration, priority=priority,
+                             actions=[of.ofp_action_output(port=port)])
+
+
+class BuildMatchTest(unittest.TestCase):
+
+    def tearDown(self):
+        mymultiflow._rule_granularity = 'exact'
+
+    def test_exact_matches_every_field(self):
+        rule, priority = build_match(icmp_packet(), HOST_PORT, True)
+        self.assertEqual(rule, of.ofp_match.from_packet(icmp_packet(),
+                                                        HOST_PORT))
+        self.assertEqual(priority, of.OFP_DEFAULT_PRIORITY)
+
+    def test_flow_keeps_the_5_tuple(self):
+        mymultiflow._rule_granularity = 'flow'
+        rule, priority = build_match(tcp_packet(1000), HOST_PORT, True)
+        self.assertEqual(flow_key(rule),
+                         (CLIENT_IP, SERVER_IP, 1000, 80, HOST_PORT))
+        self.assertEqual(rule.dl_dst, SERVER_MAC)
+        self.assertEqual(priority, of.OFP_DEFAULT_PRIORITY)
+
+    def test_flow_matches_other_ip_on_hosts(self):
+        mymultiflow._rule_granularity = 'flow'
+        rule, priority = build_match(icmp_packet(), HOST_PORT, True)
+        self.assertEqual((rule.nw_src, rule.nw_dst, rule.tp_src),
+                         (CLIENT_IP, SERVER_IP, None))
+        self.assertEqual(priority, mymultiflow.COARSE_RULE_PRIORITY)
+
+    def test_flow_matches_non_ip_on_destination(self):
+        mymultiflow._rule_granularity = 'flow'
+        rule, priority = build_match(
+            arp_request(CLIENT_MAC, CLIENT_IP, SERVER_IP), HOST_PORT, True)
+        self.assertEqual((rule.in_port, rule.dl_dst, rule.nw_src),
+                         (HOST_PORT, ETHER_BROADCAST, None))
+        self.assertEqual(priority, mymultiflow.COARSE_RULE_PRIORITY)
+
+    def test_aggregate_folds_subnets_toward_the_dpi(self):
+        mymultiflow._rule_granularity = 'aggregate'
+        rule, priority = build_match(icmp_packet(), HOST_PORT, True)
+        self.assertEqual((rule.nw_src, rule.nw_dst, rule.dl_dst),
+                         (None, '10.0.0.0/24', None))
+        self.assertEqual(priority, mymultiflow.COARSE_RULE_PRIORITY)
+        # On the way out the destination MAC is still needed
+        rule, priority = build_match(icmp_packet(), DPI_PORT, False)
+        self.assertEqual((rule.nw_dst, rule.dl_dst), (SERVER_IP, SERVER_MAC))
+
+
+class SwitchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = FakeConnection(DPID, [(DPI_NAME, DPI_PORT)])
+        self.switch = SizeBasedDynamicDmzSwitch(
+            self.connection, False, DPI_NAME,
+            SwitchFlowState(DPID, make_estimator('window', 1, 1),
+                            MemoryBudget(10 ** 7)), 1000,
+            TimerWheel(mymultiflow.TIMER_WHEEL_TICK_SECS, time.time()),
+            1000, ControllerMetrics())
+        # Keep flow_mods as they are queued, before they are packed
+        self.sent = []
+        self.switch.flow_mods.send = self.sent.append
+
+    def send_rate(self, tp_src, port, rate, seconds):
+        """ Reports a flow at rate bits/sec once a second. """
+        for second in range(1, seconds + 1):
+            self.switch.handle_flow_stats(StatsEvent([entry(
+                match(tp_src), port, byte_count=int(second * rate / 8),
+                duration=second)]))
+
+    def row(self, tp_src):
+        return self.switch.flow_table.index[flow_key(match(tp_src))]
+
+    def test_elephant_goes_to_its_destination(self):
+        self.switch.macToPort[SERVER_MAC] = SERVER_PORT
+        self.send_rate(1000, DPI_PORT, 2 * self.switch.threshold, 3)
+        self.assertEqual([(msg.match.tp_src, msg.actions[0].port)
+                          for msg in self.sent],
+                         [(1000, SERVER_PORT)])
+
+    def test_elephant_to_an_unknown_host_is_not_flooded(self):
+        self.send_rate(1000, DPI_PORT, 2 * self.switch.threshold, 3)
+        self.assertEqual(self.sent, [])
+        self.assertFalse(self.switch.flow_table.in_dmz[self.row(1000)])
+
+    def test_coarse_entries_are_not_tracked(self):
+        coarse = of.ofp_match(in_port=HOST_PORT, dl_dst=SERVER_MAC)
+        self.switch.handle_flow_stats(StatsEvent(
+            [entry(coarse, DPI_PORT, mymultiflow.COARSE_RULE_PRIORITY),
+             entry(match(1000), DPI_PORT)]))
+        self.assertEqual(list(self.switch.flow_table.index),
+                         [flow_key(match(1000))])
+
+
+class RerouteTest(unittest.TestCase):
+
+    def test_reroutes_bypass_the_dpi_whatever_their_priority(self):
+        # A reroute is a MODIFY, which keeps the learned rule's priority
+        self.assertTrue(is_reroute(entry(match(1000), SERVER_PORT),
+                                   [DPI_PORT]))
+        self.assertTrue(is_reroute(
+            entry(match(1000), SERVER_PORT, mymultiflow.REROUTE_PRIORITY),
+            [DPI_PORT]))
+
+    def test_flows_to_or_from_the_dpi_are_not_reroutes(self):
+        self.assertFalse(is_reroute(entry(match(1000), DPI_PORT),
+                                    [DPI_PORT]))
+        self.assertFalse(is_reroute(
+            entry(match(1000, in_port=DPI_PORT), SERVER_PORT), [DPI_PORT]))
+
+
+class ReconnectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timers = TimerWheel(mymultiflow.TIMER_WHEEL_TICK_SECS,
+                                 time.time())
+        self.state = self.new_state()
+        self.connect()
+
+    def new_state(self):
+        return SwitchFlowState(DPID, make_estimator('window', 1, 1),
+                               MemoryBudget(10 ** 7))
+
+    def connect(self):
+        """ Connects the switch again, as after a restart or a flap. """
+        self.switch = SizeBasedDynamicDmzSwitch(
+            FakeConnection(DPID, [(DPI_NAME, DPI_PORT)]), False, DPI_NAME,
+            self.state, 1000, self.timers, 1000, ControllerMetrics())
+        self.sent = []
+        self.switch.flow_mods.send = self.sent.append
+
+    def reply(self, *entries):
+        self.switch.handle_flow_stats(StatsEvent(list(entries)))
+
+    def restart(self):
+        """ Checkpoints the switch's state and restores it in a new one. """
+        checkpoint = self.state.checkpoint()
+        self.state = self.new_state()
+        self.state.restore(*checkpoint)
+        self.connect()
+
+    def row(self, tp_src):
+        return self.switch.flow_table.index[flow_key(match(tp_src))]
+
+    def due(self):
+        return self.timers.advance(
+            time.time() + mymultiflow.RANDOM_TIMEOUT['max'] + 1)
+
+    def test_checkpoint_round_trip(self):
+        self.state.macToPort[SERVER_MAC] = SERVER_PORT
+        self.reply(entry(match(1000), DPI_PORT, byte_count=1000))
+        self.restart()
+        self.assertEqual(self.state.macToPort, {SERVER_MAC: SERVER_PORT})
+        self.assertEqual(list(self.state.restored[0]),
+                         [compact_key(match(1000))])
+
+    def test_restored_flows_carry_on(self):
+        rate = self.switch.threshold / 4
+        self.reply(entry(match(1000), DPI_PORT, byte_count=int(rate / 8)))
+        self.restart()
+        # Three times as fast since the last reply
+        self.reply(entry(match(1000), DPI_PORT, byte_count=int(rate / 2),
+                         duration=2))
+        self.assertEqual(self.switch.flow_table.rate[self.row(1000)],
+                         3 * rate)
+        self.assertEqual(self.state.restored, ({}, None))
+
+    def test_flows_gone_from_the_switch_are_forgotten_at_once(self):
+        self.reply(entry(match(1000), DPI_PORT), entry(match(1001), DPI_PORT))
+        self.connect()
+        self.reply(entry(match(1000), DPI_PORT))
+        self.assertEqual(list(self.switch.flow_table.index),
+                         [flow_key(match(1000))])
+
+    def test_reconnect_finds_the_flows_in_the_dmz(self):
+        # After a restart, only the switch knows which flows we rerouted
+        self.state.macToPort[SERVER_MAC] = SERVER_PORT
+        elephant = int(self.switch.threshold)
+        self.reply(entry(match(1000), SERVER_PORT, byte_count=elephant),
+                   entry(match(1001), DPI_PORT, byte_count=elephant),
+                   entry(match(1000, in_port=DPI_PORT), SERVER_PORT))
+        self.assertTrue(self.switch.flow_table.in_dmz[self.row(1000)])
+        # The one already in the DMZ is not rerouted again
+        self.assertEqual([msg.match.tp_src for msg in self.sent], [1001])
+
+    def test_dmz_timers_resume(self):
+        self.reply(entry(match(1000), SERVER_PORT,
+                         byte_count=int(self.switch.threshold)))
+        self.assertEqual(self.due(),
+                         [((DPID, flow_key(match(1000))), DMZ_EXPIRED)])
+
+
+class FakePool(object):
+    """ Keeps the calls a pooled switch makes on its worker. """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, dpid, method, args=(), callback=None):
+        self.sent.append((method,) + tuple(args))
+
+
+class PooledTimersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FakePool()
+        self.timers = TimerWheel(mymultiflow.TIMER_WHEEL_TICK_SECS,
+                                 time.time())
+        self.state = SwitchFlowState(DPID, None, None, self.pool)
+        self.key = compact_key(match(1000))
+        self.now = time.time()
+
+    def connect(self):
+        switch = PooledDmzSwitch(
+            self.pool, FakeConnection(DPID, [(DPI_NAME, DPI_PORT)]), False,
+            DPI_NAME, self.state, 1000, self.timers, 1000,
+            ControllerMetrics())
+        switch.flow_mods.send = lambda msg: None
+        return switch
+
+    def fire(self, switch=None):
+        """ Fires the due timers, or drops them if the switch is away. """
+        self.now += mymultiflow.RANDOM_TIMEOUT['max'] + 1
+        for (dpid, key), action in self.timers.advance(self.now):
+            if switch is not None:
+                switch.handle_timer(key, action)
+
+    def test_timers_fired_while_away_run_again(self):
+        self.state.dmz[self.key] = Flow(match(1000))
+        self.connect()
+        self.fire()
+        self.fire(self.connect())
+        self.assertEqual((self.state.dmz, self.state.backoff),
+                         ({}, set([self.key])))
+        self.fire()
+        self.fire(self.connect())
+        self.assertEqual(self.state.backoff, set())
+        self.assertEqual(self.pool.sent, [('kick', self.key),
+                                          ('release', self.key)])
+
+
+class StreamStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = FakeConnection(DPID, [(DPI_NAME, DPI_PORT)])
+        self.switch = SizeBasedDynamicDmzSwitch(
+            self.connection, False, DPI_NAME,
+            SwitchFlowState(DPID, make_estimator('window', 1, 1),
+                            MemoryBudget(10 ** 7)), 1000,
+            TimerWheel(mymultiflow.TIMER_WHEEL_TICK_SECS, time.time()),
+            1000, ControllerMetrics())
+        mymultiflow._stream_stats = True
+        self.turns = []
+        core.callLater = self.turns.append
+
+    def tearDown(self):
+        del core.callLater
+        mymultiflow._stream_stats = False
+
+    def part(self, *tp_srcs):
+        return of.ofp_stats_reply(type=of.OFPST_FLOW, body=[
+            entry(match(tp_src), DPI_PORT, byte_count=1000)
+            for tp_src in tp_srcs])
+
+    def turn(self):
+        self.turns.pop(0)()
+
+    def published(self):
+        return sorted(json.loads(self.switch.feed.snapshot_json()[1]))
+
+    def test_one_part_per_turn(self):
+        first, second = self.part(1000), self.part(1001, 1002)
+        self.switch.handle_stats_part(first)
+        self.switch.handle_stats_part(second)
+        self.assertEqual((first.body, second.body), ([], []))
+        self.assertEqual(len(self.turns), 1)
+        self.turn()
+        self.assertEqual(list(self.switch.flow_table.index),
+                         [flow_key(match(1000))])
+        self.turn()
+        self.assertEqual(len(self.switch.flow_table), 3)
+        self.assertEqual(self.turns, [])
+
+    def test_reply_is_closed_after_its_parts(self):
+        self.switch.handle_stats_part(self.part(1000))
+        self.switch.handle_flow_stats(StatsEvent([]))
+        self.turn()
+        self.assertEqual(self.published(), [])
+        self.turn()
+        self.assertEqual(self.published(), [str(flow_key(match(1000)))])
+
+    def test_entries_left_in_the_reply_are_processed(self):
+        self.switch.handle_flow_stats(StatsEvent(self.part(1000).body))
+        while self.turns:
+            self.turn()
+        self.assertEqual(self.published(), [str(flow_key(match(1000)))])
+
+
+class PortMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = FakeConnection(DPID, [(DPI_NAME, DPI_PORT)])
+        self.ports = PortMap(self.connection)
+        self.ports.get(DPI_NAME)
+        self.connection.ports[DPI_NAME] = of.ofp_phy_port(port_no=7)
+
+    def test_lookups_are_cached(self):
+        self.assertEqual(self.ports.get(DPI_NAME), DPI_PORT)
+
+    def test_port_status_drops_the_cache(self):
+        self.connection.raise_event('PortStatus')
+        self.assertEqual(self.ports.get(DPI_NAME), 7)
+
+    def test_features_drop_the_cache(self):
+        self.connection.raise_event('FeaturesReceived')
+        self.assertEqual(self.ports.get(DPI_NAME), 7)
+
+
+class RuleTemplatesTest(unittest.TestCase):
+
+    def test_rules_share_only_the_template_fields(self):
+        rules = RuleTemplates()
+        first = rules.build(SERVER_PORT, match(1000), 10, 'first')
+        second = rules.build(SERVER_PORT, match(1001), 20, 'second')
+        self.assertEqual((first.match.tp_src, first.priority, first.data),
+                         (1000, 10, 'first'))
+        self.assertEqual((second.match.tp_src, second.priority, second.data),
+                         (1001, 20, 'second'))
+        self.assertEqual(first.actions, [of.ofp_action_output(
+            port=SERVER_PORT)])
+        self.assertEqual(first.flags, of.OFPFF_SEND_FLOW_REM)
+        self.assertEqual(first.idle_timeout,
+                         mymultiflow.FLOW_ENTRY_IDLE_TIMEOUT_SECS)
+
+    def test_one_template_per_port(self):
+        rules = RuleTemplates()
+        rule = rules.build(DPI_PORT, match(1000), 10, None)
+        self.assertEqual(rule.actions, [of.ofp_action_output(port=DPI_PORT)])
+
+
+class PacketInLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        ratelimit.time = FakeClock()
+        self.connection = FakeConnection(DPID, [(DPI_NAME, DPI_PORT)])
+        self.switch = SizeBasedDynamicDmzSwitch(
+            self.connection, False, DPI_NAME,
+            SwitchFlowState(DPID, make_estimator('window', 1, 1),
+                            MemoryBudget(10 ** 7)), 1000,
+            None, 1000, ControllerMetrics())
+        self.rules = []
+        self.switch.flow_mods.send = self.rules.append
+
+    def tearDown(self):
+        ratelimit.time = time
+        mymultiflow._packet_in_rate = None
+
+    def packet_ins(self, count):
+        for tp_src in range(count):
+            self.switch._handle_PacketIn(
+                PacketInEvent(tcp_packet(1000 + tp_src), HOST_PORT))
+
+    def test_unlimited_by_default(self):
+        self.packet_ins(10)
+        self.assertEqual(len(self.rules), 10)
+        self.assertEqual(self.switch.packet_ins_limited, 0)
+
+    def test_storm_is_flooded(self):
+        mymultiflow._packet_in_rate = 1
+        self.packet_ins(4)
+        # Two seconds of burst go through the learning path
+        self.assertEqual(len(self.rules), 2)
+        self.assertEqual(self.switch.packet_ins_limited, 2)
+        self.assertEqual([msg.actions[0].port for msg in self.connection.sent
+                          if isinstance(msg, of.ofp_packet_out)],
+                         [of.OFPP_FLOOD] * 2)
+
+
+class ProxyArpTest(unittest.TestCase):
+
+    def setUp(self):
+        mymultiflow._proxy_arp = True
+        self.connection = FakeConnection(DPID, [(DPI_NAME, DPI_PORT)])
+        self.switch = SizeBasedDynamicDmzSwitch(
+            self.connection, False, DPI_NAME,
+            SwitchFlowState(DPID, make_estimator('window', 1, 1),
+                            MemoryBudget(10 ** 7)),
+            1000, None, 1000, ControllerMetrics())
+        self.switch.hosts.learn(SERVER_IP, SERVER_MAC, SERVER_PORT)
+
+    def tearDown(self):
+        mymultiflow._proxy_arp = False
+
+    def outputs(self, packet, port):
+        """ Returns where the switch sent the packet out. """
+        self.connection.sent = []
+        self.switch._handle_PacketIn(PacketInEvent(packet, port))
+        return [action.port for msg in self.connection.sent
+                if isinstance(msg, of.ofp_packet_out)
+                for action in msg.actions]
+
+    def test_cached_host_is_answered(self):
+        self.assertEqual(
+            self.outputs(arp_request(CLIENT_MAC, CLIENT_IP, SERVER_IP),
+                         HOST_PORT), [of.OFPP_IN_PORT])
+
+    def test_gratuitous_arp_reaches_every_host(self):
+        moved = EthAddr('00:00:00:00:00:03')
+        self.assertEqual(
+            self.outputs(arp_request(moved, SERVER_IP, SERVER_IP),
+                         HOST_PORT), [of.OFPP_FLOOD])
+        self.assertEqual(self.switch.hosts.get(SERVER_IP),
+                         (moved, HOST_PORT))
+
+    def test_probe_for_own_address_is_not_answered(self):
+        self.assertEqual(
+            self.outputs(arp_request(SERVER_MAC, IPAddr('0.0.0.0'),
+                                     SERVER_IP), SERVER_PORT),
+            [of.OFPP_FLOOD])
+
+
+if __name__ == '__main__':
+    unittest.main()
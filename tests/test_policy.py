@@ -0,0 +1,75 @@
+#-------------------------------------------------------------------------
+# FILE:             test_policy.py
+# DESCRIPTION:      Tests for per-flow thresholds and dwell times
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import numpy as np
+import unittest
+
+from policy import compile_policy, parse_subnet
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+CONFIG = {
+    'default': {'up': '1.0', 'down': '0.8', 'dwell': '2'},
+    'backups': {'src': '10.9.0.0/16', 'up': '2.0', 'down': '0.5'},
+    'backups_bulk': {'src': '10.9.0.0/16', 'min_bytes': '1000000',
+                     'dwell': '30', 'priority': '1'},
+    'dpi_side': {'in_port': '3', 'up': '1.5'},
+}
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def address(text):
+    return parse_subnet(text)[0]
+
+
+class PolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = compile_policy(CONFIG)
+
+    def decide(self, src, in_port, total_bytes):
+        """ Returns the (up, down, dwell) the policy gives one flow. """
+        masks = self.policy.masks(
+            np.array([address(src)], np.uint32),
+            np.array([address('10.0.0.2')], np.uint32),
+            np.array([in_port], np.int32))
+        rule = self.policy.select(masks, np.array([total_bytes],
+                                                  np.uint64))[0]
+        return (self.policy.up[rule], self.policy.down[rule],
+                self.policy.dwell[rule])
+
+    def test_default(self):
+        self.assertEqual(self.decide('10.0.0.1', 1, 0), (1.0, 0.8, 2.0))
+
+    def test_subnet_rule(self):
+        self.assertEqual(self.decide('10.9.1.1', 1, 0), (2.0, 0.5, 2.0))
+
+    def test_priority_and_min_bytes(self):
+        # The higher priority rule only applies once the flow is big
+        self.assertEqual(self.decide('10.9.1.1', 1, 2000000),
+                         (1.0, 0.8, 30.0))
+
+    def test_port_rule(self):
+        self.assertEqual(self.decide('10.0.0.1', 3, 0), (1.5, 0.8, 2.0))
+
+    def test_bad_rules(self):
+        for config in ({'x': {'src': '1.2.3.4/40'}},
+                       {'x': {'colour': 'red'}},
+                       {'default': {'up': '1', 'down': '2'}}):
+            self.assertRaises(RuntimeError, compile_policy, config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+#-------------------------------------------------------------------------
+# FILE:             test_poller.py
+# DESCRIPTION:      Tests for the flow statistics poll scheduler
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import pox.core
+if pox.core.core is None:
+    pox.core.initialize()
+from pox.core import core
+import pox.openflow
+import pox.openflow.libopenflow_01 as of
+
+import time
+import unittest
+
+import poller
+from metrics import ControllerMetrics
+from poller import (StatsPoller, FULL, TARGETED, PORTS,
+                    MAX_TARGETED_REQUESTS, FULL_SWEEP_INTERVALS)
+from tests.fakes import FakeClock, FakeConnection
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+DPID = 1
+HOST_PORTS = (1, 2)
+DPI_PORT = 3
+# Long enough that the poll timer never fires during a test
+INTERVAL = 3600
+SWEEP_INTERVAL = 3 * INTERVAL
+THRESHOLD = 1e6
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class StatsEvent(object):
+    """ The parts of a POX stats event the poller reads. """
+
+    def __init__(self, dpid, xid, stats):
+        self.dpid = dpid
+        self.ofp = [of.ofp_stats_reply(xid=xid)]
+        self.stats = stats
+
+
+class PollTest(unittest.TestCase):
+    """ Polls one fake switch on a fake clock. """
+
+    def setUp(self):
+        pox.openflow.launch()
+        poller.time = self.clock = FakeClock()
+        self.connection = FakeConnection(DPID)
+        core.openflow._connections[DPID] = self.connection
+
+    def tearDown(self):
+        core.openflow._connections.pop(DPID, None)
+        poller.time = time
+
+    def requests(self):
+        """ Returns and forgets the (kind, request) pairs sent so far. """
+        sent = [(self.poller._kinds.get(msg.xid), msg)
+                for msg in self.connection.sent]
+        self.connection.sent = []
+        return sent
+
+    def answer(self, sent):
+        """ Replies to every request and returns what reply() made of it. """
+        return [self.poller.reply(StatsEvent(DPID, request.xid, []))
+                for kind, request in sent]
+
+
+class TieredPollTest(PollTest):
+
+    def setUp(self):
+        PollTest.setUp(self)
+        self.hot = []
+        self.poller = StatsPoller(INTERVAL, ControllerMetrics(),
+                                  sweep_interval=SWEEP_INTERVAL,
+                                  hot_flows=lambda dpid: self.hot)
+        self.poller.poll(DPID)
+        self.answer(self.requests())
+        self.clock.now += INTERVAL
+
+    def test_first_poll_is_full(self):
+        self.poller._next_sweep.clear()
+        self.poller.poll(DPID)
+        self.assertEqual([kind for kind, request in self.requests()], [FULL])
+
+    def test_hot_flows_are_requested_by_match(self):
+        self.hot = [of.ofp_match(tp_src=1000), of.ofp_match(tp_src=1001)]
+        self.poller.poll(DPID)
+        sent = self.requests()
+        self.assertEqual([(kind, request.body.match.tp_src)
+                          for kind, request in sent],
+                         [(TARGETED, 1000), (TARGETED, 1001)])
+        # The switch is done once the last of them is answered
+        self.assertEqual(self.answer(sent),
+                         [(TARGETED, False), (TARGETED, True)])
+
+    def test_no_hot_flows_sends_nothing(self):
+        self.poller.poll(DPID)
+        self.assertEqual(self.requests(), [])
+
+    def test_many_hot_flows_take_one_full_request(self):
+        self.hot = [of.ofp_match(tp_src=port)
+                    for port in range(MAX_TARGETED_REQUESTS + 1)]
+        self.poller.poll(DPID)
+        self.assertEqual([kind for kind, request in self.requests()], [FULL])
+
+    def test_sweep_is_full(self):
+        self.hot = [of.ofp_match(tp_src=1000)]
+        self.clock.now += SWEEP_INTERVAL
+        self.poller.poll(DPID)
+        self.assertEqual([kind for kind, request in self.requests()], [FULL])
+
+    def test_unanswered_switch_is_skipped(self):
+        self.hot = [of.ofp_match(tp_src=1000)]
+        self.poller.poll(DPID)
+        self.poller.poll(DPID)
+        self.assertEqual(len(self.requests()), 1)
+        self.assertEqual(self.poller.requests_skipped, 1)
+
+    def test_unknown_reply(self):
+        self.assertEqual(self.poller.reply(StatsEvent(DPID, 0, [])),
+                         (None, True))
+
+
+class GatedPollTest(PollTest):
+
+    def setUp(self):
+        PollTest.setUp(self)
+        self.hot = []
+        self.threshold = THRESHOLD
+        self.updates = []
+        self.poller = StatsPoller(
+            INTERVAL, ControllerMetrics(), hot_flows=lambda dpid: self.hot,
+            gate_threshold=lambda dpid: self.threshold,
+            ignored_ports=lambda dpid: [DPI_PORT],
+            rates_updated=lambda dpid, rates: self.updates.append(
+                (dpid, rates)))
+        self.rx_bytes = dict((port, 0) for port in HOST_PORTS + (DPI_PORT,))
+        self.answered = self.clock.now
+        # Without earlier counters every port might be busy
+        self.answer(self.answer_ports({}))
+        self.clock.now += INTERVAL
+
+    def answer_ports(self, rx_bits):
+        """
+        Polls the switch and answers its port stats request as if each
+        port received rx_bits[port] bits/sec since the last answer.
+        """
+        self.poller.poll(DPID)
+        (kind, request), = self.requests()
+        self.assertEqual(kind, PORTS)
+        for port, bits in rx_bits.items():
+            self.rx_bytes[port] += int(bits * (self.clock.now -
+                                               self.answered) / 8)
+        self.answered = self.clock.now
+        stats = [of.ofp_port_stats(port_no=port, rx_bytes=rx_bytes,
+                                   tx_bytes=0)
+                 for port, rx_bytes in sorted(self.rx_bytes.items())]
+        self.poller._handle_PortStatsReceived(
+            StatsEvent(DPID, request.xid, stats))
+        return self.requests()
+
+    def test_sweep_with_every_host_port_busy_is_full(self):
+        # The DPI port is reported, but must not turn this into per-port
+        # requests: no FULL reply would ever come to age flows out
+        sent = self.answer_ports({1: 2 * THRESHOLD, 2: 2 * THRESHOLD})
+        self.assertEqual([kind for kind, request in sent], [FULL])
+
+    def test_sweep_with_some_ports_busy_targets_them(self):
+        sent = self.answer_ports({1: 2 * THRESHOLD, DPI_PORT: 4 * THRESHOLD})
+        self.assertEqual([(kind, request.body.match.in_port)
+                          for kind, request in sent], [(TARGETED, 1)])
+
+    def test_idle_switch_is_gated(self):
+        self.assertEqual(self.answer_ports({DPI_PORT: 4 * THRESHOLD}), [])
+        self.assertEqual(self.poller.flow_polls_gated, 1)
+
+    def test_idle_switch_is_still_swept_in_full(self):
+        for sweep in range(1, FULL_SWEEP_INTERVALS):
+            self.assertEqual(self.answer_ports({}), [])
+            self.clock.now += INTERVAL
+        sent = self.answer_ports({})
+        self.assertEqual([kind for kind, request in sent], [FULL])
+        self.assertEqual(self.answer(sent), [(FULL, True)])
+
+    def test_threshold_is_the_switches_own(self):
+        self.threshold = 4 * THRESHOLD
+        self.assertEqual(self.answer_ports({1: 2 * THRESHOLD}), [])
+
+    def test_port_rates_are_kept(self):
+        self.answer_ports({1: 8000})
+        self.assertEqual(self.poller.port_rates[DPID][1], (8000, 0))
+
+    def test_rates_are_handed_on_without_a_flow_poll(self):
+        # A gated switch sends no flow stats reply at all, yet its DPI
+        # ring still has to follow the DPI port's load
+        self.answer_ports({DPI_PORT: 4 * THRESHOLD})
+        (dpid, rates), = self.updates
+        self.assertEqual(dpid, DPID)
+        self.assertEqual(sorted(rates), [1, 2, DPI_PORT])
+
+    def test_first_port_reply_has_no_rates(self):
+        # setUp answered one already
+        self.assertEqual(self.updates, [])
+
+    def test_full_reply_is_the_last(self):
+        sent = self.answer_ports({1: 2 * THRESHOLD, 2: 2 * THRESHOLD})
+        self.assertEqual(self.answer(sent), [(FULL, True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
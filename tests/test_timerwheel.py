@@ -0,0 +1,61 @@
+#-------------------------------------------------------------------------
+# FILE:             test_timerwheel.py
+# DESCRIPTION:      Tests for the hierarchical timing wheel
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import unittest
+
+from timerwheel import TimerWheel
+
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(1.0, 0, slots=4, levels=2)
+
+    def test_fires_when_due_not_before(self):
+        self.wheel.schedule('a', 2.5, 'expire')
+        self.assertEqual(self.wheel.advance(2), [])
+        self.assertEqual(self.wheel.advance(3), [('a', 'expire')])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_far_timers_cascade_down(self):
+        # Past the first level, and past the top level altogether
+        self.wheel.schedule('a', 9)
+        self.wheel.schedule('b', 40)
+        fired = []
+        for now in range(1, 41):
+            fired += [(now, key) for key, payload in self.wheel.advance(now)]
+        self.assertEqual(fired, [(9, 'a'), (40, 'b')])
+
+    def test_rescheduling_replaces_the_timer(self):
+        self.wheel.schedule('a', 2)
+        self.wheel.schedule('a', 5)
+        self.assertEqual(self.wheel.advance(4), [])
+        self.assertEqual(self.wheel.advance(5), [('a', None)])
+
+    def test_cancel(self):
+        self.wheel.schedule('a', 2)
+        self.wheel.cancel('a')
+        self.wheel.cancel('a')
+        self.assertNotIn('a', self.wheel)
+        self.assertEqual(self.wheel.advance(10), [])
+
+    def test_past_deadline_fires_next_tick(self):
+        self.wheel.advance(5)
+        self.wheel.schedule('a', 1)
+        self.assertEqual(self.wheel.advance(6), [('a', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#-------------------------------------------------------------------------
+# FILE:             test_timeseries.py
+# DESCRIPTION:      Tests for the per-flow rate history
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import unittest
+
+from timeseries import TimeSeriesStore, MemoryBudget, INITIAL_SERIES
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+ROLLUPS = (('10s', 10, 4),)
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def store(budget, raw_samples=3):
+    return TimeSeriesStore(budget, raw_samples, ROLLUPS)
+
+
+def labels(count, prefix='flow'):
+    return ['%s%d' % (prefix, i) for i in range(count)]
+
+
+class RecordTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = store(MemoryBudget(10 ** 7))
+
+    def test_raw_ring_keeps_the_latest_samples(self):
+        for now in range(1, 6):
+            self.store.record(['a'], [now * 10.0], float(now))
+        self.assertEqual(self.store.query(None, 0, 100, 'raw'),
+                         {'a': [[3, 30], [4, 40], [5, 50]]})
+        self.assertEqual(self.store.query(['a'], 4, 4, 'raw'),
+                         {'a': [[4, 40]]})
+
+    def test_rollup_closes_buckets(self):
+        for now, value in ((101, 10), (105, 30), (112, 100), (121, 0)):
+            self.store.record(['a'], [float(value)], float(now))
+        self.assertEqual(self.store.query(['a', 'b'], 0, 200, '10s'),
+                         {'a': [[100, 10, 20, 30], [110, 100, 100, 100]]})
+
+
+class BudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.budget = MemoryBudget(0)
+        self.first = store(self.budget)
+        self.budget.limit = 4 * INITIAL_SERIES * self.first.bytes_per_series
+
+    def test_full_store_reuses_its_oldest_series(self):
+        self.budget.limit = INITIAL_SERIES * self.first.bytes_per_series
+        self.first.record(labels(INITIAL_SERIES), [1.0] * INITIAL_SERIES, 1)
+        self.first.record(['late'], [2.0], 2)
+        self.assertEqual(len(self.first.index), INITIAL_SERIES)
+        self.assertIn('late', self.first.index)
+
+    def test_store_alone_may_use_the_whole_budget(self):
+        count = 4 * INITIAL_SERIES
+        self.first.record(labels(count), [1.0] * count, 1)
+        self.assertEqual(len(self.first.index), count)
+        self.assertEqual(self.budget.used, self.budget.limit)
+
+    def test_late_store_gets_its_share(self):
+        count = 4 * INITIAL_SERIES
+        self.first.record(labels(count), [1.0] * count, 1)
+        self.first.record(labels(count // 2), [2.0] * (count // 2), 2)
+        late = store(self.budget)
+        late.record(labels(count, 'late'), [3.0] * count, 3)
+        self.assertEqual(len(late.index), 0)
+        # The first store drops its oldest half on its next cycle...
+        self.first.record(labels(count // 2), [4.0] * (count // 2), 4)
+        self.assertEqual(sorted(self.first.index), sorted(labels(count // 2)))
+        self.assertEqual(self.first.query(['flow1'], 0, 10, 'raw'),
+                         {'flow1': [[1, 1], [2, 2], [4, 4]]})
+        # ...and the late one fills the other half on its next
+        late.record(labels(count, 'late'), [5.0] * count, 5)
+        self.assertEqual(len(late.index), count // 2)
+
+    def test_close_leaves_the_budget(self):
+        late = store(self.budget)
+        late.record(['a'], [1.0], 1)
+        late.close()
+        self.assertEqual((self.budget.used, self.budget.members), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
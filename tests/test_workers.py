@@ -0,0 +1,140 @@
+#-------------------------------------------------------------------------
+# FILE:             test_workers.py
+# DESCRIPTION:      Tests for the flow stats worker processes
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import tests
+
+import numpy as np
+import threading
+import unittest
+from functools import partial
+
+from estimators import make_estimator
+from timeseries import MemoryBudget
+from workers import (ShardEngine, StatsWorkerPool, WorkerError,
+                     WORKER_COUNTERS)
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+DPID = 1
+DPI_PORT = 3
+THRESHOLD = 1000.0
+NOW = 101.0
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+def key(tp_src, in_port=1):
+    return (0x0a000001, 0x0a000002, tp_src, 80, in_port)
+
+
+def stats_args(keys, rates, now=NOW, duration=1):
+    """ The arguments of ShardEngine.stats() for one second at rates. """
+    return (np.array(keys, np.int64),
+            np.array([int(rate * duration / 8) for rate in rates], np.uint64),
+            np.full(len(keys), float(duration)), now, THRESHOLD,
+            THRESHOLD / 2, DPI_PORT)
+
+
+def end_args(full=True, last=True):
+    """ The arguments of ShardEngine.end(), after DPID. """
+    return (full, last, 100, 1, THRESHOLD / 2, DPI_PORT, 10)
+
+
+class ShardEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = ShardEngine(partial(make_estimator, 'window', 1, 1),
+                                  str, MemoryBudget(10 ** 6),
+                                  [0.0] * len(WORKER_COUNTERS))
+
+    def test_reply_round_trip(self):
+        self.assertEqual(self.engine.stats(
+            DPID, *stats_args([key(1000), key(1001), key(1002, DPI_PORT)],
+                              [2 * THRESHOLD, THRESHOLD / 4,
+                               2 * THRESHOLD])),
+            ([0], [], [0], [2 * THRESHOLD]))
+        forgotten, hot, summary = self.engine.end(DPID, *end_args())
+        self.assertEqual((forgotten, hot), ([], [key(1000)]))
+        top, total, size, dmz = summary
+        self.assertEqual([label for label, rate in top],
+                         [str(key(1000)), str(key(1002, DPI_PORT)),
+                          str(key(1001))])
+        self.assertEqual((size, dmz), (3, 1))
+        self.assertEqual(self.engine.counters[:2], [1, 3])
+
+    def test_flows_missing_from_full_replies_are_forgotten(self):
+        self.engine.stats(DPID, *stats_args([key(1000), key(1001)],
+                                            [THRESHOLD, THRESHOLD]))
+        self.engine.end(DPID, *end_args())
+        self.engine.stats(DPID, *stats_args([key(1000)], [THRESHOLD],
+                                            NOW + 1, 2))
+        # A targeted reply says nothing about the flows it left out
+        self.assertEqual(self.engine.end(DPID, *end_args(False))[0], [])
+        self.engine.stats(DPID, *stats_args([key(1000)], [THRESHOLD],
+                                            NOW + 2, 3))
+        self.assertEqual(self.engine.end(DPID, *end_args())[0], [key(1001)])
+
+    def test_top_flows_on_a_port(self):
+        self.engine.stats(DPID, *stats_args([key(1000), key(1001, 2)],
+                                            [THRESHOLD, 2 * THRESHOLD]))
+        self.assertEqual(self.engine.top(DPID, 10, 1), [])
+        self.engine.end(DPID, *end_args())
+        self.assertEqual(self.engine.top(DPID, 10, 1),
+                         [(str(key(1000)), THRESHOLD)])
+
+    def test_dropped_switch_starts_over(self):
+        self.engine.stats(DPID, *stats_args([key(1000)], [2 * THRESHOLD]))
+        self.engine.drop(DPID)
+        self.assertEqual(self.engine.top(DPID, 10, None), [])
+        self.assertEqual(self.engine.stats(
+            DPID, *stats_args([key(1000)], [2 * THRESHOLD]))[0], [0])
+
+
+class StatsWorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = StatsWorkerPool(2, partial(make_estimator, 'window', 1, 1),
+                                    str, 10 ** 6, self.post)
+        self.posted = []
+
+    def tearDown(self):
+        self.pool.close()
+
+    def post(self, callback, result):
+        self.posted.append(threading.current_thread())
+        callback(result)
+
+    def test_results_are_posted(self):
+        results = []
+        for dpid in (DPID, DPID + 1):
+            self.pool.send(dpid, 'stats',
+                           stats_args([key(1000)], [2 * THRESHOLD]),
+                           results.append)
+        self.assertTrue(self.pool.wait(10))
+        self.assertEqual(results, [([0], [], [0], [2 * THRESHOLD])] * 2)
+        self.assertEqual(len(self.posted), 2)
+
+    def test_calls_to_a_worker_run_in_order(self):
+        self.pool.send(DPID, 'stats', stats_args([key(1000)], [THRESHOLD]))
+        self.pool.send(DPID, 'end', end_args())
+        self.assertEqual(self.pool.call(DPID, 'top', 10, None),
+                         [(str(key(1000)), THRESHOLD)])
+        # Each switch lives in its own worker
+        self.assertEqual(self.pool.call(DPID + 1, 'top', 10, None), [])
+        self.assertEqual(self.pool.counters()['replies'], [0, 1])
+
+    def test_failed_call_raises(self):
+        self.assertRaises(WorkerError, self.pool.call, DPID, 'stats', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#-------------------------------------------------------------------------
+# FILE:             timerwheel.py
+# DESCRIPTION:      Hierarchical timer wheel for per-flow deadlines
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import math
+
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timing wheel keyed on an arbitrary hashable id.
+
+    Level 0 has one slot per tick, and each higher level has slots that
+    are `slots` times wider. A timer goes into the lowest level that can
+    hold its deadline and is moved down a level each time the wheel above
+    it turns over. Scheduling and cancelling are O(1). Advancing the wheel
+    only touches the slots whose time has come. A key holds at most one
+    timer, so scheduling an existing key replaces its timer.
+    """
+
+    def __init__(self, tick, now, slots=64, levels=3):
+        self.tick = float(tick)
+        self.slots = slots
+        self.levels = levels
+        self._wheels = [[{} for i in range(slots)] for j in range(levels)]
+        self._where = {}
+        self._current = int(now / self.tick)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _insert(self, key, deadline, payload):
+        delta = deadline - self._current
+        level = 0
+        while level < self.levels - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        # Deadlines past the top level wait in its furthest slot and are
+        # cascaded again when they reach it.
+        delta = min(delta, self.slots ** self.levels - 1)
+        slot = ((self._current + delta) // self.slots ** level) % self.slots
+        self._wheels[level][slot][key] = (deadline, payload)
+        self._where[key] = (level, slot)
+
+    def schedule(self, key, when, payload=None):
+        """ Fires payload for key at time `when` (seconds). """
+        self.cancel(key)
+        deadline = max(int(math.ceil(when / self.tick)), self._current + 1)
+        self._insert(key, deadline, payload)
+
+    def cancel(self, key):
+        where = self._where.pop(key, None)
+        if where is not None:
+            del self._wheels[where[0]][where[1]][key]
+
+    def advance(self, now):
+        """
+        Turns the wheel up to time `now` and returns the (key, payload) of
+        every timer that came due.
+        """
+        fired = []
+        target = int(now / self.tick)
+        while self._current < target:
+            self._current += 1
+            for level in range(self.levels - 1, 0, -1):
+                width = self.slots ** level
+                if self._current % width == 0:
+                    self._cascade(level, (self._current // width) % self.slots)
+
+            slot = self._wheels[0][self._current % self.slots]
+            if not slot:
+                continue
+            self._wheels[0][self._current % self.slots] = {}
+            for key, (deadline, payload) in slot.items():
+                del self._where[key]
+                if deadline <= self._current:
+                    fired.append((key, payload))
+                else:
+                    self._insert(key, deadline, payload)
+        return fired
+
+    def _cascade(self, level, index):
+        slot = self._wheels[level][index]
+        if not slot:
+            return
+        self._wheels[level][index] = {}
+        for key, (deadline, payload) in slot.items():
+            del self._where[key]
+            self._insert(key, deadline, payload)
@@ -0,0 +1,380 @@
+#-------------------------------------------------------------------------
+# FILE:             timeseries.py
+# DESCRIPTION:      Bounded per-flow rate history with rollups
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+import numpy as np
+import threading
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+RAW_SAMPLES = 600
+# (name, seconds per bucket, buckets kept)
+ROLLUPS = (('10s', 10, 360), ('1m', 60, 1440))
+INITIAL_SERIES = 64
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class MemoryBudget(object):
+    """
+    Bytes shared by every TimeSeriesStore in the controller.
+
+    Each store is entitled to an equal share. Stores may grow past their
+    share while memory is free, but once a store below its share is
+    refused, the budget is contended and stores above their share give
+    the excess back (see TimeSeriesStore.record).
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.members = 0
+        self.contended = False
+        self._lock = threading.Lock()
+
+    @property
+    def share(self):
+        return self.limit // max(1, self.members)
+
+    def join(self):
+        with self._lock:
+            self.members += 1
+
+    def leave(self):
+        with self._lock:
+            self.members -= 1
+
+    def reserve(self, nbytes, held=0):
+        """
+        Takes nbytes from the budget if they are there. held is what the
+        caller already has; a refused caller below its share marks the
+        budget contended.
+        """
+        with self._lock:
+            if self.used + nbytes > self.limit:
+                if held < self.share:
+                    self.contended = True
+                return False
+            self.used += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self._lock:
+            self.used -= nbytes
+            self.contended = False
+
+
+class _Ring(object):
+    """
+    One fixed-size ring per series for each field, in a 2-D array.
+    """
+
+    def __init__(self, fields, length):
+        self.fields = fields
+        self.length = length
+        self.cursor = np.zeros(0, np.int32)
+        for name, dtype in fields:
+            setattr(self, name, np.zeros((0, length), dtype))
+
+    @property
+    def bytes_per_series(self):
+        return 4 + self.length * sum(np.dtype(dtype).itemsize
+                                     for name, dtype in self.fields)
+
+    def resize(self, capacity, keep):
+        """ Reallocates for capacity series, moving keep to the front. """
+        cursor = np.zeros(capacity, np.int32)
+        cursor[:len(keep)] = self.cursor[keep]
+        self.cursor = cursor
+        for name, dtype in self.fields:
+            ring = np.zeros((capacity, self.length), dtype)
+            ring[:len(keep)] = getattr(self, name)[keep]
+            setattr(self, name, ring)
+
+    def clear(self, slots):
+        self.cursor[slots] = 0
+        for name, dtype in self.fields:
+            getattr(self, name)[slots] = 0
+
+    def append(self, slots, **values):
+        cursor = self.cursor[slots]
+        for name, value in values.items():
+            getattr(self, name)[slots, cursor] = value
+        self.cursor[slots] = (cursor + 1) % self.length
+
+    def copy(self, slots):
+        """ Returns a copy of the slots' cursors and fields, for read(). """
+        return (self.cursor[slots],
+                [getattr(self, name)[slots] for name, dtype in self.fields])
+
+    @staticmethod
+    def read(copy, i, start, end):
+        """
+        Returns the i-th copied slot's entries with start <= time <= end,
+        oldest first, one array per field.
+        """
+        cursor, fields = copy
+        order = np.roll(np.arange(fields[0].shape[1]), -cursor[i])
+        times = fields[0][i, order]
+        keep = order[(times > 0) & (times >= start) & (times <= end)]
+        return [field[i, keep] for field in fields]
+
+
+class _Rollup(object):
+    """
+    Min/avg/max of every series over fixed-width time buckets.
+
+    Samples are folded into a per-series accumulator; when a sample for a
+    later bucket arrives, the finished bucket is written to the ring and
+    handed back so the next, wider rollup can fold it in.
+    """
+
+    def __init__(self, width, length):
+        self.width = width
+        self.ring = _Ring((('time', np.float64), ('min', np.float32),
+                           ('avg', np.float32), ('max', np.float32)), length)
+        self.bucket = np.zeros(0, np.int64)
+        self.low = np.zeros(0)
+        self.high = np.zeros(0)
+        self.total = np.zeros(0)
+        self.count = np.zeros(0, np.int64)
+
+    @property
+    def bytes_per_series(self):
+        return self.ring.bytes_per_series + 8 * 5
+
+    def resize(self, capacity, keep):
+        self.ring.resize(capacity, keep)
+        for name in ('bucket', 'low', 'high', 'total', 'count'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:len(keep)] = old[keep]
+            setattr(self, name, new)
+        self.bucket[len(keep):] = -1
+
+    def clear(self, slots):
+        self.ring.clear(slots)
+        self.bucket[slots] = -1
+        self.count[slots] = 0
+
+    def add(self, slots, times, low, high, total, count):
+        """
+        Folds samples (already partial aggregates) into the given series.
+        Returns the buckets this closed, in the same form, or None.
+        """
+        bucket = (times // self.width).astype(np.int64)
+        previous = self.bucket[slots]
+        closed = (previous >= 0) & (previous != bucket)
+
+        finished = None
+        if closed.any():
+            done = slots[closed]
+            counts = self.count[done]
+            finished = (done, (previous[closed] * self.width).astype(np.float64),
+                        self.low[done], self.high[done], self.total[done],
+                        counts)
+            self.ring.append(done, time=finished[1], min=finished[2],
+                             avg=finished[4] / counts, max=finished[3])
+
+        fresh = slots[closed | (previous < 0)]
+        self.low[fresh] = np.inf
+        self.high[fresh] = -np.inf
+        self.total[fresh] = 0
+        self.count[fresh] = 0
+        self.bucket[slots] = bucket
+
+        self.low[slots] = np.minimum(self.low[slots], low)
+        self.high[slots] = np.maximum(self.high[slots], high)
+        self.total[slots] += total
+        self.count[slots] += count
+        return finished
+
+
+class TimeSeriesStore(object):
+    """
+    Rate history of every flow on one switch, within a memory budget.
+
+    Each flow label owns a slot: a ring of raw samples at full resolution
+    and one ring per rollup (10 s and 1 min min/avg/max by default). Every
+    stats cycle is written for all flows at once. When the budget runs
+    out, the series updated least recently are reused, and a store holding
+    more than its share of a contended budget drops its oldest series.
+    """
+
+    def __init__(self, budget, raw_samples=RAW_SAMPLES, rollups=ROLLUPS):
+        self.budget = budget
+        budget.join()
+        self.index = {}
+        self.labels = []
+        self.size = 0
+        self.capacity = 0
+        self.last_update = np.zeros(0)
+        self.raw = _Ring((('time', np.float64), ('value', np.float32)),
+                         raw_samples)
+        self.rollups = [(name, _Rollup(width, length))
+                        for name, width, length in rollups]
+        self._free = []
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_per_series(self):
+        return 8 + self.raw.bytes_per_series + sum(
+            rollup.bytes_per_series for name, rollup in self.rollups)
+
+    @property
+    def resolutions(self):
+        return ['raw'] + [name for name, rollup in self.rollups]
+
+    @property
+    def held(self):
+        return self.capacity * self.bytes_per_series
+
+    def _resize(self, capacity, keep):
+        last_update = np.zeros(capacity)
+        last_update[:len(keep)] = self.last_update[keep]
+        self.last_update = last_update
+        self.raw.resize(capacity, keep)
+        for name, rollup in self.rollups:
+            rollup.resize(capacity, keep)
+        self.capacity = capacity
+
+    def _grow(self):
+        capacity = max(INITIAL_SERIES, self.capacity * 2)
+        while capacity > self.capacity and not self.budget.reserve(
+                (capacity - self.capacity) * self.bytes_per_series,
+                self.held):
+            capacity = self.capacity + (capacity - self.capacity) // 2
+        if capacity == self.capacity:
+            return False
+        self._resize(capacity, np.arange(self.size))
+        return True
+
+    def _shrink(self, capacity):
+        """
+        Gives back all but capacity series, keeping the ones updated most
+        recently and packing them into the first slots.
+        """
+        live = np.array(sorted(self.index.values()), np.intp)
+        if len(live) > capacity:
+            newest = np.argsort(self.last_update[live], kind='mergesort')
+            live = np.sort(live[newest[len(live) - capacity:]])
+        labels = [self.labels[slot] for slot in live]
+        released = self.held
+        self._resize(capacity, live)
+        self.budget.release(released - self.held)
+        self.index = dict((label, slot) for slot, label in enumerate(labels))
+        self.labels = labels
+        self.size = len(labels)
+        self._free = []
+
+    def _reuse_oldest(self, count, keep):
+        """
+        Frees the count series updated least recently, leaving out the
+        slots in keep (the ones being recorded) and slots already free.
+        """
+        ages = self.last_update[:self.size].copy()
+        ages[keep] = np.inf
+        candidates = np.flatnonzero(ages < np.inf)
+        count = min(count, len(candidates))
+        if not count:
+            return
+        oldest = candidates[np.argpartition(ages[candidates],
+                                            count - 1)[:count]]
+        for slot in oldest:
+            del self.index[self.labels[slot]]
+            self._free.append(slot)
+        self._clear(oldest)
+        self.last_update[oldest] = np.inf
+
+    def close(self):
+        """ Hands the store's memory back to the budget. """
+        with self._lock:
+            self.budget.release(self.held)
+            self.budget.leave()
+            self._resize(0, np.arange(0))
+            self.index = {}
+            self.labels = []
+            self.size = 0
+            self._free = []
+
+    def _clear(self, slots):
+        self.raw.clear(slots)
+        for name, rollup in self.rollups:
+            rollup.clear(slots)
+
+    def _slots(self, labels):
+        slots = np.array([self.index.get(label, -1) for label in labels],
+                         np.intp)
+        missing = np.flatnonzero(slots < 0)
+        short = len(missing) - len(self._free) - (self.capacity - self.size)
+        while short > 0 and self._grow():
+            short = len(missing) - len(self._free) - \
+                (self.capacity - self.size)
+        if short > 0:
+            self._reuse_oldest(short, slots[slots >= 0])
+        for i in missing:
+            if self._free:
+                slot = self._free.pop()
+                self.labels[slot] = labels[i]
+            elif self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+                self.labels.append(labels[i])
+            else:
+                continue
+            self.index[labels[i]] = slots[i] = slot
+        return slots
+
+    def record(self, labels, values, now):
+        """ Appends one sample for each labelled series. """
+        with self._lock:
+            budget = self.budget
+            if budget.contended and self.held > budget.share:
+                self._shrink(budget.share // self.bytes_per_series)
+            slots = self._slots(labels)
+            kept = slots >= 0
+            slots = slots[kept]
+            values = np.asarray(values)[kept]
+            self.last_update[slots] = now
+            self.raw.append(slots, time=now, value=values)
+
+            times = np.full(len(slots), now)
+            closed = (slots, times, values, values, values,
+                      np.ones(len(slots), np.int64))
+            for name, rollup in self.rollups:
+                closed = rollup.add(*closed)
+                if closed is None:
+                    break
+
+    def query(self, labels, start, end, resolution):
+        """
+        Returns {label: rows} for the labelled series between start and end.
+        Raw rows are [time, value]; rollup rows are [time, min, avg, max].
+
+        Only copying the series holds the lock; record() can go on while
+        the rows are built.
+        """
+        with self._lock:
+            if labels is None:
+                labels = list(self.index)
+            if resolution == 'raw':
+                ring = self.raw
+            else:
+                ring = dict(self.rollups)[resolution].ring
+            found = [(label, self.index[label]) for label in labels
+                     if label in self.index]
+            copy = ring.copy(np.array([slot for label, slot in found],
+                                      np.intp))
+        result = {}
+        for i, (label, slot) in enumerate(found):
+            columns = _Ring.read(copy, i, start, end)
+            result[label] = np.column_stack(columns).tolist()
+        return result
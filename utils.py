@@ -216,19 +216,21 @@ def createArpRequest(packet, ip, logger):
   pkt.dst = ETHER_BROADCAST
   return pkt
 
-def createArpReply(packet, ip, logger):
+def createArpReply(packet, ip, mac, logger):
+  # Answers the ARP request in packet: ip is at mac. The reply goes back
+  # to whoever asked.
   if not packetIsARP(packet, logger):
      logger.warn("Packet is not ARP")
      return
   origarp = packet.next
   arppkt = arp()
-  arppkt.hwsrc      = origarp.hwsrc
-  arppkt.hwdst      = origarp.hwdst
+  arppkt.hwsrc      = mac
+  arppkt.hwdst      = origarp.hwsrc
   arppkt.hwlen      = origarp.hwlen
   arppkt.opcode     = arp.REPLY
   arppkt.protolen   = origarp.protolen
   arppkt.protosrc   = IPAddr(ip)
-  arppkt.protodst   = origarp.protodst
+  arppkt.protodst   = origarp.protosrc
   pkt = ethernet()
   pkt.set_payload(arppkt)
   pkt.type = ethernet.ARP_TYPE
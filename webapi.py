@@ -0,0 +1,195 @@
+#-------------------------------------------------------------------------
+# FILE:             webapi.py
+# DESCRIPTION:      Controller-wide HTTP API and dashboard server
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from pox.core import core
+from pox.lib.util import dpid_to_str, str_to_dpid
+from flask import Flask
+from flask import render_template
+from flask import Response
+from flask import redirect
+from flask import request
+from metrics import SamplingProfiler, PROFILE_INTERVAL_SECS
+from dashboard import TOP_FLOWS
+import logging
+import json
+import threading
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+API_HOST = '0.0.0.0'
+API_PORT = 5000
+
+#-------------------------------------------------------------------------
+# VARIABLES
+#-------------------------------------------------------------------------
+flask_log = logging.getLogger('werkzeug')
+flask_log.setLevel(logging.ERROR)
+
+log = core.getLogger()
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class WebApi(object):
+    """
+    One HTTP server for every switch, with the routes under
+    /switches/<dpid>/.
+
+    Requests run on the server's own threads and only read what the POX
+    thread has published: each switch's BandwidthFeed snapshot and its
+    TimeSeriesStore. A slow client never holds up stats processing.
+
+    /data serves the dashboard's top flows, /data?all=1 every flow, and
+    /top the fastest flows overall or from one in_port.
+
+    /metrics serves the controller's metrics to Prometheus, and
+    /profile?seconds=N samples every thread's stack for N seconds and
+    returns them folded, for flame graphs.
+    """
+
+    def __init__(self, flow_states, metrics, port_rates, host=API_HOST,
+                 port=API_PORT):
+        self.flow_states = flow_states
+        self.metrics = metrics
+        self.port_rates = port_rates
+        self.profiler = SamplingProfiler()
+        self.host = host
+        self.port = port
+        self.app = Flask(__name__)
+        self._add_routes(self.app)
+
+    def start(self):
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        log.info("Dashboard on http://%s:%d/" % (self.host, self.port))
+        self.app.run(host=self.host, port=self.port, threaded=True)
+
+    def _state(self, dpid):
+        try:
+            return self.flow_states.find(str_to_dpid(dpid))
+        except Exception:
+            return None
+
+    def _add_routes(self, app):
+
+        @app.route("/")
+        def index():
+            dpids = self.flow_states.dpids()
+            if len(dpids) != 1:
+                return switches()
+            return redirect("/switches/%s/" % (dpid_to_str(dpids[0]),))
+
+        @app.route("/metrics")
+        def metrics():
+            return Response(self.metrics.render(),
+                            mimetype='text/plain; version=0.0.4')
+
+        @app.route("/profile")
+        def profile():
+            try:
+                seconds = float(request.args.get('seconds', 10))
+                interval = float(request.args.get('interval',
+                                                  PROFILE_INTERVAL_SECS))
+                assert seconds > 0 and interval > 0
+            except (ValueError, AssertionError):
+                return Response("seconds and interval must be positive",
+                                status=400)
+            stacks = self.profiler.run(seconds, interval)
+            if stacks is None:
+                return Response("A profile is already running", status=409)
+            return Response(stacks, mimetype='text/plain')
+
+        @app.route("/switches")
+        def switches():
+            return Response(json.dumps(
+                [dpid_to_str(dpid) for dpid in sorted(self.flow_states.dpids())]),
+                mimetype='application/json')
+
+        @app.route("/switches/<dpid>/")
+        def dashboard(dpid):
+            if self._state(dpid) is None:
+                return Response("Unknown switch", status=404)
+            return render_template("index.html")
+
+        @app.route("/switches/<dpid>/data")
+        def data(dpid):
+            # The dashboard's flows, or every flow with ?all=1
+            state = self._state(dpid)
+            if state is None:
+                return Response("Unknown switch", status=404)
+            everything = request.args.get('all', '0') not in ('', '0')
+            return Response(state.feed.snapshot_json(everything)[1],
+                            mimetype='application/json')
+
+        @app.route("/switches/<dpid>/top")
+        def top(dpid):
+            # ?n=<count>&port=<in_port>: [[label, bits/sec], ...], fastest
+            # first, from every port if none is named
+            state = self._state(dpid)
+            if state is None:
+                return Response("Unknown switch", status=404)
+            try:
+                n = int(request.args.get('n', TOP_FLOWS))
+                port = request.args.get('port')
+                port = None if port is None else int(port)
+                assert n > 0
+            except (ValueError, AssertionError):
+                return Response("n must be a positive integer and port an "
+                                "integer", status=400)
+            ranking = state.feed.ranking
+            flows = [] if ranking is None else ranking.top(n, port)
+            return Response(json.dumps([[flow.label, rate]
+                                        for flow, rate in flows]),
+                            mimetype='application/json')
+
+        @app.route("/switches/<dpid>/stream")
+        def stream(dpid):
+            state = self._state(dpid)
+            if state is None:
+                return Response("Unknown switch", status=404)
+            return Response(state.feed.stream(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache'})
+
+        @app.route("/switches/<dpid>/ports")
+        def ports(dpid):
+            # {port: [rx, tx]} in bits/sec; empty without port gating
+            if self._state(dpid) is None:
+                return Response("Unknown switch", status=404)
+            rates = self.port_rates.get(str_to_dpid(dpid), {})
+            return Response(json.dumps(dict(
+                (str(port), list(rate)) for port, rate in rates.items())),
+                mimetype='application/json')
+
+        @app.route("/switches/<dpid>/history")
+        def history(dpid):
+            # ?flows=<label>&flows=...&start=<secs>&end=<secs>
+            #     &resolution=raw|10s|1m
+            # Every flow if none are named.
+            state = self._state(dpid)
+            if state is None:
+                return Response("Unknown switch", status=404)
+            store = state.history
+            try:
+                start = float(request.args.get('start', 0))
+                end = float(request.args.get('end', 'inf'))
+            except ValueError:
+                return Response("start and end must be numbers", status=400)
+            resolution = request.args.get('resolution', 'raw')
+            if resolution not in store.resolutions:
+                return Response("resolution must be one of %s" %
+                                (", ".join(store.resolutions),), status=400)
+            flows = request.args.getlist('flows') or None
+            return Response(json.dumps(store.query(
+                flows, start, end, resolution)), mimetype='application/json')
@@ -0,0 +1,362 @@
+#-------------------------------------------------------------------------
+# FILE:             workers.py
+# DESCRIPTION:      Worker processes that run flow stats processing
+#-------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------
+# IMPORTS
+#-------------------------------------------------------------------------
+from flowtable import FlowTable
+from timeseries import TimeSeriesStore, MemoryBudget, ROLLUPS
+from itertools import count
+import multiprocessing
+import threading
+import numpy as np
+import time
+
+
+#-------------------------------------------------------------------------
+# CONSTANTS
+#-------------------------------------------------------------------------
+# What each worker counts in shared memory, in order
+WORKER_COUNTERS = ('replies', 'entries', 'busy_seconds', 'flows',
+                   'flaps_prevented')
+# How long a web request waits on a worker before giving up
+CALL_TIMEOUT_SECS = 10
+
+#-------------------------------------------------------------------------
+# CLASSES
+#-------------------------------------------------------------------------
+
+
+class WorkerError(Exception):
+    """ A worker failed a call, or did not answer in time. """
+    pass
+
+
+class TrackedFlow(object):
+    """ What a worker knows about a flow: its key and dashboard label. """
+    __slots__ = ('key', 'label')
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+
+
+class ShardEngine(object):
+    """
+    The flow stats half of every switch in one worker's shard.
+
+    It runs in the worker process and keeps each switch's FlowTable and
+    TimeSeriesStore there, doing what SizeBasedDynamicDmzSwitch does with
+    a reply's entries. Flows are keyed by tuples of integers, which are
+    cheap to send, and label(key) names them for the dashboard. Only which
+    entries to reroute, which flows were forgotten and a summary for the
+    dashboard go back.
+    """
+
+    def __init__(self, new_estimator, label, history_budget, counters,
+                 policy=None):
+        self.new_estimator = new_estimator
+        self.policy = policy
+        self.label = label
+        self.history_budget = history_budget
+        self.counters = counters
+        self.tables = {}
+        self.histories = {}
+        self.rankings = {}
+        self._reply_rows = {}
+
+    def _table(self, dpid):
+        table = self.tables.get(dpid)
+        if table is None:
+            table = self.tables[dpid] = FlowTable(self.new_estimator(),
+                                                  policy=self.policy)
+            self.histories[dpid] = TimeSeriesStore(self.history_budget)
+        return table
+
+    def stats(self, dpid, keys, byte_counts, durations, now, threshold,
+              hot_threshold, exclude_ports):
+        """
+        Folds some of a reply's entries into the switch's table. keys is
+        an array with one row of integers per entry. Returns the positions
+        of new elephants, of mice leaving the DMZ and of flows worth
+        polling between sweeps, then the rates of the elephants and mice
+        in that order.
+        """
+        table = self._table(dpid)
+        keys = [tuple(key) for key in keys.tolist()]
+        rows = table.lookup(keys)
+        for i in np.flatnonzero(rows < 0):
+            rows[i] = table.add(keys[i],
+                                TrackedFlow(keys[i], self.label(keys[i])))
+        rates = table.update(rows, byte_counts, durations, now)
+        self._reply_rows.setdefault(dpid, []).append(rows)
+        self.histories[dpid].record(
+            [table.flows[row].label for row in rows], rates, now)
+
+        elephants, mice, prevented = table.classify(rows, threshold,
+                                                    exclude_ports)
+        hot = table.in_dmz[rows] | (
+            (rates >= hot_threshold) &
+            ~np.in1d(table.in_port[rows], exclude_ports))
+        self.counters[1] += len(keys)
+        self.counters[4] += prevented
+        elephants = np.flatnonzero(np.in1d(rows, elephants))
+        mice = np.flatnonzero(np.in1d(rows, mice))
+        return (elephants.tolist(), mice.tolist(),
+                np.flatnonzero(hot).tolist(),
+                rates[np.concatenate((elephants, mice))].tolist())
+
+    def end(self, dpid, full, last, max_flows, age_after, hot_threshold,
+            exclude_ports, top_flows):
+        """
+        Closes a reply: ages and evicts flows, then ranks what is left.
+        Returns the keys forgotten, the keys still worth polling and the
+        ranking's (top, total, count, dmz count).
+        """
+        table = self._table(dpid)
+        rows = self._reply_rows.pop(dpid, [])
+        forgotten = []
+        if full:
+            forgotten = table.age(np.concatenate(rows + [np.zeros(0, np.intp)]),
+                                  age_after)
+        forgotten += table.evict(max_flows)
+        summary = None
+        if full or last:
+            ranking = self.rankings[dpid] = table.ranking()
+            summary = ([(flow.label, rate)
+                        for flow, rate in ranking.top(top_flows)],
+                       ranking.total, len(ranking), table.dmz_count())
+        hot = [table.keys[row]
+               for row in table.hot(hot_threshold, exclude_ports)]
+        self.counters[0] += 1
+        self.counters[3] = sum(len(t) for t in self.tables.values())
+        return forgotten, hot, summary
+
+    def demote(self, dpid, key):
+        row = self._table(dpid).index.get(key)
+        if row is not None:
+            self.tables[dpid].demote(row)
+
+    def kick(self, dpid, key):
+        row = self._table(dpid).index.get(key)
+        if row is not None:
+            self.tables[dpid].kick(row)
+
+    def release(self, dpid, key):
+        row = self._table(dpid).index.get(key)
+        if row is not None:
+            self.tables[dpid].release(row)
+
+    def remove(self, dpid, key):
+        row = self._table(dpid).index.get(key)
+        if row is not None:
+            self.tables[dpid].remove([row])
+
+    def top(self, dpid, n, in_port):
+        ranking = self.rankings.get(dpid)
+        if ranking is None:
+            return []
+        return [(flow.label, rate) for flow, rate in ranking.top(n, in_port)]
+
+    def history(self, dpid, labels, start, end, resolution):
+        history = self.histories.get(dpid)
+        if history is None:
+            return {}
+        return history.query(labels, start, end, resolution)
+
+    def drop(self, dpid):
+        """ Forgets a switch that disconnected. """
+        self.tables.pop(dpid, None)
+        self.rankings.pop(dpid, None)
+        self._reply_rows.pop(dpid, None)
+        history = self.histories.pop(dpid, None)
+        if history is not None:
+            history.close()
+
+
+def _serve(connection, counters, new_estimator, label, history_bytes,
+           policy):
+    """ A worker's main loop: runs calls on its ShardEngine until closed. """
+    engine = ShardEngine(new_estimator, label, MemoryBudget(history_bytes),
+                         counters, policy)
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, IOError):
+            return
+        if message is None:
+            return
+        call_id, method, args = message
+        start = time.time()
+        try:
+            result = getattr(engine, method)(*args)
+        except Exception as e:
+            result = WorkerError("%s failed: %s" % (method, e))
+        counters[2] += time.time() - start
+        if call_id is not None:
+            connection.send((call_id, result))
+
+
+class StatsWorkerPool(object):
+    """
+    Worker processes that each own the flow stats of a shard of switches,
+    picked by dpid.
+
+    send() queues a call on a switch's worker and hands the result to
+    a callback through post(), which must run it on the POX thread;
+    core.callLater does. Calls to one worker run in the order they were
+    sent. call() is for other threads, and waits for the result.
+
+    The history budget is split evenly between the workers. Each
+    worker's WORKER_COUNTERS live in shared memory, so reading
+    them never waits on a worker.
+    """
+
+    def __init__(self, workers, new_estimator, label, history_bytes, post,
+                 policy=None):
+        self.post = post
+        self._ids = count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._workers = []
+        for i in range(workers):
+            connection, child = multiprocessing.Pipe()
+            counters = multiprocessing.RawArray('d', len(WORKER_COUNTERS))
+            process = multiprocessing.Process(
+                target=_serve, name="stats-worker-%d" % (i,),
+                args=(child, counters, new_estimator, label,
+                      history_bytes // workers, policy))
+            process.daemon = True
+            process.start()
+            child.close()
+            reader = threading.Thread(target=self._read, args=(connection,))
+            reader.daemon = True
+            reader.start()
+            self._workers.append((connection, counters, process,
+                                  threading.Lock()))
+
+    def __len__(self):
+        return len(self._workers)
+
+    def _read(self, connection):
+        while True:
+            try:
+                call_id, result = connection.recv()
+            except (EOFError, IOError):
+                return
+            with self._lock:
+                callback = self._pending.pop(call_id, None)
+                self._idle.notify_all()
+            if callback is not None:
+                callback(result)
+
+    def _call(self, dpid, method, args, callback):
+        connection, counters, process, lock = \
+            self._workers[dpid % len(self._workers)]
+        call_id = None
+        if callback is not None:
+            call_id = next(self._ids)
+            with self._lock:
+                self._pending[call_id] = callback
+        with lock:
+            connection.send((call_id, method, (dpid,) + tuple(args)))
+
+    def send(self, dpid, method, args=(), callback=None):
+        """ Queues a call; callback(result) is posted when it is done. """
+        if callback is None:
+            self._call(dpid, method, args, None)
+        else:
+            self._call(dpid, method, args,
+                       lambda result: self.post(callback, result))
+
+    def call(self, dpid, method, *args):
+        """ Runs a call and returns its result. Not for the POX thread. """
+        done = threading.Event()
+        results = []
+
+        def finish(result):
+            results.append(result)
+            done.set()
+        self._call(dpid, method, args, finish)
+        if not done.wait(CALL_TIMEOUT_SECS) or \
+                isinstance(results[0], WorkerError):
+            raise WorkerError(results[0] if results else
+                              "%s timed out" % (method,))
+        return results[0]
+
+    def wait(self, timeout=None):
+        """ Waits until every call sent has been answered. """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def counters(self):
+        """ Returns {counter: [value per worker]}. """
+        return dict((name, [counters[i] for _, counters, _, _ in
+                            self._workers])
+                    for i, name in enumerate(WORKER_COUNTERS))
+
+    def close(self):
+        for connection, counters, process, lock in self._workers:
+            with lock:
+                connection.send(None)
+        for connection, counters, process, lock in self._workers:
+            process.join(CALL_TIMEOUT_SECS)
+
+
+class RemoteRanking(object):
+    """
+    A worker's ranking of one switch's flows, for BandwidthFeed.
+
+    The dashboard's top flows come along with each reply's result; any
+    other query asks the worker for its latest ranking.
+    """
+
+    class Flow(object):
+        __slots__ = ('label',)
+
+        def __init__(self, label):
+            self.label = label
+
+    def __init__(self, pool, dpid, top, total, size):
+        self.pool = pool
+        self.dpid = dpid
+        self._top = [(RemoteRanking.Flow(label), rate) for label, rate in top]
+        self.total = total
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def top(self, n, in_port=None):
+        if in_port is None and (n <= len(self._top) or
+                                len(self._top) == self._size):
+            return self._top[:n]
+        return [(RemoteRanking.Flow(label), rate) for label, rate in
+                self.pool.call(self.dpid, 'top', n, in_port)]
+
+
+class RemoteHistory(object):
+    """ A worker's TimeSeriesStore for one switch, for the web API. """
+
+    resolutions = ['raw'] + [name for name, width, length in ROLLUPS]
+
+    def __init__(self, pool, dpid):
+        self.pool = pool
+        self.dpid = dpid
+
+    def query(self, labels, start, end, resolution):
+        return self.pool.call(self.dpid, 'history', labels, start, end,
+                              resolution)
+
+    def close(self):
+        self.pool.send(self.dpid, 'drop')